@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+Compare loading the gallery from the thumbnail files (one JPEG per
+picture) and from the thumbnail atlas
+
+    python benchmarkAtlas.py --count 5000 --dir /media/sdcard/booth --drop-caches
+
+Both start cold with --drop-caches (Linux, as root), like the booth after a
+restart. "load" creates the icons of all pictures as the gallery does,
+"screen" paints the first few of them (what is shown right away) and
+"scroll" paints all of them (scrolling through the whole gallery).
+"""
+
+import os
+import sys
+import time
+import shutil
+import random
+import argparse
+import tempfile
+
+from PyQt4.QtCore import QSize
+from PyQt4.QtGui import QApplication, QIcon, QImage, QColor
+
+from thumbnailAtlas import ThumbnailAtlas
+
+# the icons in the list
+ICON_SIZE = QSize(170, 130)
+
+
+def createThumbnails(folder, count):
+    """ Thumbnails like the ones of the booth, packed into an atlas as well. """
+    names = ["img_{0:05d}.jpg".format(i) for i in range(count)]
+    atlas = ThumbnailAtlas(folder)
+    image = QImage(200, 150, QImage.Format_RGB32)
+    for name in names:
+        # some noise, so they compress like photos rather than like a color
+        image.fill(QColor(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)).rgb())
+        for i in range(200):
+            image.setPixel(random.randint(0, 199), random.randint(0, 149), random.randint(0, 0xffffff))
+        image.save(os.path.join(folder, name), "JPEG", 80)
+        atlas.add(name, image)
+    atlas.close()
+    return names
+
+
+def dropCaches():
+    """ Read everything from the disk again; False if not allowed. """
+    os.system("sync")
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def loadFiles(folder, names):
+    icons = []
+    for name in names:
+        thumbnailFile = os.path.join(folder, name)
+        if os.path.isfile(thumbnailFile):
+            icons.append(QIcon(thumbnailFile))
+    return icons, None
+
+
+def loadAtlas(folder, names):
+    atlas = ThumbnailAtlas(folder)
+    return [atlas.icon(name) for name in names], atlas
+
+
+def paint(icons):
+    for icon in icons:
+        icon.pixmap(ICON_SIZE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the thumbnail atlas.")
+    parser.add_argument("--dir", default=".", help="where to write the test thumbnails (default: .)")
+    parser.add_argument("-n", "--count", type=int, default=5000, help="number of pictures")
+    parser.add_argument("--visible", type=int, default=8, help="icons shown right away")
+    parser.add_argument("--drop-caches", action="store_true", help="empty the page cache before each method")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    folder = tempfile.mkdtemp(prefix="benchmarkAtlas_", dir=args.dir)
+    try:
+        names = createThumbnails(folder, args.count)
+        print "{0:<8} {1:>9} {2:>9} {3:>9}".format("method", "load s", "screen s", "scroll s")
+        for name, load in [("files", loadFiles), ("atlas", loadAtlas)]:
+            if args.drop_caches and not dropCaches():
+                print "cannot drop the caches (root needed), the numbers are warm"
+                args.drop_caches = False
+            start = time.time()
+            icons, atlas = load(folder, names)
+            loaded = time.time()
+            paint(icons[:args.visible])
+            shown = time.time()
+            paint(icons[args.visible:])
+            scrolled = time.time()
+            if atlas is not None:
+                atlas.close()
+            print "{0:<8} {1:>9.3f} {2:>9.3f} {3:>9.3f}".format(
+                name, loaded - start, shown - start, scrolled - start)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
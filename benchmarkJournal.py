@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Compare the throughput of writing pictures directly (as before), directly
+with an fsync per file, and through the capture journal with grouped syncs
+
+    python benchmarkJournal.py --dir /media/sdcard/booth --count 200 --size 3000
+
+Run it on the storage the booth writes to; the differences are largest on
+slow SD cards and USB sticks. Only the journal and the fsync variant are
+actually on disk when they finish.
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from captureJournal import CaptureJournal, fsyncPath
+
+
+def writeDirect(folder, names, data, sync=False):
+    for name in names:
+        filePath = os.path.join(folder, name)
+        with open(filePath, 'wb') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+    if sync:
+        fsyncPath(folder)
+
+
+def writeJournal(folder, names, data):
+    journal = CaptureJournal()
+    journal.open(os.path.join(folder, "capture.journal"))
+    for name in names:
+        journal.writeFile(os.path.join(folder, name), data)
+    # stop() waits for the last sync, so everything is durable afterwards
+    journal.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the capture journal.")
+    parser.add_argument("--dir", default=".", help="where to write the test files (default: .)")
+    parser.add_argument("-n", "--count", type=int, default=100, help="files per method")
+    parser.add_argument("-s", "--size", type=int, default=3000, help="file size in KB")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024)
+    methods = [
+        ("direct", lambda folder, names: writeDirect(folder, names, data)),
+        ("direct+fsync", lambda folder, names: writeDirect(folder, names, data, sync=True)),
+        ("journal", lambda folder, names: writeJournal(folder, names, data))
+    ]
+
+    print "{0:<14} {1:>9} {2:>9} {3:>9}".format("method", "seconds", "files/s", "MB/s")
+    for name, method in methods:
+        folder = tempfile.mkdtemp(prefix="benchmarkJournal_", dir=args.dir)
+        names = ["img_{0:05d}.jpg".format(i) for i in range(args.count)]
+        try:
+            start = time.time()
+            method(folder, names)
+            seconds = time.time() - start
+        finally:
+            shutil.rmtree(folder)
+        print "{0:<14} {1:>9.2f} {2:>9.1f} {3:>9.1f}".format(
+            name, seconds, args.count / seconds, args.count * args.size / 1024.0 / seconds)
+
+
+if __name__ == "__main__":
+    main()
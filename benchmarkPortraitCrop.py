@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Compare the time and peak memory of the portrait crop, decoding the whole
+raw picture (as before) versus decoding only the crop area
+
+    python benchmarkPortraitCrop.py pictures_raw/2016-09-03_20-15-00.jpg
+
+Each method runs in its own process so the peak memory is not shared.
+"""
+
+import sys
+import time
+import resource
+import argparse
+import multiprocessing
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from pyPortaitBooth import CropFrame, decodeCropArea
+
+
+def peakMemoryMB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024.0**2
+    return peak / 1024.0
+
+
+def cropFull(rawFilePath, cropFrame):
+    """ The old way: decode everything, then copy the crop area out. """
+    rawPicture = QImage(rawFilePath)
+    cropFrame.setBaseImageSize(rawPicture.size())
+    picture = rawPicture.copy(cropFrame.getCropArea())
+
+    canvasImage = QImage(int(cropFrame.getCanvasWidth()), int(cropFrame.getCanvasHeight()), QImage.Format_RGB32)
+    canvasImage.fill(Qt.white)
+    canvas = QPainter()
+    canvas.begin(canvasImage)
+    target = QRectF(0, 0, cropFrame.getCroppedWidth(), cropFrame.getCroppedHeight())
+    canvas.drawImage(target, picture)
+    canvas.end()
+    return canvasImage
+
+
+def cropRegion(rawFilePath, cropFrame):
+    """ The new way: decode only the crop area, already in its final size. """
+    picture = decodeCropArea(rawFilePath, cropFrame)
+
+    canvasImage = QImage(int(cropFrame.getCanvasWidth()), int(cropFrame.getCanvasHeight()), QImage.Format_RGB32)
+    canvasImage.fill(Qt.white)
+    canvas = QPainter()
+    canvas.begin(canvasImage)
+    canvas.drawImage(QPoint(0, 0), picture)
+    canvas.end()
+    return canvasImage
+
+
+def runMethod(method, rawFilePath, repeat, results):
+    app = QCoreApplication([])
+    baseline = peakMemoryMB()
+    durations = []
+    for i in range(repeat):
+        start = time.time()
+        method(rawFilePath, CropFrame())
+        durations.append(time.time() - start)
+    results.put((min(durations), sum(durations) / len(durations), peakMemoryMB() - baseline))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the portrait crop.")
+    parser.add_argument("picture", help="a raw picture as taken by the camera")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print "{0:<14} {1:>9} {2:>9} {3:>14}".format("method", "min ms", "avg ms", "peak +MB")
+    for name, method in [("full decode", cropFull), ("crop area", cropRegion)]:
+        results = multiprocessing.Queue()
+        p = multiprocessing.Process(target=runMethod, args=(method, args.picture, args.repeat, results))
+        p.start()
+        fastest, average, peak = results.get()
+        p.join()
+        print "{0:<14} {1:>9.1f} {2:>9.1f} {3:>14.1f}".format(name, fastest*1000, average*1000, peak)
+
+
+if __name__ == "__main__":
+    main()
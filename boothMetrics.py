@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Latency histograms for the stages of the capture-to-print path. The
+# numbers are exported in Prometheus text format over a small local HTTP
+# server and written periodically to a rotating JSON log.
+
+import os
+import time
+import json
+import bisect
+import socket
+import threading
+import functools
+import contextlib
+import logging, logging.handlers
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+# upper bounds of the histogram buckets (in seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# how often the JSON log gets a new snapshot (in seconds)
+JSON_LOG_INTERVAL = 60
+JSON_LOG_MAX_BYTES = 1024*1024
+JSON_LOG_BACKUPS = 5
+
+
+class LatencyHistogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        """ Sort a single measurement into its bucket. """
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            self.last = seconds
+            if seconds > self.maximum:
+                self.maximum = seconds
+
+    def quantile(self, q):
+        """ Estimate a quantile by interpolating inside the buckets. """
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            maximum = self.maximum
+        if count == 0:
+            return 0.0
+
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if cumulative + n >= rank and n > 0:
+                lower = self.buckets[i-1] if i > 0 else 0.0
+                upper = min(self.buckets[i], maximum) if i < len(self.buckets) else maximum
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return maximum
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count":   self.count,
+                "sum":     self.total,
+                "max":     self.maximum,
+                "last":    self.last,
+                "buckets": list(self.counts)
+            }
+
+
+class BoothMetrics():
+    def __init__(self, prefix="photobooth"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.server = None
+        self.logger = None
+        self.stopEvent = threading.Event()
+        self.logThread = None
+
+    def histogram(self, stage):
+        """ Get the histogram of a stage, create it on first use. """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        return histogram
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """ Measure the time spent inside a with-block. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time() - start)
+
+    def timed(self, stage):
+        """ Decorator measuring each call of a function. """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(stage, time.time() - start)
+            return wrapper
+        return decorator
+
+
+    def prometheusText(self):
+        """ Render all histograms in the Prometheus text exposition format. """
+        name = self.prefix + "_stage_seconds"
+        lines = [
+            "# HELP {0} Time spent in the stages of the booth.".format(name),
+            "# TYPE {0} histogram".format(name)
+        ]
+        for stage in sorted(self.histograms.keys()):
+            histogram = self.histograms[stage]
+            snapshot = histogram.snapshot()
+            cumulative = 0
+            for bound, n in zip(histogram.buckets, snapshot['buckets']):
+                cumulative += n
+                lines.append('{0}_bucket{{stage="{1}",le="{2}"}} {3}'.format(name, stage, bound, cumulative))
+            lines.append('{0}_bucket{{stage="{1}",le="+Inf"}} {2}'.format(name, stage, snapshot['count']))
+            lines.append('{0}_sum{{stage="{1}"}} {2:.6f}'.format(name, stage, snapshot['sum']))
+            lines.append('{0}_count{{stage="{1}"}} {2}'.format(name, stage, snapshot['count']))
+        return "\n".join(lines) + "\n"
+
+    def summaryLines(self):
+        """ Short per-stage summary (in ms) for the on-screen overlay. """
+        lines = ["{0:<22} {1:>6} {2:>7} {3:>7} {4:>7}".format("stage", "n", "p50", "p95", "max")]
+        for stage in sorted(self.histograms.keys()):
+            histogram = self.histograms[stage]
+            lines.append("{0:<22} {1:>6} {2:>7.1f} {3:>7.1f} {4:>7.1f}".format(
+                stage[:22], histogram.count,
+                histogram.quantile(0.5)*1000, histogram.quantile(0.95)*1000,
+                histogram.maximum*1000
+            ))
+        return lines
+
+
+    def startServer(self, port, host="127.0.0.1"):
+        """ Serve the metrics at http://host:port/metrics in a background thread. """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheusText()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except socket.error as e:
+            print "metrics endpoint not available on port {0}: {1}".format(port, e)
+            return False
+
+        thread = threading.Thread(target=self.server.serve_forever, name="metricsServer")
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def startJsonLog(self, logPath, interval=JSON_LOG_INTERVAL):
+        """ Append a JSON snapshot of all histograms to a rotating log file. """
+        logDir = os.path.dirname(logPath)
+        if logDir and not os.path.exists(logDir):
+            os.makedirs(logDir)
+
+        handler = logging.handlers.RotatingFileHandler(
+            logPath, maxBytes=JSON_LOG_MAX_BYTES, backupCount=JSON_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger = logging.getLogger(self.prefix + ".metrics")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(handler)
+
+        def writeSnapshots():
+            while not self.stopEvent.wait(interval):
+                self.writeSnapshot()
+
+        self.logThread = threading.Thread(target=writeSnapshots, name="metricsLog")
+        self.logThread.daemon = True
+        self.logThread.start()
+
+    def stop(self):
+        """ Write a last snapshot and shut down the background threads. """
+        self.stopEvent.set()
+        if self.logThread is not None:
+            self.logThread.join(1.0)
+        self.writeSnapshot()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+    def writeSnapshot(self):
+        if self.logger is None:
+            return
+        stages = dict((s, h.snapshot()) for s, h in self.histograms.items())
+        self.logger.info(json.dumps({
+            "time":    time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "buckets": LATENCY_BUCKETS,
+            "stages":  stages
+        }, sort_keys=True))
+
+
+# the one instance shared by the whole booth
+METRICS = BoothMetrics()
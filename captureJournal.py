@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Crash-safe writing of the pictures. Every file is written to a temporary
+# name and renamed when complete, so no other part of the booth ever sees
+# half a picture. An append-only journal records each file when it starts
+# and once it is on disk; the expensive syncs are grouped (one syncfs per
+# file system every SYNC_INTERVAL seconds instead of an fsync per file).
+# At startup, recover() removes stale temporary files, moves pictures cut
+# short by a crash out of the way and reports captures that never finished.
+
+import os
+import time
+import ctypes
+import ctypes.util
+import threading
+
+from boothMetrics import METRICS
+
+JOURNAL_PATH = "logs/capture.journal"
+
+# seconds between two syncs, or earlier once SYNC_BATCH files are waiting
+SYNC_INTERVAL = 1.0
+SYNC_BATCH = 16
+
+TEMP_SUFFIX = ".tmp"
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _syncfs = _libc.syncfs
+except (OSError, AttributeError):
+    _syncfs = None
+
+
+def fsyncPath(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def syncFileSystem(path):
+    """ Flush the whole file system holding path; False if syncfs is not available. """
+    if _syncfs is None:
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return _syncfs(fd) == 0
+    finally:
+        os.close(fd)
+
+
+def isCompleteJpeg(filePath):
+    """ A JPEG starts with the SOI marker and ends with EOI (maybe followed by padding). """
+    try:
+        with open(filePath, 'rb') as f:
+            if f.read(2) != '\xff\xd8':
+                return False
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 64, 2))
+            return '\xff\xd9' in f.read()
+    except IOError:
+        return False
+
+
+class CaptureJournal():
+    def __init__(self):
+        self.journalPath = None
+        self.journal = None
+        self.lock = threading.Lock()
+        self.pending = []
+        self.syncThread = None
+        # the staging area in RAM, if any (see stagingStore)
+        self.staging = None
+        self.wakeEvent = threading.Event()
+        self.stopEvent = threading.Event()
+
+    def open(self, journalPath=JOURNAL_PATH, syncInterval=SYNC_INTERVAL):
+        """ Start journaling; the records of the last run stay until recover(). """
+        self.journalPath = journalPath
+        folder = os.path.dirname(journalPath)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.journal = open(journalPath, 'a')
+
+        self.syncInterval = syncInterval
+        self.syncThread = threading.Thread(target=self.syncLoop, name="captureJournal")
+        self.syncThread.daemon = True
+        self.syncThread.start()
+
+    def record(self, kind, filePath):
+        if self.journal is None:
+            return
+        with self.lock:
+            self.journal.write("{0} {1:.3f} {2}\n".format(kind, time.time(), filePath))
+            self.journal.flush()
+
+    def begin(self, filePath):
+        """ Note that a capture for this file started (to resume it after a crash). """
+        self.record('begin', filePath)
+
+    def abort(self, filePath):
+        """ A capture was given up, there is nothing to resume. """
+        self.record('done', filePath)
+
+    def tempPath(self, filePath):
+        """ Where to write a file before commitFile() moves it to filePath. """
+        if self.staging is not None and self.staging.isActive():
+            return self.staging.tempPath(filePath)
+        return filePath + TEMP_SUFFIX
+
+    def writeFile(self, filePath, data):
+        with open(self.tempPath(filePath), 'wb') as f:
+            f.write(data)
+        self.commitFile(filePath)
+
+    def commitFile(self, filePath):
+        """ Move a completely written temporary file to its final path. """
+        self.record('begin', filePath)
+        if self.staging is not None and self.staging.commit(filePath):
+            # in RAM for now, committed() once it is flushed
+            return
+        os.rename(filePath + TEMP_SUFFIX, filePath)
+        self.committed(filePath)
+
+    def committed(self, filePath):
+        """ A file is complete at its final path, synced with the next batch. """
+        if self.journal is None:
+            return
+        with self.lock:
+            self.pending.append(filePath)
+            if len(self.pending) >= SYNC_BATCH:
+                self.wakeEvent.set()
+
+    def syncLoop(self):
+        while not self.stopEvent.is_set():
+            self.wakeEvent.wait(self.syncInterval)
+            self.wakeEvent.clear()
+            self.sync()
+
+    def sync(self):
+        """ Make all committed files durable at once and mark them done. """
+        with self.lock:
+            batch = self.pending
+            self.pending = []
+        if not batch:
+            return
+        start = time.time()
+
+        # one syncfs per file system covers all files; fsync each one without it
+        folders = set(os.path.dirname(f) or "." for f in batch if os.path.exists(f))
+        fileSystems = dict((os.stat(folder).st_dev, folder) for folder in folders)
+        synced = True
+        for folder in fileSystems.values():
+            synced = syncFileSystem(folder) and synced
+        if not synced:
+            for f in batch:
+                if os.path.exists(f):
+                    fsyncPath(f)
+        # the renames live in the directories
+        for folder in folders:
+            fsyncPath(folder)
+
+        with self.lock:
+            for f in batch:
+                self.journal.write("done {0:.3f} {1}\n".format(time.time(), f))
+            self.journal.write("sync {0:.3f} -\n".format(time.time()))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        METRICS.observe('journalSync', time.time() - start)
+
+    def readRecords(self):
+        """ Files begun but not done, and the time of the last complete sync. """
+        begun = {}
+        lastSync = None
+        if not os.path.isfile(self.journalPath):
+            return begun, lastSync
+        with open(self.journalPath) as f:
+            for line in f:
+                parts = line.rstrip("\n").split(" ", 2)
+                if len(parts) != 3:
+                    # a record cut short by the crash
+                    continue
+                kind, stamp, filePath = parts
+                if kind == 'begin':
+                    begun[filePath] = float(stamp)
+                elif kind == 'done':
+                    begun.pop(filePath, None)
+                elif kind == 'sync':
+                    lastSync = float(stamp)
+        return begun, lastSync
+
+    def recover(self, folders, quarantinePath):
+        """ Clean up after a crash; returns the captures that never finished. """
+        begun, lastSync = self.readRecords()
+
+        # temporary files were never complete, also in subfolders (series)
+        files = []
+        for folder in folders:
+            for path, dirs, names in os.walk(folder):
+                for name in names:
+                    filePath = os.path.join(path, name)
+                    if name.endswith(TEMP_SUFFIX):
+                        print "removing unfinished '{0}'".format(filePath)
+                        os.remove(filePath)
+                    else:
+                        files.append(filePath)
+
+        # check everything not known to be on disk: begun files and files
+        # changed since the last sync (in case their record got lost)
+        suspects = set(f for f in begun if os.path.isfile(f))
+        if lastSync is not None:
+            for f in files:
+                if f.endswith(".jpg") and os.path.getmtime(f) >= lastSync:
+                    suspects.add(f)
+
+        for f in sorted(suspects):
+            if f.endswith(".jpg") and not isCompleteJpeg(f):
+                # the folder in the name: series pictures share their file names
+                target = os.path.join(quarantinePath, os.path.normpath(f).replace(os.sep, "_"))
+                base, extension = os.path.splitext(target)
+                number = 1
+                while os.path.exists(target):
+                    target = "{0}_{1}{2}".format(base, number, extension)
+                    number += 1
+                print "moving damaged '{0}' to '{1}'".format(f, target)
+                os.rename(f, target)
+        unfinished = sorted(f for f in begun if not os.path.isfile(f))
+
+        # start the new journal with everything settled
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+            self.journal = open(self.journalPath, 'w')
+            self.journal.write("sync {0:.3f} -\n".format(time.time()))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        return unfinished
+
+    def stop(self):
+        """ Sync whatever is still pending and close the journal. """
+        if self.staging is not None:
+            self.staging.stop()
+        if self.syncThread is None:
+            return
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        self.syncThread.join()
+        self.syncThread = None
+        self.sync()
+        with self.lock:
+            self.journal.close()
+            self.journal = None
+
+
+JOURNAL = CaptureJournal()
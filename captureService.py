@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# The camera in its own process. The capture process is this script in a
+# separate interpreter (not forked from the booth); it owns the webcam or the
+# DSLR and publishes the preview frames into a ring of slots in a file in
+# shared memory (/dev/shm) the booth created and both map. Each slot has a
+# sequence number (set to -1 while the slot is written, like a seqlock). The
+# booth copies the newest frame out of shared memory and checks the sequence
+# number afterwards, a frame overwritten meanwhile is dropped; reading never
+# waits, without a new frame the last one is shown again. Stills are
+# requested on stdin and answered on stdout. A watchdog restarts the process
+# if it dies or stops delivering frames, e.g. when libgphoto2 hangs.
+#
+# RingVideoCapture and RingCamera stand in for cv2.VideoCapture and
+# piggyphoto.Camera, so the booths need no other changes.
+
+import os
+import sys
+import glob
+import json
+import time
+import Queue
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+import cv2
+
+from boothMetrics import METRICS
+from gphotoCamera import Preview
+
+# slots in the ring; a frame stays valid until RING_SLOTS-1 newer ones arrived
+RING_SLOTS = 4
+SLOT_SIZE = 1920*1080*3
+
+# the capture process pauses when nobody read a frame for this many seconds
+IDLE_AFTER = 1.0
+
+# restart the capture process after this many seconds without a new frame
+HANG_TIMEOUT = 5.0
+WATCH_INTERVAL = 0.5
+STILL_TIMEOUT = 30.0
+
+# the ring, in RAM if there is a tmpfs
+RING_FOLDER = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# the start of the ring: newest sequence number and time the booth last read
+C_LATEST, C_LAST_READ = range(2)
+CONTROL_FIELDS = 2
+
+# the header of each slot
+H_SEQ, H_KIND, H_SIZE, H_WIDTH, H_HEIGHT, H_TIME = range(6)
+HEADER_FIELDS = 6
+KIND_BGR, KIND_JPEG = 1, 2
+
+
+def removeStaleRings():
+    """ Rings left by a booth that crashed. """
+    for ringPath in glob.glob(os.path.join(RING_FOLDER, "captureRing_*_*")):
+        try:
+            os.kill(int(os.path.basename(ringPath).split("_")[1]), 0)
+        except ValueError:
+            continue
+        except OSError:
+            os.remove(ringPath)
+
+
+class Frame():
+    def __init__(self, seq, kind, data, timestamp):
+        self.seq = seq
+        self.kind = kind
+        self.data = data
+        self.timestamp = timestamp
+
+
+class FrameRing():
+    """ Shared memory slots written by the capture process and read by the booth. """
+    def __init__(self, ringPath, slots=RING_SLOTS, slotSize=SLOT_SIZE, create=False):
+        self.ringPath = ringPath
+        self.slots = slots
+        self.slotSize = slotSize
+        # doubles hold the integer fields exactly and the time stamps
+        mode = 'w+' if create else 'r+'
+        self.control = np.memmap(ringPath, np.float64, mode, shape=(CONTROL_FIELDS,))
+        self.headers = np.memmap(ringPath, np.float64, 'r+', offset=self.control.nbytes,
+                                 shape=(slots, HEADER_FIELDS))
+        self.buffer = np.memmap(ringPath, np.uint8, 'r+', offset=self.control.nbytes + self.headers.nbytes,
+                                shape=(slots * slotSize,))
+        if create:
+            self.control[C_LATEST] = -1
+            self.control[C_LAST_READ] = time.time()
+
+    def latest(self):
+        return int(self.control[C_LATEST])
+
+    def lastRead(self):
+        return self.control[C_LAST_READ]
+
+    def markRead(self):
+        self.control[C_LAST_READ] = time.time()
+
+    def publish(self, kind, data, width=0, height=0):
+        """ Copy a frame (BGR array or JPEG string) into the next slot. """
+        buffer, headers = self.buffer, self.headers
+        if kind == KIND_BGR:
+            data = data.reshape(-1)
+        else:
+            data = np.frombuffer(data, np.uint8)
+        if data.size > self.slotSize:
+            print "frame of {0} bytes does not fit into the ring".format(data.size)
+            return
+
+        seq = self.latest() + 1
+        slot = seq % self.slots
+        header = headers[slot]
+        header[H_SEQ] = -1
+        start = slot * self.slotSize
+        buffer[start:start + data.size] = data
+        header[H_KIND] = kind
+        header[H_SIZE] = data.size
+        header[H_WIDTH] = width
+        header[H_HEIGHT] = height
+        header[H_TIME] = time.time()
+        header[H_SEQ] = seq
+        self.control[C_LATEST] = seq
+
+    def read(self):
+        """ A copy of the newest frame, None if there is none or it was overwritten. """
+        seq = self.latest()
+        if seq < 0:
+            return None
+        buffer, headers = self.buffer, self.headers
+        header = headers[seq % self.slots]
+        if header[H_SEQ] != seq:
+            return None
+        kind, size, timestamp = int(header[H_KIND]), int(header[H_SIZE]), header[H_TIME]
+        start = (seq % self.slots) * self.slotSize
+        if kind == KIND_BGR:
+            data = buffer[start:start + size].copy().reshape(int(header[H_HEIGHT]), int(header[H_WIDTH]), 3)
+        else:
+            data = buffer[start:start + size].tostring()
+        # the slot was overwritten while copying it
+        if header[H_SEQ] != seq:
+            return None
+        return Frame(seq, kind, data, timestamp)
+
+    def close(self):
+        self.control = self.headers = self.buffer = None
+
+
+def readCommands(stream):
+    """ A queue of the JSON lines read from stream, None at its end. """
+    commands = Queue.Queue()
+    def read():
+        for line in iter(stream.readline, ""):
+            commands.put(json.loads(line))
+        commands.put(None)
+    thread = threading.Thread(target=read, name="captureCommands")
+    thread.daemon = True
+    thread.start()
+    return commands
+
+
+def serviceMain(device, ringPath, slots, slotSize, interval):
+    """ The capture process: own the device, fill the ring, take stills on request. """
+    ring = FrameRing(ringPath, slots, slotSize)
+    commands = readCommands(sys.stdin)
+    # stdout only carries the replies, everything else printed goes to stderr
+    replies = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def reply(message):
+        replies.write(json.dumps(message) + "\n")
+        replies.flush()
+
+    def waitForCommand(timeout):
+        """ The next command, None once the booth closed stdin, False if there was none. """
+        try:
+            return commands.get(timeout=timeout)
+        except Queue.Empty:
+            return False
+
+    if device == 'webcam':
+        capture = cv2.VideoCapture(0)
+    else:
+        sys.path.append('piggyphoto/')
+        import piggyphoto
+        camera = piggyphoto.Camera()
+        camera.leave_locked()
+
+    command = False
+    while True:
+        if command is False:
+            command = waitForCommand(0)
+        if command is None:
+            # the booth stops the service or quit
+            break
+        elif command is not False:
+            if command[0] == 'still':
+                try:
+                    if device == 'webcam':
+                        raise IOError("the webcam takes stills from the ring")
+                    camera.capture_image(command[1])
+                    reply(['still', None])
+                except Exception as e:
+                    reply(['still', str(e)])
+            command = False
+            continue
+
+        # nobody is looking, don't keep the device busy
+        if time.time() - ring.lastRead() > IDLE_AFTER:
+            command = waitForCommand(0.1)
+            continue
+
+        start = time.time()
+        if device == 'webcam':
+            ok, frame = capture.read()
+            if ok:
+                ring.publish(KIND_BGR, frame, frame.shape[1], frame.shape[0])
+        else:
+            preview = camera.capture_preview()
+            ring.publish(KIND_JPEG, preview.to_pixbuf())
+            preview.clean()
+        # wait for the next frame, but answer commands right away
+        command = waitForCommand(max(interval - (time.time() - start), 0))
+
+    if device == 'webcam':
+        capture.release()
+    ring.close()
+
+
+class CaptureService():
+    def __init__(self, device, interval=0.0, slots=RING_SLOTS, slotSize=SLOT_SIZE):
+        self.device = device
+        self.interval = interval
+        removeStaleRings()
+        self.ringPath = os.path.join(RING_FOLDER, "captureRing_{0}_{1}".format(os.getpid(), device))
+        self.ring = FrameRing(self.ringPath, slots, slotSize, create=True)
+        self.process = None
+        self.replies = None
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        self.watchdog = threading.Thread(target=self.watch, name="captureWatchdog")
+        self.watchdog.daemon = True
+
+        # statistics of the transfer
+        self.startTime = time.time()
+        self.lastSeq = -1
+        self.lastFrame = None
+        self.framesRead = 0
+        self.framesSkipped = 0
+        self.restarts = 0
+
+    def start(self):
+        self.startProcess()
+        self.watchdog.start()
+
+    def startProcess(self):
+        # a fresh interpreter: forking the running booth is not safe on macOS
+        script = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        self.process = subprocess.Popen([sys.executable, script, self.device, self.ringPath,
+                                         str(self.ring.slots), str(self.ring.slotSize), str(self.interval)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # replies of this process only, not of one restarted before
+        self.replies = readCommands(self.process.stdout)
+        self.progressSeq = self.ring.latest()
+        self.progressTime = time.time()
+
+    def watch(self):
+        while not self.stopEvent.wait(WATCH_INTERVAL):
+            with self.lock:
+                now = time.time()
+                seq = self.ring.latest()
+                if seq != self.progressSeq:
+                    self.progressSeq = seq
+                    self.progressTime = now
+                reading = now - self.ring.lastRead() < IDLE_AFTER
+                if self.process.poll() is not None:
+                    self.restart("died")
+                elif reading and now - self.progressTime > HANG_TIMEOUT:
+                    self.restart("hangs")
+
+    def restart(self, reason):
+        print "capture process {0}, restarting it".format(reason)
+        if self.process.poll() is None:
+            self.process.terminate()
+        self.process.wait()
+        self.restarts += 1
+        self.startProcess()
+
+    def readFrame(self):
+        """ The newest frame without waiting; the last one if there is no new one. """
+        self.ring.markRead()
+        frame = self.ring.read()
+        if frame is None:
+            # torn, the process restarts or is still starting up
+            return self.lastFrame
+        self.lastFrame = frame
+
+        if frame.seq != self.lastSeq:
+            METRICS.observe('frameTransfer', time.time() - frame.timestamp)
+            if self.lastSeq >= 0 and frame.seq > self.lastSeq:
+                self.framesSkipped += frame.seq - self.lastSeq - 1
+            self.lastSeq = frame.seq
+            self.framesRead += 1
+        return frame
+
+    def still(self, filePath):
+        """ Let the capture process take a picture into filePath. """
+        start = time.time()
+        with self.lock:
+            try:
+                self.process.stdin.write(json.dumps(['still', filePath]) + "\n")
+                self.process.stdin.flush()
+                answer = self.replies.get(timeout=STILL_TIMEOUT)
+            except IOError:
+                raise IOError("the capture process died")
+            except Queue.Empty:
+                raise IOError("no answer from the capture process")
+            if answer is None:
+                raise IOError("the capture process died")
+            reply, error = answer
+            # the preview paused while taking the picture
+            self.progressTime = time.time()
+        METRICS.observe('stillCapture', time.time() - start)
+        if error is not None:
+            raise IOError(error)
+
+    def report(self):
+        elapsed = max(time.time() - self.startTime, 1e-6)
+        return "capture service: {0:.1f} fps published, {1:.1f} fps read, {2} skipped, {3} restarts".format(
+            (self.ring.latest() + 1) / elapsed, self.framesRead / elapsed, self.framesSkipped, self.restarts)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.watchdog.join()
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        deadline = time.time() + 2.0
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        print self.report()
+        self.ring.close()
+        os.remove(self.ringPath)
+
+
+class RingVideoCapture():
+    """ Stands in for cv2.VideoCapture. """
+    def __init__(self, service):
+        self.service = service
+
+    def read(self):
+        frame = self.service.readFrame()
+        if frame is None:
+            return False, None
+        return True, frame.data
+
+    def isOpened(self):
+        return self.service.process.poll() is None
+
+    def release(self):
+        pass
+
+
+class RingCamera():
+    """ Stands in for piggyphoto.Camera. """
+    def __init__(self, service):
+        self.service = service
+
+    def leave_locked(self):
+        pass
+
+    def capture_preview(self):
+        frame = self.service.readFrame()
+        if frame is None:
+            raise IOError("no preview from the capture process")
+        return Preview(frame.data)
+
+    def capture_image(self, destpath):
+        self.service.still(destpath)
+
+
+if __name__ == "__main__":
+    # started by CaptureService: device, ring file, slots, slot size, interval
+    serviceMain(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), float(sys.argv[5]))
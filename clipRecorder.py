@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Short clips from the live view. The frames are scaled into one of two
+# preallocated buffers, files in shared memory (/dev/shm) mapped by the
+# booth and the encoder, so recording allocates nothing and the next clip
+# can be recorded while the last one is still encoded. The encoder is this
+# script in a separate interpreter at low priority (started the first time
+# the clip mode is chosen, not forked from the booth); it gets the jobs on
+# stdin and encodes a buffer into MP4 (cv2) and/or an animated GIF (ffmpeg),
+# optionally as a boomerang (forward + reverse). It reports on stdout.
+
+import os
+import sys
+import glob
+import json
+import time
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+import cv2
+
+from boothMetrics import METRICS
+
+CLIP_SECONDS = 3
+CLIP_FPS = 15
+CLIP_WIDTH = 640
+CLIP_HEIGHT = 432
+CLIP_BUFFERS = 2
+CLIP_NICE = 10
+
+# the frame buffers, in RAM if there is a tmpfs
+BUFFER_FOLDER = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def makeFourcc(code):
+    try:
+        return cv2.VideoWriter_fourcc(*code)
+    except AttributeError:
+        return cv2.cv.CV_FOURCC(*code)
+
+
+def writeMp4(frames, filePath, fps):
+    writer = cv2.VideoWriter(filePath, makeFourcc('mp4v'), fps, (CLIP_WIDTH, CLIP_HEIGHT))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+
+def writeGif(frames, filePath, fps):
+    """ Stream the raw frames into ffmpeg, which builds a palette for the GIF. """
+    command = ["ffmpeg", "-loglevel", "error", "-y",
+               "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "{0}x{1}".format(CLIP_WIDTH, CLIP_HEIGHT),
+               "-r", str(fps), "-i", "-",
+               "-filter_complex", "[0:v]split[a][b];[a]palettegen[p];[b][p]paletteuse",
+               "-loop", "0", filePath]
+    ffmpeg = subprocess.Popen(command, stdin=subprocess.PIPE)
+    for frame in frames:
+        ffmpeg.stdin.write(frame.tostring())
+    ffmpeg.stdin.close()
+    if ffmpeg.wait() != 0:
+        raise IOError("ffmpeg could not write '{0}'".format(filePath))
+
+
+WRITERS = {'mp4': writeMp4, 'gif': writeGif}
+
+
+def mapBuffer(bufferPath, mode, frames=None):
+    """ A buffer file as array of frames. """
+    shape = None if frames is None else (frames, CLIP_HEIGHT, CLIP_WIDTH, 3)
+    view = np.memmap(bufferPath, np.uint8, mode, shape=shape)
+    return view.reshape(-1, CLIP_HEIGHT, CLIP_WIDTH, 3)
+
+
+def removeStaleBuffers():
+    """ Buffers left by a booth that crashed. """
+    for bufferPath in glob.glob(os.path.join(BUFFER_FOLDER, "clipBuffer_*_*")):
+        try:
+            os.kill(int(os.path.basename(bufferPath).split("_")[1]), 0)
+        except ValueError:
+            continue
+        except OSError:
+            os.remove(bufferPath)
+
+
+def encoderMain(bufferPaths):
+    """ The encoder process: turn a recorded buffer into the clip files. """
+    os.nice(CLIP_NICE)
+    views = [mapBuffer(bufferPath, 'r') for bufferPath in bufferPaths]
+    for line in iter(sys.stdin.readline, ""):
+        index, count, fps, basePath, formats, boomerang = json.loads(line)
+        frames = [views[index][i] for i in range(count)]
+        if boomerang:
+            frames = frames + frames[-2:0:-1]
+
+        seconds = {}
+        for extension in formats:
+            start = time.time()
+            try:
+                WRITERS[extension](frames, basePath + "." + extension, fps)
+                seconds[extension] = time.time() - start
+            except Exception as e:
+                print >> sys.stderr, "could not encode the clip '{0}.{1}': {2}".format(basePath, extension, e)
+        sys.stdout.write(json.dumps([index, basePath, seconds]) + "\n")
+        sys.stdout.flush()
+
+
+class ClipRecorder():
+    def __init__(self, formats=('mp4', 'gif'), boomerang=True):
+        self.formats = list(formats)
+        self.boomerang = boomerang
+        self.maxFrames = CLIP_SECONDS * CLIP_FPS
+        self.bufferPaths = []
+        self.views = []
+        self.busy = [False] * CLIP_BUFFERS
+
+        self.recording = False
+        self.current = None
+        self.count = 0
+        self.startTime = 0
+        self.lastFrame = 0
+
+        self.process = None
+        self.listener = None
+
+    def open(self):
+        """ Create the buffers and start the encoder, once. """
+        if self.process is not None:
+            return
+        removeStaleBuffers()
+        self.bufferPaths = [os.path.join(BUFFER_FOLDER, "clipBuffer_{0}_{1}".format(os.getpid(), i))
+                            for i in range(CLIP_BUFFERS)]
+        self.views = [mapBuffer(bufferPath, 'w+', self.maxFrames) for bufferPath in self.bufferPaths]
+        script = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        self.process = subprocess.Popen([sys.executable, script] + self.bufferPaths,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.listener = threading.Thread(target=self.listen, name="clipListener")
+        self.listener.daemon = True
+        self.listener.start()
+
+    def start(self):
+        """ Start recording into a free buffer; False if both are still being encoded. """
+        self.open()
+        for index, busy in enumerate(self.busy):
+            if not busy:
+                self.busy[index] = True
+                self.current = index
+                self.count = 0
+                self.startTime = time.time()
+                self.lastFrame = 0
+                self.recording = True
+                return True
+        return False
+
+    def addFrame(self, frame):
+        """ Scale a live view frame into the buffer; True once the clip is complete. """
+        if not self.recording:
+            return False
+        now = time.time()
+        if now - self.lastFrame >= 1.0 / CLIP_FPS:
+            cv2.resize(frame, (CLIP_WIDTH, CLIP_HEIGHT), self.views[self.current][self.count],
+                       interpolation=cv2.INTER_AREA)
+            self.count += 1
+            self.lastFrame = now
+        return self.count >= self.maxFrames or now - self.startTime >= CLIP_SECONDS
+
+    def posterFrame(self):
+        """ A copy of the middle frame of the clip being recorded. """
+        return self.views[self.current][self.count // 2].copy()
+
+    def finish(self, basePath):
+        """ Stop recording and hand the buffer to the encoder process. """
+        self.recording = False
+        # the live view may have been slower than CLIP_FPS
+        fps = max(self.count / max(time.time() - self.startTime, 1e-6), 1.0)
+        self.views[self.current].flush()
+        job = [self.current, self.count, min(fps, CLIP_FPS), basePath, self.formats, self.boomerang]
+        try:
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+        except IOError as e:
+            print "clip encoder not reachable: {0}".format(e)
+            self.busy[self.current] = False
+
+    def listen(self):
+        for line in iter(self.process.stdout.readline, ""):
+            index, basePath, seconds = json.loads(line)
+            self.busy[index] = False
+            for extension in sorted(seconds):
+                METRICS.observe('clipEncode_' + extension, seconds[extension])
+            print "clip '{0}' encoded ({1})".format(basePath, ", ".join(
+                "{0} {1:.1f} s".format(extension, seconds[extension]) for extension in sorted(seconds)))
+
+    def stop(self):
+        """ Let the encoder finish the pending clips. """
+        self.recording = False
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        self.process.wait()
+        self.listener.join()
+        self.views = []
+        for bufferPath in self.bufferPaths:
+            os.remove(bufferPath)
+
+
+if __name__ == "__main__":
+    # started by ClipRecorder with the paths of the buffers
+    encoderMain(sys.argv[1:])
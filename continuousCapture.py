@@ -1,38 +1,208 @@
 #!/usr/bin/env python
 """
-A script to constantly save images from the webcam
+A script to constantly save images from the webcam (time-lapse)
+
+Frames are taken on a fixed schedule: every deadline is computed from the
+start time, so encoding and writing never make the interval drift. The
+frames are handed through a bounded queue to a pool of JPEG encoders or
+to a single video writer. If the encoders fall behind, frames are dropped
+instead of delaying the capture.
+
+    python continuousCapture.py --interval 0.2 --duration 3600
+    python continuousCapture.py --interval 1 --video timelapse.avi --fps 25
 """
 
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+import Queue
+
 import numpy as np
 import cv2
-import time
 
-cap = cv2.VideoCapture(0)
+# property ids (the names differ between OpenCV 2.4 and 3.x)
+CAP_PROP_FRAME_WIDTH = getattr(cv2, 'CAP_PROP_FRAME_WIDTH', 3)
+CAP_PROP_FRAME_HEIGHT = getattr(cv2, 'CAP_PROP_FRAME_HEIGHT', 4)
+IMWRITE_JPEG_QUALITY = getattr(cv2, 'IMWRITE_JPEG_QUALITY', 1)
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Time-lapse capture from the webcam.")
+    parser.add_argument("-i", "--interval", type=float, default=1.0,
+                        help="seconds between two frames (default: 1)")
+    parser.add_argument("-d", "--duration", type=float, default=0,
+                        help="stop after this many seconds")
+    parser.add_argument("-n", "--frames", type=int, default=0,
+                        help="stop after this many frames")
+    parser.add_argument("--width", type=int, default=0, help="requested frame width")
+    parser.add_argument("--height", type=int, default=0, help="requested frame height")
+    parser.add_argument("--device", type=int, default=0, help="webcam index")
+    parser.add_argument("-o", "--output", default="timelapse/",
+                        help="folder for the JPEG frames (default: timelapse/)")
+    parser.add_argument("-q", "--quality", type=int, default=90, help="JPEG quality")
+    parser.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of JPEG encoder threads")
+    parser.add_argument("--queue", type=int, default=32,
+                        help="frames waiting for the encoders before frames get dropped")
+    parser.add_argument("--video", help="write into this video file instead of JPEGs")
+    parser.add_argument("--fps", type=float, default=25, help="frame rate of the video")
+    parser.add_argument("--fourcc", default="MJPG", help="codec of the video (default: MJPG)")
+    return parser.parse_args()
+
+
+class JpegWorkers():
+    """ Pool of threads encoding and writing frames (cv2 releases the GIL). """
+    def __init__(self, frameQueue, output, quality, count):
+        self.frameQueue = frameQueue
+        self.output = output
+        self.quality = quality
+        self.written = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.work) for i in range(count)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def work(self):
+        while True:
+            item = self.frameQueue.get()
+            if item is None:
+                break
+            imageCount, frame = item
+            ok, data = cv2.imencode(".jpg", frame, [IMWRITE_JPEG_QUALITY, self.quality])
+            filename = os.path.join(self.output, "img_{0:05d}.jpg".format(imageCount))
+            with open(filename, 'wb') as f:
+                f.write(data.tostring())
+            with self.lock:
+                self.written += 1
+
+    def finish(self):
+        for t in self.threads:
+            self.frameQueue.put(None)
+        for t in self.threads:
+            t.join()
+
 
-# we need some initial delay to adjust camera brightness settings
-cap.read()
-time.sleep(1)
+class VideoWorker():
+    """ A single thread appending the frames in order to a video file. """
+    def __init__(self, frameQueue, path, fps, fourcc):
+        self.frameQueue = frameQueue
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+        self.written = 0
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
 
-imageCount = 0
-while(True):
-    # Capture frame-by-frame
-    ret, frame = cap.read()
+    def work(self):
+        while True:
+            item = self.frameQueue.get()
+            if item is None:
+                break
+            imageCount, frame = item
+            if self.writer is None:
+                try:
+                    fourcc = cv2.VideoWriter_fourcc(*self.fourcc)
+                except AttributeError:
+                    fourcc = cv2.cv.CV_FOURCC(*self.fourcc)
+                size = (frame.shape[1], frame.shape[0])
+                self.writer = cv2.VideoWriter(self.path, fourcc, self.fps, size)
+            self.writer.write(frame)
+            self.written += 1
+        if self.writer is not None:
+            self.writer.release()
 
-    # Save the image
-    filename = "img_{0:05d}.jpg".format( imageCount )
-    cv2.imwrite(filename, frame)
-    print "captured image '{0}'".format( filename )
+    def finish(self):
+        self.frameQueue.put(None)
+        self.thread.join()
 
-    # Display the resulting frame
-    # cv2.imshow('frame',frame)
-    # if cv2.waitKey(1) & 0xFF == ord('q'):
-    #     break
 
-    imageCount = imageCount + 1
+def printSummary(startTime, captured, dropped, workers, frameQueue, final=False):
+    elapsed = max(time.time() - startTime, 1e-6)
+    line = "captured {0} ({1:.2f} fps), written {2}, dropped {3}, encoder backlog {4}".format(
+        captured, captured / elapsed, workers.written, dropped, frameQueue.qsize())
+    if final:
+        print "\n" + line
+    else:
+        sys.stdout.write("\r" + line + "   ")
+        sys.stdout.flush()
 
-    # wait a bit
+
+def main():
+    args = parseArguments()
+
+    cap = cv2.VideoCapture(args.device)
+    if args.width:
+        cap.set(CAP_PROP_FRAME_WIDTH, args.width)
+    if args.height:
+        cap.set(CAP_PROP_FRAME_HEIGHT, args.height)
+
+    # we need some initial delay to adjust camera brightness settings
+    cap.read()
     time.sleep(1)
 
-# When everything done, release the capture
-cap.release()
-cv2.destroyAllWindows()
+    frameQueue = Queue.Queue(maxsize=args.queue)
+    if args.video:
+        workers = VideoWorker(frameQueue, args.video, args.fps, args.fourcc)
+    else:
+        if not os.path.exists(args.output):
+            os.makedirs(args.output)
+        workers = JpegWorkers(frameQueue, args.output, args.quality, args.workers)
+
+    imageCount = 0
+    dropped = 0
+    startTime = time.time()
+    deadline = startTime
+    lastSummary = startTime
+    try:
+        while True:
+            if args.frames and imageCount >= args.frames:
+                break
+            if args.duration and deadline - startTime >= args.duration:
+                break
+
+            # wait for the next deadline
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Capture frame-by-frame
+            ret, frame = cap.read()
+            if not ret:
+                print "\ncould not read a frame from the webcam"
+                break
+
+            # hand it to the encoders, drop it if they can't keep up
+            try:
+                frameQueue.put_nowait((imageCount, frame))
+            except Queue.Full:
+                dropped += 1
+            imageCount = imageCount + 1
+
+            # the next deadline is fixed to the start time; skip missed slots
+            deadline += args.interval
+            now = time.time()
+            if now > deadline + args.interval:
+                missed = int((now - deadline) / args.interval)
+                dropped += missed
+                deadline += missed * args.interval
+
+            if now - lastSummary > 1.0:
+                printSummary(startTime, imageCount, dropped, workers, frameQueue)
+                lastSummary = now
+    except KeyboardInterrupt:
+        pass
+
+    # When everything done, release the capture
+    cap.release()
+    workers.finish()
+    printSummary(startTime, imageCount, dropped, workers, frameQueue, final=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Archiving of an event while the booth keeps running. The output folders
+# are renamed into archive/<event>/ (instant on the same file system) and
+# recreated empty; a background thread then packs the event into a zip
+# file with a sha256 index, reading at a limited rate so the live view is
+# not disturbed, and removes the folder once both are written (unless
+# ARCHIVE_KEEP_FOLDERS). Packing interrupted by quitting the booth leaves a
+# <event>.zip.tmp; such events are packed again at the next start. On the
+# command line it replaces moveImages.sh:
+#
+#     python eventArchive.py ARCHIVE_DIR
+
+import os
+import sys
+import time
+import json
+import shutil
+import zipfile
+import hashlib
+import threading
+
+ARCHIVE_PATH = "archive/"
+
+# the folders of both booths
+ARCHIVE_FOLDERS = ["clips/", "deleted/", "pictures/", "pictures_raw/", "prints/", "series/", "thumbnails/"]
+
+# read rate of the background packing
+ARCHIVE_READ_MB_PER_S = 20
+
+# keep archive/<event>/ next to the packed zip file
+ARCHIVE_KEEP_FOLDERS = False
+READ_BLOCK = 256*1024
+
+# JPEGs don't get smaller by deflating them
+STORED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.zip', '.pdf']
+
+
+def getEventName():
+    return time.strftime("%Y-%m-%d_%H-%M-%S")
+
+
+def rotateFolders(folders, eventDir):
+    """ Move the folders into the event directory and recreate them empty. """
+    if os.path.exists(eventDir):
+        raise OSError("archive directory '{0}' already exists".format(eventDir))
+    os.makedirs(eventDir)
+    for folder in folders:
+        folder = folder.rstrip("/")
+        if not os.path.isdir(folder):
+            continue
+        target = os.path.join(eventDir, os.path.basename(folder))
+        try:
+            os.rename(folder, target)
+        except OSError:
+            # another file system, copy it over
+            shutil.move(folder, target)
+        os.makedirs(folder)
+    return eventDir
+
+
+class ArchivePacker(threading.Thread):
+    """ Pack an event directory into <event>.zip and <event>.index.json. """
+    def __init__(self, eventDir, rate=ARCHIVE_READ_MB_PER_S, keepFolder=ARCHIVE_KEEP_FOLDERS):
+        threading.Thread.__init__(self, name="archivePacker")
+        self.daemon = True
+        self.eventDir = eventDir.rstrip("/")
+        self.rate = rate * 1024.0**2
+        self.keepFolder = keepFolder
+        self.stopEvent = threading.Event()
+        self.filesDone = 0
+        self.bytesDone = 0
+        self.filesTotal = 0
+
+    def listFiles(self):
+        files = []
+        for root, dirs, names in os.walk(self.eventDir):
+            dirs.sort()
+            for name in sorted(names):
+                files.append(os.path.join(root, name))
+        return files
+
+    def readThrottled(self, filePath, sha):
+        """ Read a file in blocks, never faster than the configured rate. """
+        blocks = []
+        with open(filePath, 'rb') as f:
+            while not self.stopEvent.is_set():
+                start = time.time()
+                block = f.read(READ_BLOCK)
+                if not block:
+                    break
+                sha.update(block)
+                blocks.append(block)
+                self.stopEvent.wait(max(len(block) / self.rate - (time.time() - start), 0))
+        return "".join(blocks)
+
+    def run(self):
+        files = self.listFiles()
+        self.filesTotal = len(files)
+        zipPath = self.eventDir + ".zip"
+        indexPath = self.eventDir + ".index.json"
+        startTime = time.time()
+
+        index = []
+        archive = zipfile.ZipFile(zipPath + ".tmp", 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        for filePath in files:
+            if self.stopEvent.is_set():
+                break
+            sha = hashlib.sha256()
+            data = self.readThrottled(filePath, sha)
+            name = os.path.relpath(filePath, self.eventDir)
+            info = zipfile.ZipInfo(name, time.localtime(os.path.getmtime(filePath))[:6])
+            if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, data)
+            index.append({'name': name, 'size': len(data), 'sha256': sha.hexdigest()})
+            self.filesDone += 1
+            self.bytesDone += len(data)
+        archive.close()
+
+        if self.stopEvent.is_set():
+            # leave the unfinished file, the folders are still complete
+            print "archiving of '{0}' interrupted".format(self.eventDir)
+            return
+        # the index first: a zip file without .tmp is always complete with its index
+        with open(indexPath, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.rename(zipPath + ".tmp", zipPath)
+        if not self.keepFolder:
+            shutil.rmtree(self.eventDir)
+        print "archived {0} files ({1:.0f} MB) of '{2}' in {3:.0f} s".format(
+            self.filesDone, self.bytesDone / 1024.0**2, self.eventDir, time.time() - startTime)
+
+    def progress(self):
+        if self.filesTotal == 0:
+            return 0.0
+        return float(self.filesDone) / self.filesTotal
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+
+
+def archiveEvent(folders, eventDir=None, rate=ARCHIVE_READ_MB_PER_S):
+    """ Rotate the folders into a new event directory and start packing it. """
+    if eventDir is None:
+        eventDir = os.path.join(ARCHIVE_PATH, getEventName())
+    rotateFolders(folders, eventDir)
+    packer = ArchivePacker(eventDir, rate)
+    packer.start()
+    return packer
+
+
+def resumeArchives(archivePath=ARCHIVE_PATH, rate=ARCHIVE_READ_MB_PER_S):
+    """ Pack the events again whose packing was interrupted; returns the packers. """
+    packers = []
+    if not os.path.isdir(archivePath):
+        return packers
+    for name in sorted(os.listdir(archivePath)):
+        eventDir = os.path.join(archivePath, name)
+        if not os.path.isdir(eventDir) or not os.path.exists(eventDir + ".zip.tmp"):
+            continue
+        # a zip file cannot be continued, it is written from the start
+        print "packing '{0}' again".format(eventDir)
+        os.remove(eventDir + ".zip.tmp")
+        packer = ArchivePacker(eventDir, rate)
+        packer.start()
+        packers.append(packer)
+    return packers
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print >> sys.stderr, "Usage: {0} ARCHIVE_DIR".format(sys.argv[0])
+        sys.exit(1)
+    if os.path.exists(sys.argv[1]):
+        print >> sys.stderr, "Archive directory already exists, choose another name."
+        sys.exit(1)
+
+    # the booth is not running, so pack at full speed
+    packer = archiveEvent(ARCHIVE_FOLDERS, sys.argv[1], rate=float('inf'))
+    try:
+        while packer.is_alive():
+            packer.join(0.5)
+    except KeyboardInterrupt:
+        packer.stop()
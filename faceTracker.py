@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Face detection for the automatic crop frame of the portrait booth. The
+# live view only hands over its newest frame; a worker thread detects the
+# face on a downscaled copy every DETECT_INTERVAL and follows it with
+# template matching in between, never faster than TRACK_INTERVAL.
+
+import os
+import time
+import threading
+
+import numpy as np
+import cv2
+
+from boothMetrics import METRICS
+
+# the cascade shipped with OpenCV (cv2.data only exists in newer versions)
+CASCADE_DIRS = [getattr(getattr(cv2, 'data', None), 'haarcascades', ''),
+                "/usr/share/opencv/haarcascades/", "/usr/local/share/OpenCV/haarcascades/"]
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+
+# width of the frame faces are searched in
+DETECT_WIDTH = 320
+
+# seconds between two detections and between two tracking steps
+DETECT_INTERVAL = 0.5
+TRACK_INTERVAL = 0.1
+
+# below this match score the tracked face counts as lost
+TRACK_MIN_SCORE = 0.5
+
+
+def findCascade():
+    for directory in CASCADE_DIRS:
+        path = os.path.join(directory, CASCADE_FILE)
+        if directory and os.path.isfile(path):
+            return path
+    return CASCADE_FILE
+
+
+class FaceTracker(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self, name="faceTracker")
+        self.daemon = True
+        self.cascade = cv2.CascadeClassifier(findCascade())
+        self.latestFrame = None
+        self.frameEvent = threading.Event()
+        self.stopEvent = threading.Event()
+
+        # the last face as (x, y, width, height) relative to the frame
+        self.face = None
+        self.box = None
+        self.template = None
+        self.lastDetection = 0
+
+    def submit(self, frame):
+        """ Hand over the newest frame (a BGR/gray array or JPEG data); older ones are dropped. """
+        self.latestFrame = frame
+        self.frameEvent.set()
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.frameEvent.wait(1.0)
+            self.frameEvent.clear()
+            frame = self.latestFrame
+            if frame is None:
+                continue
+
+            start = time.time()
+            small = self.shrink(frame)
+            if self.template is None or start - self.lastDetection > DETECT_INTERVAL:
+                self.detect(small)
+                self.lastDetection = start
+                METRICS.observe('faceDetect', time.time() - start)
+            else:
+                self.track(small)
+                METRICS.observe('faceTrack', time.time() - start)
+
+            if self.box is not None:
+                x, y, w, h = self.box
+                height, width = small.shape
+                self.face = (float(x) / width, float(y) / height, float(w) / width, float(h) / height)
+            else:
+                self.face = None
+
+            # throttle, the live view is more important
+            self.stopEvent.wait(max(TRACK_INTERVAL - (time.time() - start), 0))
+
+    def shrink(self, frame):
+        if isinstance(frame, str):
+            frame = cv2.imdecode(np.frombuffer(frame, np.uint8), cv2.IMREAD_GRAYSCALE)
+        elif frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = float(DETECT_WIDTH) / frame.shape[1]
+        size = (DETECT_WIDTH, int(frame.shape[0] * scale))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def detect(self, small):
+        """ Look for faces in the whole frame and keep the largest one. """
+        faces = self.cascade.detectMultiScale(cv2.equalizeHist(small), 1.1, 5, 0, (24, 24))
+        if len(faces) == 0:
+            self.box = None
+            self.template = None
+            return
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        self.box = (x, y, w, h)
+        self.template = small[y:y+h, x:x+w].copy()
+
+    def track(self, small):
+        """ Follow the face near its last position by template matching. """
+        x, y, w, h = self.box
+        left, top = max(x - w//2, 0), max(y - h//2, 0)
+        right, bottom = min(x + w + w//2, small.shape[1]), min(y + h + h//2, small.shape[0])
+        region = small[top:bottom, left:right]
+        if region.shape[0] < h or region.shape[1] < w:
+            self.box = None
+            self.template = None
+            return
+
+        scores = cv2.matchTemplate(region, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        if score < TRACK_MIN_SCORE:
+            self.box = None
+            self.template = None
+            return
+        self.box = (left + location[0], top + location[1], w, h)
+
+    def stop(self):
+        self.stopEvent.set()
+        self.frameEvent.set()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# A small web gallery for the guests' phones: the pictures, their thumbnails
+# and the printed PDFs over the venue Wi-Fi. It runs in its own process (this
+# script in a new interpreter, not forked from the booth) at low priority,
+# so the live view of the booth doesn't notice it. Files are sent by the
+# kernel (sendfile) with ETag/Last-Modified revalidation and range requests;
+# the JSON listings come from an index that is only rebuilt when the folder
+# changed. Files the booth still holds in RAM (see
+# stagingStore) are listed and served from there. Next to a running booth
+# it can also be started on its own:
+#
+#     python galleryServer.py --port 8080
+
+import os
+import sys
+import time
+import json
+import errno
+import select
+import socket
+import ctypes
+import ctypes.util
+import urlparse
+import argparse
+import threading
+import email.utils
+import subprocess
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from stagingStore import STAGING, STAGING_PATH
+
+GALLERY_PORT = 8080
+GALLERY_NICE = 10
+
+# served under /<name>/, listed under /api/<name>
+GALLERY_FOLDERS = {
+    'pictures':   ("pictures/", ('.jpg',)),
+    'thumbnails': ("thumbnails/", ('.jpg',)),
+    'prints':     ("prints/", ('.pdf',)),
+}
+
+CONTENT_TYPES = {'.jpg': "image/jpeg", '.pdf': "application/pdf", '.html': "text/html; charset=utf-8"}
+
+# entries per page of a listing
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# the names of the pictures never change, phones may keep them a while
+FILE_MAX_AGE = 3600
+
+# a listing is rebuilt when its folder changed, or at the latest after this
+# many seconds (folder time stamps can be coarse, e.g. on FAT)
+MAX_INDEX_AGE = 30.0
+
+# bytes per sendfile call and per block without sendfile
+SENDFILE_BLOCK = 4*1024*1024
+READ_BLOCK = 256*1024
+SEND_TIMEOUT = 30.0
+
+# written by the journal, not complete yet
+TEMP_SUFFIX = ".tmp"
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    # the 64 bit offset variant, also on the 32 bit Raspberry Pi
+    _sendfile = _libc.sendfile64
+    _sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    _sendfile.restype = ctypes.c_ssize_t
+except (OSError, AttributeError):
+    _sendfile = None
+
+
+def sendFile(sock, f, offset, count):
+    """ Copy count bytes at offset of the file to the socket, in the kernel if possible. """
+    if _sendfile is not None:
+        position = ctypes.c_int64(offset)
+        while count > 0:
+            sent = _sendfile(sock.fileno(), f.fileno(), ctypes.byref(position), min(count, SENDFILE_BLOCK))
+            if sent > 0:
+                count -= sent
+                continue
+            if sent == 0:
+                # the file got shorter
+                return
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            elif error == errno.EAGAIN:
+                select.select([], [sock], [], SEND_TIMEOUT)
+                continue
+            elif error in (errno.EINVAL, errno.ENOSYS):
+                # not supported for this file, continue below
+                offset = position.value
+                break
+            raise socket.error(error, os.strerror(error))
+        else:
+            return
+
+    f.seek(offset)
+    while count > 0:
+        block = f.read(min(count, READ_BLOCK))
+        if not block:
+            break
+        sock.sendall(block)
+        count -= len(block)
+
+
+def parseRange(header, size):
+    """ (first, last) byte of a single range request; None if it cannot be
+        satisfied, False if it should be ignored (the whole file is sent). """
+    units, _, spec = header.partition("=")
+    if units.strip() != "bytes" or "," in spec:
+        return False
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # the last n bytes
+            length = int(last)
+            if length == 0:
+                return None
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = int(last) if last else size - 1
+    except ValueError:
+        return False
+    if first >= size:
+        return None
+    if last < first:
+        return False
+    return first, min(last, size - 1)
+
+
+class DirectoryIndex():
+    """ The files of a folder, newest first; rescanned only when the folder changed. """
+    def __init__(self, folder, extensions):
+        self.folder = folder
+        self.extensions = extensions
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.scanTime = 0
+        self.entries = []
+        self.names = set()
+        self.scans = 0
+
+    def folders(self):
+        """ The folder and its counterpart in the booth's staging area, if any. """
+        if STAGING.root is None or os.path.isabs(self.folder):
+            return [self.folder]
+        return [self.folder, STAGING.stagedPath(self.folder)]
+
+    def scan(self):
+        files = {}
+        for folder in self.folders():
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            # a staged file is newer than its flushed copy
+            for name in names:
+                if name.startswith(".") or os.path.splitext(name)[1].lower() not in self.extensions:
+                    continue
+                try:
+                    st = os.stat(os.path.join(folder, name))
+                except OSError:
+                    continue
+                files[name] = (st.st_mtime, name, st.st_size)
+        return sorted(files.values(), reverse=True)
+
+    def current(self):
+        """ The entries as (mtime, name, size) and the time stamp of the folder. """
+        try:
+            mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            return [], 0
+        for folder in self.folders()[1:]:
+            try:
+                mtime = max(mtime, os.stat(folder).st_mtime)
+            except OSError:
+                pass
+        with self.lock:
+            if mtime != self.mtime or time.time() - self.scanTime > MAX_INDEX_AGE:
+                self.entries = self.scan()
+                self.names = set(name for m, name, size in self.entries)
+                self.mtime = mtime
+                self.scanTime = time.time()
+                self.scans += 1
+            return self.entries, self.mtime
+
+
+INDEX_PAGE = u"""<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Fotobox</title>
+<style>
+body { font-family: sans-serif; margin: 0; background: #222; color: #eee; }
+h1 { font-size: 1.3em; margin: 0.6em; }
+#grid { display: flex; flex-wrap: wrap; }
+#grid a { width: 50%; max-width: 240px; }
+#grid img { width: 100%; display: block; border: 2px solid #222; box-sizing: border-box; }
+button { margin: 1em; padding: 0.8em 2em; font-size: 1em; }
+</style></head>
+<body>
+<h1>Fotobox &ndash; eure Bilder</h1>
+<div id="grid"></div>
+<button id="more" onclick="load()">Mehr laden</button>
+<script>
+var page = 0;
+function load() {
+  var request = new XMLHttpRequest();
+  request.onload = function() {
+    var listing = JSON.parse(request.responseText);
+    listing.items.forEach(function(item) {
+      var link = document.createElement("a");
+      link.href = item.url;
+      var image = document.createElement("img");
+      image.src = item.thumbnail || item.url;
+      image.loading = "lazy";
+      link.appendChild(image);
+      document.getElementById("grid").appendChild(link);
+    });
+    page = listing.page;
+    document.getElementById("more").style.display = page < listing.pages ? "" : "none";
+  };
+  request.open("GET", "/api/pictures?page=" + (page + 1));
+  request.send();
+}
+load();
+</script>
+</body></html>
+""".encode('utf-8')
+
+
+class GalleryHandler(BaseHTTPRequestHandler):
+    # keep the connections of the phones open
+    protocol_version = "HTTP/1.1"
+    server_version = "pyPhotoBooth"
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if not parts:
+            self.sendData(INDEX_PAGE, CONTENT_TYPES['.html'])
+        elif len(parts) == 2 and parts[0] == "api" and parts[1] in GALLERY_FOLDERS:
+            self.sendListing(parts[1], urlparse.parse_qs(url.query))
+        elif len(parts) == 2 and parts[0] in GALLERY_FOLDERS:
+            self.sendStatic(parts[0], parts[1])
+        else:
+            self.sendStatus(404)
+
+    def sendStatus(self, status, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def sendData(self, data, contentType, headers=()):
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def notModified(self, etag, mtime):
+        """ Does the phone have this version already? """
+        ifNoneMatch = self.headers.get('If-None-Match')
+        if ifNoneMatch is not None:
+            tags = [t.strip() for t in ifNoneMatch.split(",")]
+            return etag in tags or "*" in tags
+        ifModifiedSince = self.headers.get('If-Modified-Since')
+        if ifModifiedSince is not None:
+            since = email.utils.parsedate_tz(ifModifiedSince)
+            return since is not None and int(mtime) <= email.utils.mktime_tz(since)
+        return False
+
+    def sendListing(self, name, query):
+        index = self.server.indices[name]
+        entries, mtime = index.current()
+        thumbnails = None
+        thumbnailScans = 0
+        if name == 'pictures':
+            thumbnailIndex = self.server.indices['thumbnails']
+            thumbnailIndex.current()
+            thumbnails = thumbnailIndex.names
+            thumbnailScans = thumbnailIndex.scans
+
+        try:
+            page = max(int(query.get('page', ["1"])[0]), 1)
+            size = min(max(int(query.get('size', [str(PAGE_SIZE)])[0]), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            self.sendStatus(400)
+            return
+
+        # the listing only changes when the folders were scanned again
+        etag = '"{0}-{1}-{2}-{3:x}-{4}-{5}"'.format(
+            name, page, size, int(mtime * 1e6), index.scans, thumbnailScans)
+        ifNoneMatch = self.headers.get('If-None-Match')
+        if ifNoneMatch is not None and etag in [t.strip() for t in ifNoneMatch.split(",")]:
+            self.sendStatus(304, [("ETag", etag)])
+            return
+
+        items = []
+        for entryTime, fileName, fileSize in entries[(page - 1) * size:page * size]:
+            item = {'name': fileName, 'url': "/{0}/{1}".format(name, fileName),
+                    'size': fileSize, 'time': int(entryTime)}
+            if thumbnails is not None and fileName in thumbnails:
+                item['thumbnail'] = "/thumbnails/" + fileName
+            items.append(item)
+        data = json.dumps({'page': page, 'pages': (len(entries) + size - 1) // size,
+                           'total': len(entries), 'items': items})
+        self.sendData(data, "application/json", [("ETag", etag), ("Cache-Control", "no-cache")])
+
+    def sendStatic(self, name, fileName):
+        if fileName.startswith(".") or fileName.endswith(TEMP_SUFFIX) \
+                or os.path.splitext(fileName)[1].lower() not in GALLERY_FOLDERS[name][1]:
+            self.sendStatus(404)
+            return
+        filePath = os.path.join(self.server.root, GALLERY_FOLDERS[name][0], fileName)
+        try:
+            f = open(STAGING.resolve(filePath), 'rb')
+        except IOError:
+            # flushed from RAM in the meantime
+            try:
+                f = open(filePath, 'rb')
+            except IOError:
+                self.sendStatus(404)
+                return
+
+        with f:
+            st = os.fstat(f.fileno())
+            etag = '"{0:x}-{1:x}"'.format(int(st.st_mtime * 1e6), st.st_size)
+            lastModified = email.utils.formatdate(st.st_mtime, usegmt=True)
+            headers = [("ETag", etag), ("Last-Modified", lastModified),
+                       ("Cache-Control", "public, max-age={0}".format(FILE_MAX_AGE))]
+            if self.notModified(etag, st.st_mtime):
+                self.sendStatus(304, headers)
+                return
+
+            first, last, status = 0, st.st_size - 1, 200
+            rangeHeader = self.headers.get('Range')
+            ifRange = self.headers.get('If-Range')
+            if rangeHeader is not None and ifRange in (None, etag, lastModified):
+                byteRange = parseRange(rangeHeader, st.st_size)
+                if byteRange is None:
+                    self.sendStatus(416, [("Content-Range", "bytes */{0}".format(st.st_size))])
+                    return
+                if byteRange is not False:
+                    first, last = byteRange
+                    status = 206
+
+            self.send_response(status)
+            self.send_header("Content-Type", CONTENT_TYPES.get(os.path.splitext(fileName)[1].lower(),
+                                                               "application/octet-stream"))
+            self.send_header("Content-Length", str(last - first + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            if status == 206:
+                self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(first, last, st.st_size))
+            for key, value in headers:
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.flush()
+                sendFile(self.connection, f, first, last - first + 1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class GalleryHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # many phones connecting at the same moment
+    request_queue_size = 128
+
+    def __init__(self, address, root):
+        HTTPServer.__init__(self, address, GalleryHandler)
+        self.root = root
+        self.indices = dict((name, DirectoryIndex(os.path.join(root, folder), extensions))
+                            for name, (folder, extensions) in GALLERY_FOLDERS.items())
+
+
+def serverMain(root, host, port):
+    """ The gallery process. """
+    try:
+        os.nice(GALLERY_NICE)
+    except OSError:
+        pass
+    try:
+        server = GalleryHTTPServer((host, port), root)
+    except socket.error as e:
+        print "gallery not available on port {0}: {1}".format(port, e)
+        return
+    server.serve_forever()
+
+
+class GalleryServer():
+    """ The gallery in a separate process, started and stopped with the booth. """
+    def __init__(self, root=".", port=GALLERY_PORT, host=""):
+        self.root = root
+        self.port = port
+        self.host = host
+        self.process = None
+
+    def start(self):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        self.process = subprocess.Popen([sys.executable, script, "--root", self.root, "--host", self.host,
+                                         "--port", str(self.port), "--staging", STAGING.root or ""])
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the pictures of the booth to the guests' phones.")
+    parser.add_argument("--root", default=".", help="folder of the booth (default: .)")
+    parser.add_argument("--host", default="", help="address to listen on (default: all)")
+    parser.add_argument("--port", type=int, default=GALLERY_PORT,
+                        help="port (default: {0})".format(GALLERY_PORT))
+    parser.add_argument("--staging", default=STAGING_PATH,
+                        help="staging folder of the booth (default: {0})".format(STAGING_PATH))
+    args = parser.parse_args()
+    STAGING.attach(args.staging)
+    try:
+        serverMain(args.root, args.host, args.port)
+    except KeyboardInterrupt:
+        pass
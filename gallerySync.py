@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Several booths sharing one output folder. Instead of scanning the whole
+# folder for every change, the folders are watched with inotify (read in the
+# GUI thread through a QSocketNotifier) and each added, removed or renamed
+# file is reported. The events are collected for a short moment and handed
+# over as one batch. Files are only reported once they are complete: the
+# journal writes them under a temporary name and renames them at the end.
+# Without inotify a QFileSystemWatcher tells which folder changed, which is
+# then compared with the last listing.
+
+import os
+import time
+import errno
+import struct
+import ctypes
+import ctypes.util
+from collections import OrderedDict
+
+from PyQt4.QtCore import QObject, QTimer, QSocketNotifier, QFileSystemWatcher, pyqtSignal
+
+from boothMetrics import METRICS
+
+# events are collected this long before they are handed over
+DEBOUNCE_MS = 200
+
+# retry watching a folder that was moved away (e.g. archived)
+REWATCH_MS = 1000
+
+# written by the journal, not complete yet
+TEMP_SUFFIX = ".tmp"
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _inotify_init1 = _libc.inotify_init1
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    _inotify_rm_watch = _libc.inotify_rm_watch
+except (OSError, AttributeError):
+    _inotify_init1 = None
+
+
+class GallerySync(QObject):
+    # paths of the added and of the removed pictures, newest events last
+    changed = pyqtSignal(list, list)
+    # events were lost or a folder was replaced, the list has to be rebuilt
+    rescan = pyqtSignal()
+
+    def __init__(self, folders, extensions=('.jpg',)):
+        QObject.__init__(self)
+        self.folders = [f if f.endswith("/") else f + "/" for f in folders]
+        self.extensions = extensions
+        self.pending = OrderedDict()
+        self.firstEventTime = None
+        self.needRescan = False
+        self.lost = set()
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DEBOUNCE_MS)
+        self.timer.timeout.connect(self.flush)
+        self.rewatchTimer = QTimer()
+        self.rewatchTimer.setInterval(REWATCH_MS)
+        self.rewatchTimer.timeout.connect(self.rewatch)
+
+        self.fd = -1
+        self.notifier = None
+        self.watcher = None
+        self.watches = {}
+        self.listings = {}
+        if _inotify_init1 is not None:
+            self.fd = _inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd >= 0:
+            for folder in self.folders:
+                self.watch(folder)
+            self.notifier = QSocketNotifier(self.fd, QSocketNotifier.Read)
+            self.notifier.activated.connect(self.readEvents)
+        else:
+            # only tells which folder changed
+            self.watcher = QFileSystemWatcher()
+            for folder in self.folders:
+                self.watch(folder)
+            self.watcher.directoryChanged.connect(self.folderChanged)
+
+    def usesInotify(self):
+        return self.fd >= 0
+
+    def watch(self, folder):
+        """ Start watching a folder; False if it cannot be watched (yet). """
+        if not os.path.isdir(folder):
+            self.lost.add(folder)
+            return False
+        if self.fd >= 0:
+            wd = _inotify_add_watch(self.fd, folder, WATCH_MASK)
+            if wd < 0:
+                self.lost.add(folder)
+                return False
+            self.watches[wd] = folder
+        else:
+            self.listings[folder] = self.listFolder(folder)
+            self.watcher.addPath(folder)
+        self.lost.discard(folder)
+        return True
+
+    def rewatch(self):
+        for folder in list(self.lost):
+            if self.watch(folder):
+                self.needRescan = True
+        if not self.lost:
+            self.rewatchTimer.stop()
+        if self.needRescan:
+            self.schedule()
+
+    def isPicture(self, name):
+        return not name.startswith(".") and not name.endswith(TEMP_SUFFIX) \
+            and os.path.splitext(name)[1].lower() in self.extensions
+
+    def addEvent(self, filePath, added):
+        # the last event of a file counts, e.g. added and removed again
+        self.pending.pop(filePath, None)
+        self.pending[filePath] = added
+        self.schedule()
+
+    def schedule(self):
+        # not restarted by further events, so the delay stays bounded
+        if self.firstEventTime is None:
+            self.firstEventTime = time.time()
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def folderLost(self, folder):
+        self.lost.add(folder)
+        self.needRescan = True
+        self.rewatchTimer.start()
+        self.schedule()
+
+    def readEvents(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64*1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip("\0")
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    self.needRescan = True
+                    self.schedule()
+                    continue
+                folder = self.watches.get(wd)
+                if folder is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # e.g. moved into the archive, watch the new folder
+                    del self.watches[wd]
+                    if mask & IN_MOVE_SELF:
+                        _inotify_rm_watch(self.fd, wd)
+                    self.folderLost(folder)
+                    continue
+                if mask & IN_ISDIR or not self.isPicture(name):
+                    continue
+                self.addEvent(folder + name, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO)))
+
+    def listFolder(self, folder):
+        return set(name for name in os.listdir(folder) if self.isPicture(name))
+
+    def folderChanged(self, folder):
+        folder = str(folder)
+        if not os.path.isdir(folder):
+            self.listings.pop(folder, None)
+            self.folderLost(folder)
+            return
+        listing = self.listFolder(folder)
+        known = self.listings.get(folder, set())
+        for name in sorted(listing - known):
+            self.addEvent(folder + name, True)
+        for name in known - listing:
+            self.addEvent(folder + name, False)
+        self.listings[folder] = listing
+
+    def flush(self):
+        if self.firstEventTime is not None:
+            METRICS.observe('gallerySync', time.time() - self.firstEventTime)
+        self.firstEventTime = None
+        if self.needRescan:
+            self.needRescan = False
+            self.pending.clear()
+            self.rescan.emit()
+            return
+        if not self.pending:
+            return
+        added = [path for path, isAdded in self.pending.items() if isAdded]
+        removed = [path for path, isAdded in self.pending.items() if not isAdded]
+        self.pending.clear()
+        self.changed.emit(added, removed)
+
+    def stop(self):
+        self.timer.stop()
+        self.rewatchTimer.stop()
+        if self.notifier is not None:
+            self.notifier.setEnabled(False)
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
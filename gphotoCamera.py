@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# A camera on top of python-gphoto2 with the interface of piggyphoto.Camera
+# the booths use (capture_preview, capture_image, leave_locked). Unlike
+# piggyphoto it can fetch every file of an exposure, e.g. RAW + JPEG, also
+# the JPEG first and the big RAW later from another thread; the camera is
+# used by one thread at a time.
+
+import os
+import threading
+
+import gphoto2 as gp
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def isJpeg(fileName):
+    return os.path.splitext(fileName)[1].lower() in JPEG_EXTENSIONS
+
+
+class Preview():
+    """ A preview frame like the one of piggyphoto. """
+    def __init__(self, data):
+        self.data = data
+
+    def to_pixbuf(self):
+        return self.data
+
+    def clean(self):
+        self.data = None
+
+
+class GphotoCamera():
+    def __init__(self, imageFormat=None, port=None):
+        self.context = gp.gp_context_new()
+        self.lock = threading.RLock()
+        self.camera = gp.check_result(gp.gp_camera_new())
+        if port is not None:
+            # one of several cameras, e.g. "usb:001,007" (see gphoto2 --auto-detect)
+            portInfoList = gp.check_result(gp.gp_port_info_list_new())
+            gp.check_result(gp.gp_port_info_list_load(portInfoList))
+            index = gp.check_result(gp.gp_port_info_list_lookup_path(portInfoList, port))
+            portInfo = gp.check_result(gp.gp_port_info_list_get_info(portInfoList, index))
+            gp.check_result(gp.gp_camera_set_port_info(self.camera, portInfo))
+        gp.check_result(gp.gp_camera_init(self.camera, self.context))
+        if imageFormat is not None:
+            self.setConfig('imageformat', imageFormat)
+
+    def setConfig(self, name, value):
+        """ Change a setting of the camera, e.g. imageformat to 'RAW + Large Fine JPEG'. """
+        config = gp.check_result(gp.gp_camera_get_config(self.camera, self.context))
+        widget = gp.check_result(gp.gp_widget_get_child_by_name(config, name))
+        gp.check_result(gp.gp_widget_set_value(widget, value))
+        gp.check_result(gp.gp_camera_set_config(self.camera, config, self.context))
+
+    def leave_locked(self):
+        # gphoto2 keeps the camera open between calls anyway
+        pass
+
+    def capture_preview(self):
+        with self.lock:
+            cameraFile = gp.check_result(gp.gp_camera_capture_preview(self.camera, self.context))
+            data = gp.check_result(gp.gp_file_get_data_and_size(cameraFile))
+        return Preview(str(data))
+
+    def download(self, folder, name):
+        with self.lock:
+            cameraFile = gp.check_result(gp.gp_camera_file_get(
+                self.camera, folder, name, gp.GP_FILE_TYPE_NORMAL, self.context))
+            return str(gp.check_result(gp.gp_file_get_data_and_size(cameraFile)))
+
+    def waitForFile(self):
+        """ (folder, name) of the next file of the exposure, None once all are announced. """
+        while True:
+            eventType, eventData = gp.check_result(
+                gp.gp_camera_wait_for_event(self.camera, 1000, self.context))
+            if eventType == gp.GP_EVENT_FILE_ADDED:
+                return eventData.folder, eventData.name
+            elif eventType in (gp.GP_EVENT_TIMEOUT, gp.GP_EVENT_CAPTURE_COMPLETE):
+                return None
+
+    def capture_first(self):
+        """ Take a picture and download only its JPEG (or, without one, its first
+            file) as (file name, data); the function returned with it downloads the
+            other files as (file name, data), e.g. from a background thread. """
+        with self.lock:
+            path = gp.check_result(gp.gp_camera_capture(self.camera, gp.GP_CAPTURE_IMAGE, self.context))
+            paths = [(path.folder, path.name)]
+            # further files of the same exposure (RAW + JPEG) are announced as events
+            complete = False
+            while not any(isJpeg(name) for folder, name in paths):
+                nextPath = self.waitForFile()
+                if nextPath is None:
+                    complete = True
+                    break
+                paths.append(nextPath)
+            first = ([p for p in paths if isJpeg(p[1])] or paths)[0]
+            paths.remove(first)
+            data = self.download(*first)
+
+        def downloadRest():
+            with self.lock:
+                if not complete:
+                    nextPath = self.waitForFile()
+                    while nextPath is not None:
+                        paths.append(nextPath)
+                        nextPath = self.waitForFile()
+                return [(name, self.download(folder, name)) for folder, name in paths]
+        return (first[1], data), downloadRest
+
+    def capture_files(self):
+        """ Take a picture and download all its files as (file name, data). """
+        with self.lock:
+            first, downloadRest = self.capture_first()
+            return [first] + downloadRest()
+
+    def capture_image(self, destpath):
+        """ Take a picture and save its JPEG (or its only file) to destpath. """
+        files = self.capture_files()
+        name, data = files[0]
+        for fileName, fileData in files:
+            if isJpeg(fileName):
+                name, data = fileName, fileData
+        with open(destpath, 'wb') as f:
+            f.write(data)
+
+    def exit(self):
+        with self.lock:
+            gp.check_result(gp.gp_camera_exit(self.camera, self.context))
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# JPEG encoding off the GUI thread. Every kind of output has its own profile
+# (quality, chroma subsampling, progressive, optimized Huffman tables) and
+# the time and size of each encode are recorded per profile.
+
+import time
+import threading
+import Queue
+
+import numpy as np
+import cv2
+
+from PyQt4.QtCore import Qt, QObject, QSize, pyqtSignal
+from PyQt4.QtGui import QImage, QImageReader
+
+from boothMetrics import METRICS
+from captureJournal import JOURNAL
+from stagingStore import STAGING
+
+# number of encoder threads (cv2.imencode releases the GIL)
+ENCODER_WORKERS = 2
+
+
+class EncodeProfile():
+    def __init__(self, quality, subsampling="420", progressive=False, optimize=False):
+        self.quality = quality
+        self.subsampling = subsampling
+        self.progressive = progressive
+        self.optimize = optimize
+
+    def imencodeParams(self):
+        """ Parameters for cv2.imencode, leaving out what this OpenCV doesn't know. """
+        params = [getattr(cv2, 'IMWRITE_JPEG_QUALITY', 1), self.quality]
+        if self.progressive and hasattr(cv2, 'IMWRITE_JPEG_PROGRESSIVE'):
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        if self.optimize and hasattr(cv2, 'IMWRITE_JPEG_OPTIMIZE'):
+            params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+        sampling = getattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR_' + self.subsampling, None)
+        if sampling is not None:
+            params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, sampling]
+        return params
+
+
+# one profile for each kind of output
+ENCODE_PROFILES = {
+    'thumbnail': EncodeProfile(80, "420", optimize=True),
+    'preview':   EncodeProfile(85, "420", progressive=True, optimize=True),
+    'print':     EncodeProfile(95, "444", optimize=True),
+    'archive':   EncodeProfile(92, "422")
+}
+
+
+def qimageToArray(image):
+    """ Copy a QImage into a BGR numpy array as used by cv2. """
+    image = image.convertToFormat(QImage.Format_RGB32)
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    pixels = np.frombuffer(bits, np.uint8).reshape(image.height(), image.bytesPerLine() / 4, 4)
+    # RGB32 is stored as BGRA in memory
+    return np.ascontiguousarray(pixels[:, :image.width(), :3])
+
+
+def readScaled(source, width, height=0):
+    """ Decode a JPEG (path or QIODevice) right at a reduced size, the decoder
+        scales while decoding (DCT scaling). As wide as width, or fitted into
+        width x height. A QImage, None if it cannot be read. """
+    reader = QImageReader(source)
+    size = reader.size()
+    if not size.isValid():
+        return None
+    if height:
+        size.scale(width, height, Qt.KeepAspectRatio)
+    else:
+        size = QSize(width, max(size.height() * width / size.width(), 1))
+    reader.setScaledSize(size)
+    image = reader.read()
+    return None if image.isNull() else image
+
+
+def writeFile(filePath, data):
+    """ Write through the journal: temporary file, rename, grouped sync. """
+    JOURNAL.writeFile(filePath, data)
+
+
+class EncodeStats():
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+
+
+class JpegEncoder(QObject):
+    # emitted from the workers, delivered in the GUI thread
+    encoded = pyqtSignal(int, str)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, workers=ENCODER_WORKERS):
+        QObject.__init__(self)
+        self.jobs = Queue.Queue()
+        self.callbacks = {}
+        self.nextJobId = 0
+        self.stats = dict((name, EncodeStats()) for name in ENCODE_PROFILES)
+        self.statsLock = threading.Lock()
+        self.encoded.connect(self.runCallback)
+        self.failed.connect(self.runFailure)
+
+        self.threads = [threading.Thread(target=self.work, name="jpegEncoder") for i in range(workers)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    # callback gets the file path once it is written, failure the reason if not
+
+    def encodeFrame(self, frame, filePath, profile, callback=None, failure=None):
+        """ Encode a BGR frame (e.g. from the webcam) into a file. """
+        self.submit('frame', frame, filePath, profile, callback, failure)
+
+    def encodeImage(self, image, filePath, profile, callback=None, failure=None):
+        """ Encode a QImage into a file. """
+        self.submit('image', image, filePath, profile, callback, failure)
+
+    def scaleFile(self, sourcePath, filePath, width, profile, callback=None, failure=None):
+        """ Decode a JPEG at reduced size, scale it to the width and encode it. """
+        self.submit('scale', (sourcePath, width), filePath, profile, callback, failure)
+
+    def submit(self, kind, source, filePath, profile, callback, failure):
+        jobId = self.nextJobId
+        self.nextJobId += 1
+        if callback is not None or failure is not None:
+            self.callbacks[jobId] = (callback, failure)
+        self.jobs.put((jobId, kind, source, filePath, profile))
+
+    def runCallback(self, jobId, filePath):
+        callback, failure = self.callbacks.pop(jobId, (None, None))
+        if callback is not None:
+            callback(str(filePath))
+
+    def runFailure(self, jobId, reason):
+        callback, failure = self.callbacks.pop(jobId, (None, None))
+        if failure is not None:
+            failure(unicode(reason))
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            jobId, kind, source, filePath, profile = job
+            try:
+                self.encode(kind, source, filePath, profile)
+            except Exception as e:
+                print "could not encode '{0}': {1}".format(filePath, e)
+                # the booth continues with its failure path, not with a missing file
+                self.failed.emit(jobId, "could not encode '{0}': {1}".format(filePath, e))
+            else:
+                self.encoded.emit(jobId, filePath)
+            self.jobs.task_done()
+
+    def encode(self, kind, source, filePath, profileName):
+        profile = ENCODE_PROFILES[profileName]
+        if kind == 'frame':
+            frame = source
+        elif kind == 'image':
+            frame = qimageToArray(source)
+        else:
+            sourcePath, width = source
+            image = readScaled(STAGING.resolve(sourcePath), width)
+            if image is None:
+                raise IOError("cannot read '{0}'".format(sourcePath))
+            frame = qimageToArray(image)
+
+        start = time.time()
+        ok, data = cv2.imencode(".jpg", frame, profile.imencodeParams())
+        data = data.tostring()
+        seconds = time.time() - start
+        writeFile(filePath, data)
+
+        METRICS.observe('encode_' + profileName, seconds)
+        with self.statsLock:
+            stats = self.stats[profileName]
+            stats.count += 1
+            stats.seconds += seconds
+            stats.bytes += len(data)
+
+    def report(self):
+        """ Average encode time and output size per profile. """
+        lines = ["{0:<10} {1:>6} {2:>9} {3:>9}".format("profile", "n", "ms/file", "KB/file")]
+        with self.statsLock:
+            for name in sorted(self.stats):
+                stats = self.stats[name]
+                if stats.count == 0:
+                    continue
+                lines.append("{0:<10} {1:>6} {2:>9.1f} {3:>9.1f}".format(
+                    name, stats.count, stats.seconds*1000 / stats.count, stats.bytes/1024.0 / stats.count))
+        return "\n".join(lines)
+
+    def finish(self):
+        """ Wait until all pending files are written and print the statistics. """
+        for t in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        print self.report()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# The picture view of both booths. It keeps the newest live view frame (or
+# the picture on display) as it is and scales it only while painting, so a
+# frame is neither converted to a pixmap nor copied on its way to the
+# screen, and a resized window shows everything at the new size. Countdown,
+# shutter, crop frame etc. are layers painted on top instead of into the
+# frame. Only the area of the picture is repainted for a new frame.
+
+import time
+
+from PyQt4.QtCore import Qt, QRect, QPoint
+from PyQt4.QtGui import QWidget, QPainter, QPixmap
+
+from boothMetrics import METRICS
+
+
+class LiveViewWidget(QWidget):
+    def __init__(self, parent=None):
+        QWidget.__init__(self, parent)
+        # a QImage (live view) or QPixmap (picture on display)
+        self.image = None
+        # keeps the memory of a QImage alive, e.g. the numpy frame
+        self.imageSource = None
+        self.scaledPixmap = None
+        self.targetRect = QRect()
+
+        # callables (canvas, rect) painted on top, in this order; the
+        # canvas is moved to the picture, rect is the picture's area
+        self.layers = []
+        # painted until the next image, e.g. the shutter
+        self.transientLayer = None
+
+        self.paintSeconds = 0.0
+
+    def addLayer(self, layer):
+        self.layers.append(layer)
+
+    def setImage(self, image, source=None):
+        """ Show a QImage or QPixmap; source is kept alive until the next image. """
+        self.image = image
+        self.imageSource = source
+        self.scaledPixmap = None
+        self.transientLayer = None
+        self.updatePicture()
+
+    def showUntilNextImage(self, layer):
+        """ Paint a layer on top of the current image until the next one is set. """
+        self.transientLayer = layer
+        self.update(self.targetRect)
+
+    def pictureRect(self):
+        """ The area of the picture: scaled to the widget, centered. """
+        if self.image is None or self.image.width() == 0 or self.image.height() == 0:
+            return QRect()
+        size = self.image.size()
+        size.scale(self.size(), Qt.KeepAspectRatio)
+        return QRect(QPoint((self.width() - size.width()) / 2, (self.height() - size.height()) / 2), size)
+
+    def updatePicture(self):
+        """ Repaint the picture's area (and what it covered before). """
+        newRect = self.pictureRect()
+        if newRect == self.targetRect:
+            self.update(newRect)
+        else:
+            self.update(newRect.united(self.targetRect))
+            self.targetRect = newRect
+
+    def resizeEvent(self, event):
+        self.scaledPixmap = None
+        self.targetRect = self.pictureRect()
+        self.update()
+
+    def paintEvent(self, event):
+        if self.image is None:
+            return
+        start = time.time()
+        target = self.targetRect
+        canvas = QPainter(self)
+
+        if isinstance(self.image, QPixmap):
+            # a picture on display is scaled once per widget size
+            if self.scaledPixmap is None or self.scaledPixmap.size() != target.size():
+                self.scaledPixmap = self.image.scaled(target.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+            canvas.drawPixmap(target.topLeft(), self.scaledPixmap)
+        else:
+            canvas.drawImage(target, self.image)
+
+        canvas.setClipRect(target)
+        canvas.translate(target.topLeft())
+        area = QRect(QPoint(0, 0), target.size())
+        for layer in self.layers:
+            canvas.save()
+            layer(canvas, area)
+            canvas.restore()
+        if self.transientLayer is not None:
+            self.transientLayer(canvas, area)
+        canvas.end()
+
+        self.paintSeconds = time.time() - start
+        METRICS.observe('paintLiveView', self.paintSeconds)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Load test of the gallery server: many phones browsing the gallery at once,
+while the live view frame rate of the running booth is read from its
+metrics endpoint before and during the load
+
+    python loadTestGallery.py --clients 100 --seconds 30
+    python loadTestGallery.py --url http://192.168.1.10:8080 --metrics http://192.168.1.10:9100/metrics
+
+Each client keeps its connection open, loads a page of the listing, the
+thumbnails on it (revalidated with If-None-Match on the next visit) and now
+and then a picture, resumed with a range request. The live view rate is
+the rate of displayWebcamStream / displayCameraPreview; with
+ADAPTIVE_LIVEVIEW someone has to stand in front of the camera.
+"""
+
+import re
+import sys
+import time
+import json
+import random
+import socket
+import httplib
+import urllib2
+import urlparse
+import argparse
+import threading
+
+FRAME_STAGES = ("displayWebcamStream", "displayCameraPreview")
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Load test of the gallery server.")
+    parser.add_argument("--url", default="http://localhost:8080", help="the gallery (default: %(default)s)")
+    parser.add_argument("--metrics", default="http://localhost:9100/metrics",
+                        help="metrics endpoint of the booth (default: %(default)s)")
+    parser.add_argument("-c", "--clients", type=int, default=100, help="concurrent phones (default: 100)")
+    parser.add_argument("-s", "--seconds", type=float, default=30, help="duration of the load (default: 30)")
+    parser.add_argument("--baseline", type=float, default=10,
+                        help="seconds to measure the frame rate without load (default: 10)")
+    parser.add_argument("--think", type=float, default=1.0,
+                        help="mean pause of a phone between two pages (default: 1.0)")
+    return parser.parse_args()
+
+
+def frameCount(metricsUrl):
+    """ Number of live view frames shown so far, None if the booth is not reachable. """
+    try:
+        text = urllib2.urlopen(metricsUrl, timeout=5).read()
+    except (urllib2.URLError, socket.error):
+        return None
+    count = 0
+    for stage in FRAME_STAGES:
+        match = re.search(r'_count\{{stage="{0}"\}} (\d+)'.format(stage), text)
+        if match:
+            count += int(match.group(1))
+    return count
+
+
+def frameRate(metricsUrl, seconds):
+    start = frameCount(metricsUrl)
+    time.sleep(seconds)
+    end = frameCount(metricsUrl)
+    if start is None or end is None:
+        return None
+    return (end - start) / seconds
+
+
+class Results():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = 0
+        self.bytes = 0
+
+    def add(self, kind, status, seconds, size):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes += size
+
+    def error(self):
+        with self.lock:
+            self.errors += 1
+
+
+class Phone(threading.Thread):
+    def __init__(self, url, results, think, stopEvent):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.address = urlparse.urlparse(url).netloc
+        self.results = results
+        self.think = think
+        self.stopEvent = stopEvent
+        self.etags = {}
+        self.connection = None
+
+    def request(self, kind, path, headers=None):
+        headers = dict(headers or {})
+        if path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        start = time.time()
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = httplib.HTTPConnection(self.address, timeout=30)
+                self.connection.request("GET", path, headers=headers)
+                response = self.connection.getresponse()
+                body = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                # the server may have closed the kept-alive connection
+                self.connection = None
+                if attempt == 1:
+                    self.results.error()
+                    return None
+        if response.getheader('ETag') and response.status == 200:
+            self.etags[path] = response.getheader('ETag')
+        self.results.add(kind, response.status, time.time() - start, len(body))
+        return body if response.status == 200 else ""
+
+    def run(self):
+        page = 1
+        while not self.stopEvent.is_set():
+            body = self.request('listing', "/api/pictures?page={0}".format(page))
+            items = []
+            if body:
+                listing = json.loads(body)
+                items = listing['items']
+                page = random.randint(1, max(listing['pages'], 1))
+            for item in items:
+                if self.stopEvent.is_set():
+                    break
+                self.request('thumbnail', item.get('thumbnail', item['url']))
+            if items and random.random() < 0.3:
+                item = random.choice(items)
+                # a download interrupted by the Wi-Fi and resumed
+                self.request('picture', item['url'], {'Range': "bytes=0-65535"})
+                self.request('picture', item['url'], {'Range': "bytes=65536-"})
+            self.stopEvent.wait(random.expovariate(1.0 / self.think) if self.think > 0 else 0)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    args = parseArguments()
+
+    print "live view without load ...",
+    sys.stdout.flush()
+    baseline = frameRate(args.metrics, args.baseline)
+    print "{0:.1f} fps".format(baseline) if baseline is not None else "metrics not reachable"
+
+    results = Results()
+    stopEvent = threading.Event()
+    phones = [Phone(args.url, results, args.think, stopEvent) for i in range(args.clients)]
+    start = time.time()
+    for phone in phones:
+        phone.start()
+
+    print "live view with {0} phones ...".format(args.clients),
+    sys.stdout.flush()
+    loaded = frameRate(args.metrics, args.seconds)
+    stopEvent.set()
+    for phone in phones:
+        phone.join(30)
+    elapsed = time.time() - start
+    print "{0:.1f} fps".format(loaded) if loaded is not None else "metrics not reachable"
+
+    requests = sum(len(l) for l in results.latencies.values())
+    print "{0} requests in {1:.0f} s ({2:.0f}/s, {3:.1f} MB/s), {4} errors".format(
+        requests, elapsed, requests / elapsed, results.bytes / 1024.0**2 / elapsed, results.errors)
+    print "status: " + ", ".join("{0}: {1}".format(s, n) for s, n in sorted(results.statuses.items()))
+    print "{0:<10} {1:>7} {2:>8} {3:>8} {4:>8}".format("request", "n", "p50 ms", "p95 ms", "max ms")
+    for kind in sorted(results.latencies):
+        latencies = results.latencies[kind]
+        print "{0:<10} {1:>7} {2:>8.1f} {3:>8.1f} {4:>8.1f}".format(
+            kind, len(latencies), percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.95) * 1000, max(latencies) * 1000)
+    if baseline and loaded is not None:
+        print "live view frame rate changed by {0:+.1f} %".format((loaded / baseline - 1) * 100)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+"""
+Compose the portraits into a wall: a mosaic or contact sheet of any size,
+written as a series of JPEG strips (or print pages) or as one streamed PPM
+
+    python mosaicBuilder.py --columns 100 --tile-width 120 --output wall/wall.jpg
+    python mosaicBuilder.py --columns 4 --rows-per-file 5 --output pages/page.jpg
+    python mosaicBuilder.py --columns 100 --ppm wall.ppm
+
+The wall is built one row band at a time: a pool of threads decodes the
+tiles of the next row while the current one is placed, so only a few rows
+are held in memory. JPEG output keeps at most one file (--rows-per-file
+rows) in memory, by default as many rows as fit into STRIP_BYTES and into
+the 65535 px a JPEG can have; the PPM output only the current row.
+"""
+
+import os
+import sys
+import glob
+import time
+import resource
+import argparse
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import cv2
+
+from jpegEncoder import readScaled, qimageToArray
+
+IMWRITE_JPEG_QUALITY = getattr(cv2, 'IMWRITE_JPEG_QUALITY', 1)
+
+# the largest width and height of a JPEG
+JPEG_MAX_SIZE = 65535
+
+# default size of a JPEG strip before it is encoded
+STRIP_BYTES = 64*1024*1024
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Build a wall of portraits.")
+    parser.add_argument("input", nargs="?", default="pictures/",
+                        help="folder with the portraits (default: pictures/)")
+    parser.add_argument("--pattern", default="*.jpg", help="file pattern (default: *.jpg)")
+    parser.add_argument("-c", "--columns", type=int, default=20, help="tiles per row")
+    parser.add_argument("--tile-width", type=int, default=200, help="width of a tile in px")
+    parser.add_argument("--tile-height", type=int, default=0,
+                        help="height of a tile in px (default: keep the ratio of the portraits)")
+    parser.add_argument("--gap", type=int, default=4, help="space between the tiles in px")
+    parser.add_argument("--background", default="255,255,255", help="color as R,G,B")
+    parser.add_argument("-o", "--output", default="mosaic/wall.jpg",
+                        help="JPEG output; numbered if it takes several files")
+    parser.add_argument("-r", "--rows-per-file", type=int, default=0,
+                        help="rows per JPEG strip or page (default: strips of at most {0} MB)".format(
+                            STRIP_BYTES // 1024**2))
+    parser.add_argument("--ppm", help="stream the whole wall into one PPM file ('-' for stdout)")
+    parser.add_argument("-q", "--quality", type=int, default=92, help="JPEG quality")
+    parser.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of decoding threads")
+    return parser.parse_args()
+
+
+class TileDecoder():
+    """ Decode a portrait right at the size that fits into the tile and center it there. """
+    def __init__(self, tileWidth, tileHeight, background):
+        self.tileWidth = tileWidth
+        self.tileHeight = tileHeight
+        self.background = background
+        self.failed = 0
+
+    def decode(self, filePath):
+        tile = np.empty((self.tileHeight, self.tileWidth, 3), np.uint8)
+        tile[:] = self.background
+        # scaled while decoding, the full portrait is never in memory
+        image = readScaled(filePath, self.tileWidth, self.tileHeight)
+        if image is None:
+            self.failed += 1
+            return tile
+
+        frame = qimageToArray(image)
+        height, width = frame.shape[:2]
+        left, top = (self.tileWidth - width) // 2, (self.tileHeight - height) // 2
+        tile[top:top+height, left:left+width] = frame
+        return tile
+
+
+class JpegStrips():
+    """ Copy row bands into a strip and write it as numbered JPEG files. """
+    def __init__(self, output, rowsPerFile, quality, totalRows, width, maxHeight):
+        self.output = output
+        self.rowsPerFile = rowsPerFile
+        self.quality = quality
+        self.numbered = self.rowsPerFile < totalRows
+        # one buffer for all strips, the bands are not kept
+        self.strip = np.empty((maxHeight, width, 3), np.uint8)
+        self.height = 0
+        self.rows = 0
+        self.files = []
+        folder = os.path.dirname(output)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def add(self, band):
+        self.strip[self.height:self.height+band.shape[0]] = band
+        self.height += band.shape[0]
+        self.rows += 1
+        if self.rows == self.rowsPerFile:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.numbered:
+            root, ext = os.path.splitext(self.output)
+            filePath = "{0}_{1:03d}{2}".format(root, len(self.files) + 1, ext or ".jpg")
+        else:
+            filePath = self.output
+        strip = self.strip[:self.height]
+        self.height = 0
+        self.rows = 0
+        ok, data = cv2.imencode(".jpg", strip, [IMWRITE_JPEG_QUALITY, self.quality])
+        with open(filePath, 'wb') as f:
+            f.write(data.tostring())
+        self.files.append(filePath)
+
+    def finish(self):
+        self.flush()
+        return self.files
+
+
+class PpmStream():
+    """ Write the row bands straight into one binary PPM. """
+    def __init__(self, output, width, height):
+        self.output = output
+        if output == '-':
+            self.f = sys.stdout
+        else:
+            self.f = open(output, 'wb')
+        self.f.write("P6\n{0} {1}\n255\n".format(width, height))
+
+    def add(self, band):
+        self.f.write(cv2.cvtColor(band, cv2.COLOR_BGR2RGB).tostring())
+
+    def finish(self):
+        self.f.flush()
+        if self.f is not sys.stdout:
+            self.f.close()
+        return [self.output]
+
+
+def main():
+    args = parseArguments()
+    files = sorted(glob.glob(os.path.join(args.input, args.pattern)))
+    if not files:
+        print "no portraits found in '{0}'".format(args.input)
+        return 1
+
+    # the first portrait defines the tile ratio
+    first = cv2.imread(files[0])
+    if first is None:
+        print "could not read '{0}'".format(files[0])
+        return 1
+    sourceSize = (first.shape[1], first.shape[0])
+    tileHeight = args.tile_height or int(round(args.tile_width * float(sourceSize[1]) / sourceSize[0]))
+    del first
+
+    background = [int(c) for c in reversed(args.background.split(","))]
+    decoder = TileDecoder(args.tile_width, tileHeight, background)
+
+    columns = args.columns
+    rows = (len(files) + columns - 1) // columns
+    width = columns * args.tile_width + (columns + 1) * args.gap
+    height = rows * (tileHeight + args.gap) + args.gap
+    if args.ppm:
+        writer = PpmStream(args.ppm, width, height)
+    else:
+        # a band is a row of tiles with the gap above, the last one also below
+        bandHeight = tileHeight + args.gap
+        rowsPerFile = args.rows_per_file or max(STRIP_BYTES // (bandHeight * width * 3), 1)
+        rowsPerFile = min(rowsPerFile, rows, (JPEG_MAX_SIZE - args.gap) // bandHeight)
+        if width > JPEG_MAX_SIZE or rowsPerFile < 1:
+            print "the wall is too large for a JPEG, use --ppm or smaller tiles"
+            return 1
+        if args.rows_per_file and rowsPerFile < min(args.rows_per_file, rows):
+            print "only {0} rows fit into a JPEG, writing those per file".format(rowsPerFile)
+        writer = JpegStrips(args.output, rowsPerFile, args.quality, rows,
+                            width, rowsPerFile * bandHeight + args.gap)
+    log = sys.stderr if args.ppm == '-' else sys.stdout
+
+    pool = ThreadPool(args.workers)
+    startTime = time.time()
+    rowFiles = [files[i:i+columns] for i in range(0, len(files), columns)]
+    pending = pool.map_async(decoder.decode, rowFiles[0])
+    for rowIndex in range(rows):
+        tiles = pending.get()
+        # decode the next row while this one is placed and written
+        if rowIndex + 1 < rows:
+            pending = pool.map_async(decoder.decode, rowFiles[rowIndex + 1])
+
+        # each band carries the gap above its tiles, the last one also below
+        bandHeight = tileHeight + args.gap
+        if rowIndex == rows - 1:
+            bandHeight += args.gap
+        band = np.empty((bandHeight, width, 3), np.uint8)
+        band[:] = background
+        for i, tile in enumerate(tiles):
+            left = args.gap + i * (args.tile_width + args.gap)
+            band[args.gap:args.gap+tileHeight, left:left+args.tile_width] = tile
+        writer.add(band)
+
+        done = min((rowIndex + 1) * columns, len(files))
+        log.write("\rrow {0}/{1}, {2} portraits, {3:.1f}/s   ".format(
+            rowIndex + 1, rows, done, done / max(time.time() - startTime, 1e-6)))
+        log.flush()
+
+    written = writer.finish()
+    pool.close()
+    pool.join()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    log.write("\n{0} portraits in {1:.1f} s into {2}x{3} px ({4} unreadable), peak memory {5:.0f} MB\n".format(
+        len(files), time.time() - startTime, width, height, decoder.failed, peak))
+    for filePath in written:
+        log.write("  {0}\n".format(filePath))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
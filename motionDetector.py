@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Cheap motion detection on tiny grayscale frames, used to slow down the
+# live view while nobody is in front of the booth and to wake it up again.
+
+import time
+import numpy as np
+import cv2
+
+from PyQt4.QtCore import QBuffer, QByteArray, QIODevice
+
+from jpegEncoder import readScaled, qimageToArray
+
+# size of the frame the difference is computed on
+MOTION_SIZE = (32, 24)
+
+# mean absolute difference (in gray levels) which counts as motion
+MOTION_THRESHOLD = 4.0
+
+# seconds without motion before the live view slows down
+IDLE_AFTER = 10
+
+
+def decodePreview(data):
+    """ Decode a JPEG preview to a small gray image, reduced while decoding; None if broken. """
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    buffer.open(QIODevice.ReadOnly)
+    # twice the motion size, shrink() averages it down
+    image = readScaled(buffer, MOTION_SIZE[0] * 2)
+    if image is None:
+        return None
+    return cv2.cvtColor(qimageToArray(image), cv2.COLOR_BGR2GRAY)
+
+
+class MotionPacer():
+    def __init__(self, activeInterval, idleInterval, idleAfter=IDLE_AFTER, threshold=MOTION_THRESHOLD):
+        self.activeInterval = activeInterval
+        self.idleInterval = idleInterval
+        self.idleAfter = idleAfter
+        self.threshold = threshold
+        self.previous = None
+        self.lastMotion = time.time()
+
+    def shrink(self, frame):
+        small = cv2.resize(frame, MOTION_SIZE, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    def update(self, frame):
+        """ Compare the frame with the previous one, returns True on motion. """
+        if frame is None:
+            return False
+        small = self.shrink(frame)
+        previous = self.previous
+        self.previous = small
+        if previous is None:
+            return False
+
+        score = np.abs(small - previous).mean()
+        if score > self.threshold:
+            self.lastMotion = time.time()
+            return True
+        return False
+
+    def poke(self):
+        """ Treat the current moment as motion (e.g. a key was pressed). """
+        self.lastMotion = time.time()
+
+    def reset(self):
+        self.previous = None
+
+    def interval(self):
+        """ The frame interval (in ms) fitting the recent motion. """
+        if time.time() - self.lastMotion < self.idleAfter:
+            return self.activeInterval
+        return self.idleInterval
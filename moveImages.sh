@@ -5,17 +5,13 @@ if [ "$#" -ne 1 ]; then
   exit 1
 fi
 
-if [ -d "$1" ]; then
-  echo "Archive directory already exists, choose another name." >&2
-  exit 1
-fi
-
-folders="deleted pictures pictures_raw prints series thumbnails"
-archive=$1
-
-mkdir $archive
-for folder in $folders
-do
-    mv $folder $archive
-    mkdir $folder
-done
+# moves the folders into the archive directory, recreates them empty and
+# packs the archive into ARCHIVE_DIR.zip with a checksum index; while the
+# booth is running, use Ctrl+E instead
+# ARCHIVE_DIR is relative to where the script is called from
+case "$1" in
+  /*) target="$1" ;;
+  *) target="$PWD/$1" ;;
+esac
+cd "$(dirname "$0")"
+exec python eventArchive.py "$target"
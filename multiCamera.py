@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Further cameras that take their pictures together with the booth's own
+# camera. Every camera has its own thread which keeps the device open; a
+# webcam thread keeps grabbing, so the frame after the trigger is a fresh
+# one and not an old one from the driver's buffer. On a trigger all threads
+# take their picture at once and note when they did, the spread of these
+# time stamps (skew) and the total capture time are reported.
+
+import os
+import time
+import threading
+
+import cv2
+
+from PyQt4.QtCore import QObject, pyqtSignal
+
+from boothMetrics import METRICS
+from captureJournal import JOURNAL
+from jpegEncoder import ENCODE_PROFILES, writeFile
+
+# how long a webcam thread waits between grabs when the device failed
+RETRY_INTERVAL = 1.0
+
+
+class CameraResult():
+    def __init__(self, name, filePath, timestamp, endTime):
+        self.name = name
+        # None if the camera failed
+        self.filePath = filePath
+        self.timestamp = timestamp
+        self.endTime = endTime
+
+
+class CameraWorker(threading.Thread):
+    """ Owns one camera, e.g. {'name': "links", 'type': 'webcam', 'index': 1}
+        or {'name': "dslr", 'type': 'camera', 'port': "usb:001,007"}. """
+    def __init__(self, config, rig):
+        threading.Thread.__init__(self, name="camera_" + config['name'])
+        self.daemon = True
+        self.config = config
+        self.cameraName = config['name']
+        self.kind = config.get('type', 'webcam')
+        self.rig = rig
+        self.filePath = None
+        self.triggerEvent = threading.Event()
+        self.stopEvent = threading.Event()
+        self.capture = None
+        self.camera = None
+
+    def openDevice(self):
+        if self.kind == 'webcam':
+            self.capture = cv2.VideoCapture(self.config.get('index', 0))
+        else:
+            from gphotoCamera import GphotoCamera
+            self.camera = GphotoCamera(self.config.get('imageFormat'), self.config.get('port'))
+
+    def shoot(self, filePath):
+        self.filePath = filePath
+        self.triggerEvent.set()
+
+    def run(self):
+        try:
+            self.openDevice()
+        except Exception as e:
+            print "could not open camera '{0}': {1}".format(self.cameraName, e)
+
+        while not self.stopEvent.is_set():
+            if self.kind == 'webcam' and self.capture is not None and self.capture.isOpened():
+                # the next grab after the trigger is the picture, exposed
+                # from the start of the grab
+                triggered = self.triggerEvent.is_set()
+                timestamp = time.time()
+                if not self.capture.grab():
+                    self.stopEvent.wait(RETRY_INTERVAL)
+                if triggered:
+                    self.triggerEvent.clear()
+                    self.takeWebcamImage(timestamp)
+            elif self.triggerEvent.wait(0.5):
+                self.triggerEvent.clear()
+                self.takeCameraImage()
+
+        if self.capture is not None:
+            self.capture.release()
+        if self.camera is not None:
+            self.camera.exit()
+
+    def takeWebcamImage(self, timestamp):
+        filePath = self.filePath
+        try:
+            ok, frame = self.capture.retrieve()
+            if not ok:
+                raise IOError("no frame")
+            endTime = time.time()
+            # mirrored like the picture of the booth's webcam
+            frame = cv2.flip(frame, 1)
+            ok, data = cv2.imencode(".jpg", frame, ENCODE_PROFILES['archive'].imencodeParams())
+            writeFile(filePath, data.tostring())
+        except Exception as e:
+            print "camera '{0}' failed: {1}".format(self.cameraName, e)
+            filePath = None
+            endTime = time.time()
+        self.rig.addResult(CameraResult(self.cameraName, filePath, timestamp, endTime))
+
+    def takeCameraImage(self):
+        # the shutter releases right at the start of the call
+        timestamp = time.time()
+        filePath = self.filePath
+        try:
+            if self.camera is None:
+                raise IOError("not connected")
+            self.camera.capture_image(JOURNAL.tempPath(filePath))
+            JOURNAL.commitFile(filePath)
+        except Exception as e:
+            print "camera '{0}' failed: {1}".format(self.cameraName, e)
+            filePath = None
+        self.rig.addResult(CameraResult(self.cameraName, filePath, timestamp, time.time()))
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join()
+
+
+class MultiCamera(QObject):
+    # emitted from the last camera thread, delivered in the GUI thread
+    captured = pyqtSignal()
+
+    def __init__(self, cameras):
+        QObject.__init__(self)
+        self.lock = threading.Lock()
+        self.results = []
+        self.pending = 0
+        self.triggerTime = 0
+        self.workers = [CameraWorker(config, self) for config in cameras]
+        for worker in self.workers:
+            worker.start()
+
+    def trigger(self, folder, baseName, ownCameras=1):
+        """ Let all cameras take a picture into folder/<baseName>_<camera>.jpg.
+            The booth's own cameras report with addResult, captured is
+            emitted once all pictures are written. """
+        with self.lock:
+            self.results = []
+            self.pending = len(self.workers) + ownCameras
+            self.triggerTime = time.time()
+        for worker in self.workers:
+            worker.shoot(os.path.join(folder, "{0}_{1}.jpg".format(baseName, worker.cameraName)))
+
+    def addResult(self, result):
+        with self.lock:
+            self.results.append(result)
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            self.report()
+            self.captured.emit()
+
+    def pictureFiles(self, order=None):
+        """ The written pictures, in the order of the given camera names. """
+        results = [r for r in self.results if r.filePath is not None]
+        if order is not None:
+            results.sort(key=lambda r: order.index(r.name) if r.name in order else len(order))
+        return [r.filePath for r in results]
+
+    def report(self):
+        stamps = [r.timestamp for r in self.results]
+        skew = max(stamps) - min(stamps)
+        total = max(r.endTime for r in self.results) - self.triggerTime
+        METRICS.observe('cameraSkew', skew)
+        METRICS.observe('multiCapture', total)
+        first = min(stamps)
+        print "{0} cameras: skew {1:.0f} ms, total {2:.0f} ms ({3})".format(
+            len(self.results), skew * 1000, total * 1000, ", ".join(
+                "{0} +{1:.0f} ms{2}".format(r.name, (r.timestamp - first) * 1000,
+                                            "" if r.filePath else " failed")
+                for r in sorted(self.results, key=lambda r: r.timestamp)))
+
+    def cameraNames(self):
+        return [worker.cameraName for worker in self.workers]
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
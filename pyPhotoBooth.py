@@ -9,6 +9,7 @@ import sys, os
 import psutil
 import glob
 import time
+import threading
 
 # used for the webcam
 import numpy as np
@@ -19,6 +20,51 @@ sys.path.append('piggyphoto/')
 import piggyphoto
 import gphoto2 as gp
 
+# instrumentation
+from boothMetrics import METRICS
+from stallDetector import StallDetector
+from samplingProfiler import SamplingProfiler
+from resourceMonitor import ResourceMonitor
+
+# motion detection for the live view
+from motionDetector import MotionPacer, decodePreview
+
+# JPEG encoding off the GUI thread
+from jpegEncoder import JpegEncoder
+
+# the camera in a separate process
+from captureService import CaptureService, RingVideoCapture, RingCamera
+
+# short video clips
+from clipRecorder import ClipRecorder
+
+# crash-safe writing of the pictures
+from captureJournal import JOURNAL
+
+# new files in RAM first, flushed to the (slow) disk in the background
+from stagingStore import STAGING
+
+# archiving of an event while the booth keeps running
+from eventArchive import archiveEvent, resumeArchives
+
+# further cameras triggered together with the main one
+from multiCamera import MultiCamera, CameraResult
+
+# web gallery for the guests' phones
+from galleryServer import GalleryServer
+
+# slideshow on a second screen
+from slideshow import SlideshowWindow, SLIDESHOW_COUNT
+
+# several booths sharing the picture folders
+from gallerySync import GallerySync
+
+# copies of all pictures on an S3 compatible storage
+from uploadQueue import UploadQueue
+
+# all thumbnails in one memory-mapped file
+from thumbnailAtlas import ThumbnailAtlas
+
 # the UI
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
@@ -30,12 +76,68 @@ from photoBoothUI import Ui_photoBooth
 #  webcam: use internal webcam
 CAM_MODE = 'auto'
 
+# run the webcam / camera in a separate process, restarted if it crashes or hangs
+CAPTURE_SERVICE = True
+
+# further cameras, triggered together with the main one in single picture
+# mode; all pictures are composed into one sheet like a series (so at most
+# three of them), e.g.
+#   [{'name': "links", 'type': 'webcam', 'index': 1},
+#    {'name': "dslr", 'type': 'camera', 'port': "usb:001,007"}]
+CAMERAS = []
+
+# serve the gallery to the guests' phones on this port (None: off)
+GALLERY_PORT = None
+
+# show a slideshow of the newest pictures on this screen, if connected (None: off)
+SLIDESHOW_SCREEN = 1
+
+# watch the picture folders (e.g. shared by several booths) and update the
+# gallery picture by picture instead of reading the whole folder every time
+GALLERY_SYNC = False
+
+# upload the pictures and prints to an S3 compatible storage (None: off), e.g.
+#   {'endpoint': "http://192.168.1.2:9000", 'bucket': "fotobox", 'prefix': "hochzeit/",
+#    'accessKey': "...", 'secretKey': "...", 'rate': 512*1024}
+UPLOAD_TARGET = None
+
+# write new files to a folder in RAM first and copy them to the paths below
+# in the background (None: off); writing waits once STAGING_LIMIT_MB are staged
+STAGING_PATH = "/dev/shm/photobooth"
+STAGING_LIMIT_MB = 256
+
+# pack the thumbnails into one memory-mapped file (thumbnails/.atlas.*), so
+# the gallery loads without reading a file per picture (benchmarkAtlas.py)
+THUMBNAIL_ATLAS = True
+
 # paths to generated files
 DELETED_PATH = "deleted/"
 PICTURE_PATH = "pictures/"
 PRINTS_PATH = "prints/"
 SERIES_PATH = "series/"
+CLIPS_PATH = "clips/"
 THUMBNAIL_PATH = "thumbnails/"
+THUMBNAIL_PLACEHOLDER = "graphics/picture_single.png"
+
+# latency metrics: Prometheus endpoint (http://localhost:PORT/metrics) and log
+METRICS_PORT = 9100
+METRICS_LOG_PATH = "logs/metrics_photobooth.json"
+
+# event loop watchdog: log the call blocking the GUI longer than the threshold
+STALL_THRESHOLD_MS = 250
+HEARTBEAT_MS = 50
+
+# slow the live view down to IDLE_INTERVAL_MS while nothing moves and wake it
+# up from hibernation on motion (checked every MOTION_PROBE_MS)
+ADAPTIVE_LIVEVIEW = True
+IDLE_INTERVAL_MS = 500
+MOTION_WAKE = True
+MOTION_PROBE_MS = 1000
+
+# clip mode: formats to encode ('mp4', 'gif') and whether to play the clip
+# forward and backward
+CLIP_FORMATS = ['mp4', 'gif']
+CLIP_BOOMERANG = True
 
 # dimensions
 class Dimensions():
@@ -63,6 +165,7 @@ S_DISPLAY = 'displayImage'
 
 M_SINGLE = 's'
 M_MULTI = 'm'
+M_CLIP = 'c'
 
 
 def getFilePath(pictureMode, seriesFolder = "", composedImage = False):
@@ -71,6 +174,8 @@ def getFilePath(pictureMode, seriesFolder = "", composedImage = False):
     basename = currentTimeString
     if pictureMode == M_SINGLE:
         suffix = "_single"
+    elif pictureMode == M_CLIP:
+        suffix = "_clip"
     elif pictureMode == M_MULTI:
         if not composedImage:
             suffix = "_partial"
@@ -97,40 +202,47 @@ def getSeriesFolder():
     return currentTimeString
 
 
-def createThumbnails(redoAll = False):
-    pictureFiles = filter(os.path.isfile, glob.glob(PICTURE_PATH + "*.jpg"))
+@METRICS.timed('createThumbnails')
+def createThumbnails(encoder, redoAll = False, callback = None, pictureFiles = None):
+    """ Let the encoder create the missing thumbnails in the background. """
+    if pictureFiles is None:
+        pictureFiles = STAGING.glob(PICTURE_PATH + "*.jpg")
     for f in pictureFiles:
         thumbnailFile = f.replace(PICTURE_PATH, THUMBNAIL_PATH)
-        if ( redoAll or not os.path.isfile(thumbnailFile) ):
-            image = QImage(f)
-            thumbnail = image.scaledToWidth(200)
-            thumbnail.save(thumbnailFile, "JPG", 90)
+        if ( redoAll or not os.path.isfile(STAGING.resolve(thumbnailFile)) ):
+            encoder.scaleFile(f, thumbnailFile, 200, 'thumbnail', callback)
 
 
-def getPictureList():
+def getPictureList(atlas = None):
     # get a sorted list of files
-    pictureFiles = filter(os.path.isfile, glob.glob(PICTURE_PATH + "*.jpg"))
-    pictureFiles.sort(key=lambda x: os.path.getctime(x))
+    pictureFiles = STAGING.glob(PICTURE_PATH + "*.jpg")
+    pictureFiles.sort(key=lambda x: STAGING.getctime(x))
     pictureFiles.reverse()
 
     # go through the filenames and create QIcons
-    pictures = []
-    for f in pictureFiles:
-        timeInfo = time.strftime( "%H:%M:%S", time.localtime(os.path.getctime(f)) )
+    return [getPictureEntry(f, atlas) for f in pictureFiles]
 
-        # use the thumbnail if it exists
-        thumbnailFile = f.replace(PICTURE_PATH, THUMBNAIL_PATH)
+
+def getPictureEntry(f, atlas = None):
+    ctime = STAGING.getctime(f)
+    timeInfo = time.strftime( "%H:%M:%S", time.localtime(ctime) )
+
+    # use the thumbnail from the atlas or its file if it exists, otherwise a
+    # placeholder until thumbnailCreated (never the full picture)
+    thumbnail = atlas.icon(os.path.basename(f)) if atlas is not None else None
+    if thumbnail is None:
+        thumbnailFile = STAGING.resolve(f.replace(PICTURE_PATH, THUMBNAIL_PATH))
         if not os.path.isfile(thumbnailFile):
-            thumbnailFile = f
+            thumbnailFile = THUMBNAIL_PLACEHOLDER
         thumbnail = QIcon(thumbnailFile)
 
-        pictures.append({
-            "title": timeInfo,
-            "pic":   thumbnail,
-            "path":  f,
-            "base":  os.path.splitext( os.path.basename(f) )[0]
-        })
-    return pictures
+    return {
+        "title": timeInfo,
+        "pic":   thumbnail,
+        "path":  f,
+        "base":  os.path.splitext( os.path.basename(f) )[0],
+        "time":  ctime
+    }
 
 
 class BoothUI(QWidget):
@@ -139,10 +251,25 @@ class BoothUI(QWidget):
         QWidget.__init__(self, parent)
         self.ui = Ui_photoBooth()
         self.ui.setupUi(self)
+        # before anything is written (or a process is started that reads)
+        if STAGING_PATH is not None:
+            STAGING.open(STAGING_PATH, STAGING_LIMIT_MB*1024*1024)
         self.initObjects()
 
+        # clean up after a crash before showing the pictures
+        JOURNAL.open()
+        unfinished = JOURNAL.recover([PICTURE_PATH, SERIES_PATH, THUMBNAIL_PATH], DELETED_PATH)
+        qApp.aboutToQuit.connect(JOURNAL.stop)
+        # unlike a portrait there is no raw picture to finish them from, the
+        # frame or the camera's file was only in memory
+        for filePath in unfinished:
+            print "lost in the crash: '{0}'".format(filePath)
+
         # display the latest pictures
         self.updatePictureList()
+        if self.slideshow is not None and not self.slideshow.showOnScreen():
+            self.slideshow.stop()
+            self.slideshow = None
 
         # detect if an external camera has been connected
         global USE_WEBCAM
@@ -168,6 +295,19 @@ class BoothUI(QWidget):
         quit_action.triggered.connect(qApp.closeAllWindows)
         self.addAction(quit_action)
 
+        # hidden sampling profiler (writes flame graph stacks to profiles/)
+        profile_action = QAction('Profile', self)
+        profile_action.setShortcut('Ctrl+P')
+        profile_action.triggered.connect(self.toggleProfiler)
+        self.addAction(profile_action)
+        qApp.aboutToQuit.connect(self.stopProfiler)
+
+        # archive the event so far and continue with an empty gallery
+        archive_action = QAction('Archive', self)
+        archive_action.setShortcut('Ctrl+E')
+        archive_action.triggered.connect(self.archiveCurrentEvent)
+        self.addAction(archive_action)
+
         # toggle mode
         self.ui.pushButton_switchMode.clicked.connect(self.toggleMode)
         scMode = QShortcut(QKeySequence(Qt.Key_M), self, self.toggleMode)
@@ -185,6 +325,25 @@ class BoothUI(QWidget):
         self.ui.pushButton_delete.clicked.connect(self.deleteSelectedImage)
         scDelete = QShortcut(QKeySequence(Qt.Key_L), self, self.deleteSelectedImage)
 
+        # latency metrics and their on-screen overlay
+        scMetrics = QShortcut(QKeySequence(Qt.Key_D), self, self.toggleMetricsOverlay)
+        METRICS.startServer(METRICS_PORT)
+        METRICS.startJsonLog(METRICS_LOG_PATH)
+        qApp.aboutToQuit.connect(METRICS.stop)
+
+        # watch the event loop for stalls
+        self.stallDetector = StallDetector(STALL_THRESHOLD_MS/1000.0, HEARTBEAT_MS/1000.0)
+        self.heartbeat = QTimer()
+        self.heartbeat.timeout.connect(self.stallDetector.beat)
+        self.heartbeat.start(HEARTBEAT_MS)
+        self.stallDetector.start()
+        qApp.aboutToQuit.connect(self.stallDetector.stop)
+
+        # record memory, CPU and disk usage over the event
+        self.resourceMonitor = ResourceMonitor([PICTURE_PATH, SERIES_PATH, CLIPS_PATH, PRINTS_PATH, THUMBNAIL_PATH, DELETED_PATH])
+        self.resourceMonitor.start()
+        qApp.aboutToQuit.connect(self.resourceMonitor.stop)
+
 
     def initObjects(self):
         self.printDim = Dimensions()
@@ -193,16 +352,74 @@ class BoothUI(QWidget):
             "pic":   QIcon("graphics/picture_single.png"),
             "path":  "graphics/picture_single.png"
         }
-        self.modeTitle = { 's': "Einzelbild", 'm': "Bilderserie" }
+        self.modeTitle = { 's': "Einzelbild", 'm': "Bilderserie", 'c': "Kurzvideo" }
         self.modeIcon = {
             's': QPixmap(":/icon/graphics/picture_single.png"),
-            'm': QPixmap(":/icon/graphics/picture_multi.png")
+            'm': QPixmap(":/icon/graphics/picture_multi.png"),
+            'c': QPixmap(":/icon/graphics/liveview.png")
         }
         self.ui.currentState = S_LIVEVIEW
         self.ui.currentMode = M_SINGLE
         self.multiShotFolder = ""
         self.multiShotLastImage = ""
         self.countDownOverlayActive = False
+        self.countDownEndTime = 0
+        self.metricsOverlayActive = False
+        self.profiler = None
+        self.archivePacker = None
+        self.archiveWait = None
+        for packer in resumeArchives():
+            qApp.aboutToQuit.connect(packer.stop)
+
+        self.encoder = JpegEncoder()
+        qApp.aboutToQuit.connect(self.encoder.finish)
+
+        # painted on top of the live view / picture, in this order
+        for layer in [self.paintCountdown, self.paintRecording, self.paintMetrics, self.paintWarning]:
+            self.ui.pictureView.addLayer(layer)
+
+        if GALLERY_PORT:
+            self.galleryServer = GalleryServer(".", GALLERY_PORT)
+            self.galleryServer.start()
+            qApp.aboutToQuit.connect(self.galleryServer.stop)
+
+        self.slideshow = None
+        if SLIDESHOW_SCREEN is not None:
+            self.slideshow = SlideshowWindow(SLIDESHOW_SCREEN)
+            qApp.aboutToQuit.connect(self.slideshow.stop)
+
+        self.thumbnailAtlas = None
+        if THUMBNAIL_ATLAS:
+            self.thumbnailAtlas = ThumbnailAtlas(THUMBNAIL_PATH)
+            qApp.aboutToQuit.connect(self.thumbnailAtlas.close)
+
+        self.gallerySync = None
+        if GALLERY_SYNC:
+            self.gallerySync = GallerySync([PICTURE_PATH, THUMBNAIL_PATH])
+            self.gallerySync.changed.connect(self.applyGalleryChanges)
+            self.gallerySync.rescan.connect(self.updatePictureList)
+            qApp.aboutToQuit.connect(self.gallerySync.stop)
+
+        self.uploadQueue = None
+        if UPLOAD_TARGET is not None:
+            self.uploadQueue = UploadQueue(UPLOAD_TARGET, folders=[PICTURE_PATH, SERIES_PATH, PRINTS_PATH])
+            self.uploadQueue.start()
+            qApp.aboutToQuit.connect(self.uploadQueue.stop)
+
+        self.multiCamera = None
+        self.multiCameraShot = None
+        if CAMERAS:
+            if len(CAMERAS) > 3:
+                print "only 4 pictures fit on a sheet, not using the cameras {0}".format(
+                    ", ".join(c['name'] for c in CAMERAS[3:]))
+            self.multiCamera = MultiCamera(CAMERAS[:3])
+            self.multiCamera.captured.connect(self.multiCameraCaptured)
+            qApp.aboutToQuit.connect(self.multiCamera.stop)
+
+        if not os.path.exists(CLIPS_PATH):
+            os.makedirs(CLIPS_PATH)
+        self.clipRecorder = ClipRecorder(CLIP_FORMATS, CLIP_BOOMERANG)
+        qApp.aboutToQuit.connect(self.clipRecorder.stop)
 
         self.countDownTimer = QTimer()
         self.countDownTimer.timeout.connect(self.shotCountDown)
@@ -212,6 +429,10 @@ class BoothUI(QWidget):
         self.camHibernate.timeout.connect(self.pauseLiveview)
         self.camHibernate.setInterval(3*60*1000)
 
+        self.motionProbe = QTimer()
+        self.motionProbe.timeout.connect(self.probeMotion)
+        self.motionProbe.setInterval(MOTION_PROBE_MS)
+
         self.printerPDF = QPrinter()
         self.printerPDF.setOrientation(QPrinter.Portrait)
         self.printerPDF.setPaperSize(self.printDim.getPageSize(), self.printDim.getPageSizeUnit())
@@ -222,62 +443,75 @@ class BoothUI(QWidget):
 
 
     def toggleMode(self):
-        """ Toggle the mode between single and multiple photos """
+        """ Toggle the mode between single photos, multiple photos and clips """
         # switch mode
         if self.ui.currentMode == M_SINGLE:
             self.ui.currentMode = M_MULTI
-        else:
+        elif self.ui.currentMode == M_MULTI:
             self.multiShotFolder = ""
+            self.ui.currentMode = M_CLIP
+            # the encoder is only started if clips are made at all
+            self.clipRecorder.open()
+        else:
             self.ui.currentMode = M_SINGLE
 
         # update the UI
         self.ui.label_captureMode.setText(self.modeTitle[self.ui.currentMode])
         self.ui.label_captureModeIcon.setPixmap(self.modeIcon[self.ui.currentMode])
 
-        createThumbnails()
+        createThumbnails(self.encoder, callback=self.thumbnailCreated)
 
 
     def setupWebcam(self):
         """ Initialize webcam camera and get regular pictures """
-        self.capture = cv2.VideoCapture(0)
+        if CAPTURE_SERVICE:
+            self.captureService = CaptureService('webcam')
+            self.captureService.start()
+            qApp.aboutToQuit.connect(self.captureService.stop)
+            self.capture = RingVideoCapture(self.captureService)
+        else:
+            self.capture = cv2.VideoCapture(0)
 
         self.camRefresh = QTimer()
         self.camRefresh.timeout.connect(self.displayWebcamStream)
         self.camRefresh.setInterval(50)
         self.camRefresh.start()
+        self.motionPacer = MotionPacer(50, IDLE_INTERVAL_MS)
 
         self.camHibernate.start()
 
 
     def setupCamera(self):
         """ Initialize the camera and get regular preview pictures. """
-        self.camera = piggyphoto.Camera()
+        if CAPTURE_SERVICE:
+            self.captureService = CaptureService('camera', 0.1)
+            self.captureService.start()
+            qApp.aboutToQuit.connect(self.captureService.stop)
+            self.camera = RingCamera(self.captureService)
+        else:
+            self.camera = piggyphoto.Camera()
         self.camera.leave_locked()
 
         self.camRefresh = QTimer()
         self.camRefresh.timeout.connect(self.displayCameraPreview)
         self.camRefresh.setInterval(100)
         self.camRefresh.start()
+        self.motionPacer = MotionPacer(100, IDLE_INTERVAL_MS)
         self.camHibernate.start()
 
 
+    @METRICS.timed('displayCameraPreview')
     def displayCameraPreview(self):
-        """ Read frame from camera and repaint QLabel widget. """
+        """ Read frame from camera and show it in the picture view. """
         preview = self.camera.capture_preview()
+        previewData = preview.to_pixbuf()
+        if ADAPTIVE_LIVEVIEW:
+            self.adaptLiveviewRate(decodePreview(previewData))
+        if self.clipRecorder.recording:
+            self.recordClipFrame(cv2.imdecode(np.frombuffer(previewData, np.uint8), 1))
 
-        # load from temporary file
-        pixmap = QPixmap()
-        pixmap.loadFromData(preview.to_pixbuf(), "JPG")
-
-        # scale the image down if necessary
-        pixmap = self.scaleImageToLabel(pixmap)
-
-        # overlay the countdown on the image if activated
-        if self.countDownOverlayActive:
-            pixmap = self.overlayCountdown(pixmap)
-
-        # set image
-        self.ui.label_pictureView.setPixmap(pixmap)
+        # the view scales it while painting, the overlays are its layers
+        self.ui.pictureView.setImage(QImage.fromData(previewData, "JPG"))
 
         # free unused memory (not tested if this works)
         preview.clean()
@@ -285,6 +519,9 @@ class BoothUI(QWidget):
 
     def captureFrame(self):
         _, frame = self.capture.read()
+        if frame is None:
+            # no frame from the camera (yet)
+            return None
 
         # get the current ratio
         frameSize = cv.GetSize(cv.fromarray(frame))
@@ -305,37 +542,31 @@ class BoothUI(QWidget):
         return newFrame
 
 
-    def scaleImageToLabel(self, pixmap):
-        """ Scale the image to the label's area. """
-        labelWidth = self.ui.label_pictureView.width()
-        labelHeight = self.ui.label_pictureView.height()
-        return pixmap.scaled(labelWidth, labelHeight, Qt.KeepAspectRatio)
-
-
+    @METRICS.timed('displayWebcamStream')
     def displayWebcamStream(self):
-        """ Read frame from camera and repaint QLabel widget. """
+        """ Read frame from camera and show it in the picture view. """
         frame = self.captureFrame()
+        if frame is None:
+            return
+        if ADAPTIVE_LIVEVIEW:
+            self.adaptLiveviewRate(frame)
 
         # apply some corrections to the live feed
-        frame = cv2.cvtColor(frame, cv2.cv.CV_BGR2RGB)
         frame = cv2.flip(frame, 1)
+        if self.clipRecorder.recording:
+            self.recordClipFrame(frame)
+        frame = cv2.cvtColor(frame, cv2.cv.CV_BGR2RGB)
         image = QImage(frame, frame.shape[1], frame.shape[0],
                        frame.strides[0], QImage.Format_RGB888)
 
-        # scale the image down if necessary
-        pixmap = self.scaleImageToLabel(QPixmap.fromImage(image))
-
-        # overlay the countdown on the image if activated
-        if self.countDownOverlayActive:
-            pixmap = self.overlayCountdown(pixmap)
-
-        # set image
-        self.ui.label_pictureView.setPixmap(pixmap)
+        # the view scales it while painting, the overlays are its layers;
+        # the image uses the memory of the frame, which has to live until then
+        self.ui.pictureView.setImage(image, frame)
 
 
-    def overlayCountdown(self, pixmap):
-        canvas = QPainter()
-        canvas.begin(pixmap)
+    def paintCountdown(self, canvas, rect):
+        if not self.countDownOverlayActive:
+            return
         shadowOffset = 2
 
         counterTitle = "Foto in"
@@ -349,8 +580,8 @@ class BoothUI(QWidget):
         counterValue = "{0}".format(self.countDownValue+1)
 
         # the counter title
-        counterTitleRect = pixmap.rect()
-        counterTitleRect.setHeight(pixmap.height()/2)
+        counterTitleRect = QRect(rect)
+        counterTitleRect.setHeight(rect.height()/2)
         counterTitleFont = QFont("Helvetica Neue")
         counterTitleFont.setPointSize(100)
         canvas.setFont( counterTitleFont )
@@ -381,28 +612,93 @@ class BoothUI(QWidget):
         canvas.setFont( counterValueFont )
 
         canvas.setPen( Qt.black )
-        rect1 = pixmap.rect()
+        rect1 = QRect(rect)
         rect1.translate(0,shadowOffset)
         canvas.drawText( rect1, Qt.AlignCenter, counterValue )
 
-        rect2 = pixmap.rect()
+        rect2 = QRect(rect)
         rect2.translate(0,-shadowOffset)
         canvas.drawText( rect2, Qt.AlignCenter, counterValue )
 
-        rect3 = pixmap.rect()
+        rect3 = QRect(rect)
         rect3.translate(shadowOffset,0)
         canvas.drawText( rect3, Qt.AlignCenter, counterValue )
 
-        rect4 = pixmap.rect()
+        rect4 = QRect(rect)
         rect4.translate(-shadowOffset,0)
         canvas.drawText( rect4, Qt.AlignCenter, counterValue )
 
         canvas.setPen( Qt.white )
-        canvas.drawText( pixmap.rect(), Qt.AlignCenter, counterValue )
+        canvas.drawText( QRect(rect), Qt.AlignCenter, counterValue )
 
 
-        canvas.end()
-        return pixmap
+    def paintRecording(self, canvas, rect):
+        """ A red dot in the corner while a clip is recorded. """
+        if not self.clipRecorder.recording:
+            return
+        canvas.setRenderHint(QPainter.Antialiasing)
+        canvas.setPen(Qt.NoPen)
+        canvas.setBrush(QColor(220, 30, 30))
+        radius = max(rect.height() / 30, 8)
+        canvas.drawEllipse(QPoint(3*radius, 3*radius), radius, radius)
+
+
+    def paintMetrics(self, canvas, rect):
+        """ Draw the latency summary of all stages in the upper left corner. """
+        if not self.metricsOverlayActive:
+            return
+        lines = METRICS.summaryLines()
+
+        metricsFont = QFont("Menlo")
+        metricsFont.setStyleHint(QFont.TypeWriter)
+        metricsFont.setPointSize(11)
+        canvas.setFont( metricsFont )
+
+        lineHeight = canvas.fontMetrics().height()
+        boxWidth = max([canvas.fontMetrics().width(l) for l in lines]) + 20
+        boxHeight = lineHeight * len(lines) + 20
+        canvas.fillRect(0,0, boxWidth, boxHeight, QColor(0,0,0,160))
+
+        canvas.setPen( Qt.white )
+        for i, line in enumerate(lines):
+            canvas.drawText( 10, 10 + lineHeight*(i+1) - canvas.fontMetrics().descent(), line )
+
+
+    def paintWarning(self, canvas, rect):
+        """ Draw a red bar with a warning at the bottom of the picture. """
+        message = self.resourceMonitor.warning
+        if not message:
+            return
+        warningFont = QFont("Helvetica Neue")
+        warningFont.setPointSize(16)
+        canvas.setFont( warningFont )
+
+        barHeight = canvas.fontMetrics().height() + 16
+        warningRect = QRect(0, rect.height() - barHeight, rect.width(), barHeight)
+        canvas.fillRect(warningRect, QColor(200,30,30,200))
+        canvas.setPen( Qt.white )
+        canvas.drawText( warningRect, Qt.AlignCenter, QString.fromUtf8(message) )
+
+
+    def toggleMetricsOverlay(self):
+        """ Show or hide the latency numbers on top of the picture. """
+        self.metricsOverlayActive = not self.metricsOverlayActive
+        self.ui.pictureView.update()
+
+
+    def toggleProfiler(self):
+        """ Start or stop sampling all threads of the booth. """
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(lambda: self.ui.currentState)
+            self.profiler.start()
+        else:
+            self.stopProfiler()
+
+
+    def stopProfiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
 
 
     def overlayShutter(self):
@@ -410,20 +706,20 @@ class BoothUI(QWidget):
         self.camRefresh.stop()
         self.camHibernate.stop()
 
-        # now produce an overlay to indicate the picture taking process
-        pixmap = self.ui.label_pictureView.pixmap()
+        # now show an overlay to indicate the picture taking process
+        self.ui.pictureView.showUntilNextImage(self.paintShutter)
+
 
+    def paintShutter(self, canvas, rect):
         # white shadow
-        canvas = QPainter()
-        canvas.begin(pixmap)
-        canvas.fillRect(0,0, pixmap.width(), pixmap.height(), QColor(255,255,255,150))
+        canvas.fillRect(rect, QColor(255,255,255,150))
 
         # message if in camera mode
         if not USE_WEBCAM:
             message = "Aufnahme..."
             shadowOffset = 2
-            messageRect = pixmap.rect()
-            messageRect.setHeight(pixmap.height()/2)
+            messageRect = QRect(rect)
+            messageRect.setHeight(rect.height()/2)
             messageFont = QFont("Helvetica Neue")
             messageFont.setPointSize(100)
             canvas.setFont( messageFont )
@@ -448,11 +744,6 @@ class BoothUI(QWidget):
             canvas.setPen( Qt.white )
             canvas.drawText( messageRect, Qt.AlignCenter, message )
 
-        canvas.end()
-
-        pixmap = self.scaleImageToLabel(pixmap)
-        self.ui.label_pictureView.setPixmap(pixmap)
-
 
     def pauseLiveview(self):
         """ Pause the live preview for now. """
@@ -461,12 +752,48 @@ class BoothUI(QWidget):
             self.camHibernate.stop()
             QTimer.singleShot(100, self.displayHibernateImage)
             self.ui.currentState = S_HIBERNATE
+            if MOTION_WAKE:
+                self.motionPacer.reset()
+                self.motionProbe.start()
         else:
+            self.motionProbe.stop()
+            self.motionPacer.poke()
             self.camHibernate.start()
             self.camRefresh.start()
             self.ui.currentState = S_LIVEVIEW
 
 
+    def adaptLiveviewRate(self, frame):
+        """ Slow the live view down while nobody moves in front of the booth. """
+        if self.countDownOverlayActive or self.clipRecorder.recording:
+            self.motionPacer.poke()
+        else:
+            self.motionPacer.update(frame)
+
+        interval = self.motionPacer.interval()
+        if self.camRefresh.interval() != interval:
+            self.camRefresh.setInterval(interval)
+
+
+    def probeMotion(self):
+        """ Look for motion while hibernating and wake the live view up. """
+        if self.ui.currentState != S_HIBERNATE:
+            self.motionProbe.stop()
+            return
+
+        if USE_WEBCAM:
+            frame = self.captureFrame()
+            if frame is None:
+                return
+        else:
+            preview = self.camera.capture_preview()
+            frame = decodePreview(preview.to_pixbuf())
+            preview.clean()
+
+        if self.motionPacer.update(frame):
+            self.pauseLiveview()
+
+
     def adjustMainButton(self):
         """ Depending on the current state, modify the main button. """
         icon = QIcon()
@@ -502,16 +829,59 @@ class BoothUI(QWidget):
 
 
     def takeImage(self):
-        """ Read frame from camera and repaint QLabel widget. """
+        """ Read frame from camera and show it in the picture view. """
 
         # now take a picture
+        METRICS.observe('countdownToExposure', time.time() - self.countDownEndTime)
         filePath = getFilePath(self.ui.currentMode, self.multiShotFolder)
-        if USE_WEBCAM:
-            frame = self.captureFrame()
-            frame = cv2.flip(frame, 1)
-            cv2.imwrite(filePath, frame)
+        allCameras = self.multiCamera is not None and self.ui.currentMode == M_SINGLE
+        if allCameras:
+            # all cameras at once, the pictures go into a series folder
+            self.multiShotFolder = getSeriesFolder()
+            filePath = getFilePath(M_MULTI, self.multiShotFolder)
+            self.multiCamera.trigger(SERIES_PATH + self.multiShotFolder,
+                                     os.path.splitext(os.path.basename(filePath))[0])
+        with METRICS.timer('takeImage'):
+            if USE_WEBCAM:
+                frame = self.captureFrame()
+                exposure = time.time()
+                if frame is None:
+                    self.mainCameraFailed(allCameras, exposure, "no frame from the webcam")
+                    return
+                frame = cv2.flip(frame, 1)
+                if allCameras:
+                    self.multiCameraShot = (exposure, exposure)
+                self.encoder.encodeFrame(frame, filePath, 'archive', self.imageTaken, self.pictureFailed)
+            else:
+                exposure = time.time()
+                try:
+                    self.camera.capture_image(JOURNAL.tempPath(filePath))
+                except Exception as e:
+                    self.mainCameraFailed(allCameras, exposure, e)
+                    return
+                JOURNAL.commitFile(filePath)
+                if allCameras:
+                    self.multiCameraShot = (exposure, time.time())
+                self.imageTaken(filePath)
+
+
+    def mainCameraFailed(self, allCameras, exposure, reason):
+        """ The booth's camera took no picture; the other cameras' are still used. """
+        if allCameras:
+            print "main camera failed: {0}".format(reason)
+            self.multiCamera.addResult(CameraResult('main', None, exposure, time.time()))
         else:
-            self.camera.capture_image(filePath)
+            self.pictureFailed(reason)
+
+
+    def imageTaken(self, filePath):
+        """ Continue once the picture has been written. """
+        # the other cameras may still be busy, see multiCameraCaptured
+        if self.multiCameraShot is not None:
+            timestamp, endTime = self.multiCameraShot
+            self.multiCameraShot = None
+            self.multiCamera.addResult(CameraResult('main', filePath, timestamp, endTime))
+            return
 
         # things required for multiple shots
         if self.ui.currentMode == M_MULTI:
@@ -528,16 +898,46 @@ class BoothUI(QWidget):
                 self.countDownTimer.start()
             else:
                 self.buildMultiShotImage()
-
-        # update picture list and select the most recent one
-        if not (self.ui.currentMode == M_MULTI and self.multiShotCount < 4):
+        else:
+            self.pictureFinished(filePath)
+
+
+    def pictureFinished(self, filePath):
+        """ Update picture list and select the most recent one. """
+        self.ui.pushButton_main.setEnabled(True)
+        if self.uploadQueue is not None:
+            self.uploadQueue.add(filePath)
+        if self.gallerySync is not None:
+            # only this picture is new here, others come from the watcher
+            createThumbnails(self.encoder, callback=self.thumbnailCreated, pictureFiles=[filePath])
+            self.applyGalleryChanges([filePath], [])
+        else:
             # create thumbnails for new pictures
-            createThumbnails()
-
-            self.ui.pushButton_main.setEnabled(True)
+            createThumbnails(self.encoder, callback=self.thumbnailCreated)
             self.updatePictureList()
-            self.ui.listWidget_lastPictures.setCurrentRow(1)
-            self.displayImage()
+        self.ui.listWidget_lastPictures.setCurrentRow(1)
+        self.displayImage()
+        if self.slideshow is not None:
+            self.slideshow.showNow(filePath)
+
+
+    def thumbnailCreated(self, thumbnailFile):
+        """ Swap the icon of a picture once its thumbnail is ready. """
+        picturePath = thumbnailFile.replace(THUMBNAIL_PATH, PICTURE_PATH)
+        if self.thumbnailAtlas is not None:
+            # shown from the atlas from the next start on
+            self.thumbnailAtlas.pack([thumbnailFile], replace=True)
+        p = self.pictureIndex.get(picturePath)
+        if p is not None:
+            p['pic'] = QIcon(STAGING.resolve(thumbnailFile))
+            row = self.pictureList.index(p)
+            self.ui.listWidget_lastPictures.item(row).setIcon(p['pic'])
+
+
+    def pictureFailed(self, reason):
+        """ Taking the picture went wrong, back to the live view. """
+        print "no picture taken: {0}".format(reason)
+        self.ui.pushButton_main.setEnabled(True)
 
 
     def startPictureProcess(self):
@@ -563,21 +963,60 @@ class BoothUI(QWidget):
         else:
             self.countDownTimer.stop()
             self.countDownOverlayActive = False
-            QTimer.singleShot(100, self.overlayShutter)
-            QTimer.singleShot(200, self.takeImage)
+            self.countDownEndTime = time.time()
+            if self.ui.currentMode == M_CLIP:
+                # the live view keeps running while recording
+                self.startClip()
+            else:
+                QTimer.singleShot(100, self.overlayShutter)
+                QTimer.singleShot(200, self.takeImage)
+
+
+    def startClip(self):
+        """ Record the next frames of the live view into a clip. """
+        if not self.clipRecorder.start():
+            # both buffers are still being encoded, try again shortly
+            QTimer.singleShot(200, self.startClip)
+            return
+        METRICS.observe('countdownToExposure', time.time() - self.countDownEndTime)
+
+
+    def recordClipFrame(self, frame):
+        if self.clipRecorder.addFrame(frame):
+            # the clip is complete: encode it in the background, show the poster
+            filePath = getFilePath(M_CLIP)
+            clipPath = CLIPS_PATH + os.path.splitext(os.path.basename(filePath))[0]
+            poster = self.clipRecorder.posterFrame()
+            self.clipRecorder.finish(clipPath)
+            self.encoder.encodeFrame(poster, filePath, 'archive', self.pictureFinished, self.pictureFailed)
+
+
+    def multiCameraCaptured(self):
+        """ All cameras are done, compose their pictures into one sheet. """
+        pictureFiles = self.multiCamera.pictureFiles(['main'] + self.multiCamera.cameraNames())
+        if pictureFiles:
+            self.buildMultiShotImage(pictureFiles)
+        else:
+            self.pictureFailed("no camera delivered a picture")
+        self.multiShotFolder = ""
 
 
-    def buildMultiShotImage(self):
+    @METRICS.timed('buildMultiShotImage')
+    def buildMultiShotImage(self, pictureFiles=None):
         """ Combine the 4 taken images into one single picture. """
         self.multiShotLastImage = ""
 
         # get a sorted list of files
-        seriesPath = SERIES_PATH + self.multiShotFolder + '/'
-        pictureFiles = filter(os.path.isfile, glob.glob(seriesPath + "*.jpg"))
-        pictureFiles.sort(key=lambda x: os.path.getctime(x))
+        if pictureFiles is None:
+            seriesPath = SERIES_PATH + self.multiShotFolder + '/'
+            pictureFiles = STAGING.glob(seriesPath + "*.jpg")
+            pictureFiles.sort(key=lambda x: STAGING.getctime(x))
+        if self.uploadQueue is not None:
+            for f in pictureFiles:
+                self.uploadQueue.add(f)
 
         # create the base of the image
-        pictureSize = QImage(pictureFiles[0]).size()
+        pictureSize = QImage(STAGING.resolve(pictureFiles[0])).size()
         spacing = pictureSize.height() / 42
         image = QImage(pictureSize.width() + 3*spacing, pictureSize.height() + 3*spacing, QImage.Format_RGB32)
         image.fill(Qt.white)
@@ -591,33 +1030,96 @@ class BoothUI(QWidget):
                 spacing, spacing,
                 pictureSize.width()/2, pictureSize.height()/2
             )
-            canvas.drawImage(target, QImage(pictureFiles[0]))
+            canvas.drawImage(target, QImage(STAGING.resolve(pictureFiles[0])))
         if len(pictureFiles) > 1:
             target = QRectF(
                 pictureSize.width()/2 + 2*spacing, spacing,
                 pictureSize.width()/2, pictureSize.height()/2
             )
-            canvas.drawImage(target, QImage(pictureFiles[1]))
+            canvas.drawImage(target, QImage(STAGING.resolve(pictureFiles[1])))
         if len(pictureFiles) > 2:
             target = QRectF(
                 spacing, pictureSize.height()/2 + 2*spacing,
                 pictureSize.width()/2, pictureSize.height()/2
             )
-            canvas.drawImage(target, QImage(pictureFiles[2]))
+            canvas.drawImage(target, QImage(STAGING.resolve(pictureFiles[2])))
         if len(pictureFiles) > 3:
             target = QRectF(
                 pictureSize.width()/2 + 2*spacing, pictureSize.height()/2 + 2*spacing,
                 pictureSize.width()/2, pictureSize.height()/2
             )
-            canvas.drawImage(target, QImage(pictureFiles[3]))
+            canvas.drawImage(target, QImage(STAGING.resolve(pictureFiles[3])))
 
         canvas.end()
-        image.save(getFilePath(M_MULTI, self.multiShotFolder, True), "JPG", 92)
+        filePath = getFilePath(M_MULTI, self.multiShotFolder, True)
+        self.encoder.encodeImage(image, filePath, 'print', self.pictureFinished, self.pictureFailed)
+
+
+    def archiveCurrentEvent(self):
+        """ Move all pictures into the archive and start over with an empty gallery. """
+        if not self.ui.pushButton_main.isEnabled() or self.countDownTimer.isActive():
+            return
+        answer = QMessageBox.question(self, "Veranstaltung archivieren",
+                                      "Alle Bilder archivieren und mit einer leeren Galerie weitermachen?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if answer != QMessageBox.Yes:
+            return
+
+        # nothing may be written into the old folders anymore; the booth
+        # keeps running while the encoder and the staging area finish
+        self.ui.pushButton_main.setEnabled(False)
+        self.archiveWait = threading.Thread(target=self.waitForOutput, name="archiveWait")
+        self.archiveWait.daemon = True
+        self.archiveWait.start()
+        self.rotateEvent()
+
 
+    def waitForOutput(self):
+        """ Wait until everything taken so far is written to its folder. """
+        self.encoder.jobs.join()
+        STAGING.flushAll()
 
+
+    def rotateEvent(self):
+        """ Archive the folders once they are complete, see archiveCurrentEvent. """
+        if self.archiveWait.is_alive():
+            QTimer.singleShot(100, self.rotateEvent)
+            return
+        self.archiveWait = None
+        self.ui.pushButton_main.setEnabled(True)
+
+        # the atlas moves with the thumbnails, a new one starts empty
+        if self.thumbnailAtlas is not None:
+            self.thumbnailAtlas.close()
+        try:
+            self.archivePacker = archiveEvent([PICTURE_PATH, SERIES_PATH, CLIPS_PATH, PRINTS_PATH, THUMBNAIL_PATH, DELETED_PATH])
+        except OSError as e:
+            print "could not archive the event: {0}".format(e)
+            return
+        finally:
+            if self.thumbnailAtlas is not None:
+                self.thumbnailAtlas.open()
+        qApp.aboutToQuit.connect(self.archivePacker.stop)
+
+        # the gallery is known to be empty now, no need to rescan
+        self.pictureList = [self.liveViewIcon]
+        self.pictureIndex = {}
+        if self.slideshow is not None:
+            self.slideshow.setPictures([])
+        self.ui.listWidget_lastPictures.clear()
+        QListWidgetItem(self.liveViewIcon['pic'], self.liveViewIcon['title'], self.ui.listWidget_lastPictures)
+        self.ui.listWidget_lastPictures.setCurrentRow(0)
+
+
+    @METRICS.timed('updatePictureList')
     def updatePictureList(self):
         """ Gets a list of QPixmaps from the latest images. """
-        self.pictureList = getPictureList()
+        self.pictureList = getPictureList(self.thumbnailAtlas)
+        self.pictureIndex = dict((p['path'], p) for p in self.pictureList)
+        if self.thumbnailAtlas is not None:
+            # e.g. thumbnails from before the atlas or from another booth
+            self.thumbnailAtlas.pack([p['path'].replace(PICTURE_PATH, THUMBNAIL_PATH) for p in self.pictureList
+                                      if os.path.basename(p['path']) not in self.thumbnailAtlas])
         self.pictureList.insert(0, self.liveViewIcon)
 
         # put the pictures in the list
@@ -625,7 +1127,42 @@ class BoothUI(QWidget):
         for p in self.pictureList:
             newItem = QListWidgetItem(p['pic'], p['title'], self.ui.listWidget_lastPictures)
 
-
+        if self.slideshow is not None:
+            self.slideshow.setPictures([p['path'] for p in self.pictureList[1:]])
+
+
+    @METRICS.timed('applyGalleryChanges')
+    def applyGalleryChanges(self, added, removed):
+        """ Add and remove single pictures instead of reading the whole list again. """
+        listWidget = self.ui.listWidget_lastPictures
+        for filePath in removed:
+            p = self.pictureIndex.pop(filePath, None)
+            if p is not None:
+                row = self.pictureList.index(p)
+                del self.pictureList[row]
+                listWidget.takeItem(row)
+
+        for filePath in added:
+            if filePath.startswith(THUMBNAIL_PATH):
+                self.thumbnailCreated(filePath)
+                continue
+            if filePath in self.pictureIndex or not os.path.isfile(STAGING.resolve(filePath)):
+                continue
+            p = getPictureEntry(filePath, self.thumbnailAtlas)
+            self.pictureIndex[filePath] = p
+
+            # newest first, a new picture usually belongs right at the top
+            row = 1
+            while row < len(self.pictureList) and self.pictureList[row]['time'] > p['time']:
+                row += 1
+            self.pictureList.insert(row, p)
+            listWidget.insertItem(row, QListWidgetItem(p['pic'], p['title']))
+
+        if self.slideshow is not None:
+            self.slideshow.setPictures([p['path'] for p in self.pictureList[1:SLIDESHOW_COUNT+1]])
+
+
+    @METRICS.timed('displayImage')
     def displayImage(self, filePath = ""):
         """ Get the currently selected image and display it. """
         selectedImageID = self.ui.listWidget_lastPictures.currentRow()
@@ -634,25 +1171,17 @@ class BoothUI(QWidget):
             self.camRefresh.stop()
             self.camHibernate.stop()
 
-            # load the image and display it
-            # (Note: It scales the image only once when it loads it.
-            #        Resizing the window after that doesn't change scaling.)
+            # load the image and display it (the view scales it to its size)
             if filePath == "":
                 if selectedImageID >= len(self.pictureList):
                     selectedImageID = len(self.pictureList) - 1
                 selectedImage = self.pictureList[selectedImageID]
-                selectedImagePixmap = QPixmap(selectedImage['path'])
+                selectedImagePixmap = QPixmap(STAGING.resolve(selectedImage['path']))
             else:
-                selectedImagePixmap = QPixmap(filePath)
+                selectedImagePixmap = QPixmap(STAGING.resolve(filePath))
 
             self.ui.currentState = S_DISPLAY
-            selectedImagePixmap = self.scaleImageToLabel(selectedImagePixmap)
-
-            # overlay the countdown on the image if activated
-            if self.countDownOverlayActive:
-                selectedImagePixmap = self.overlayCountdown(selectedImagePixmap)
-
-            self.ui.label_pictureView.setPixmap(selectedImagePixmap)
+            self.ui.pictureView.setImage(selectedImagePixmap)
             self.ui.pushButton_delete.setEnabled(True)
         else:
             # reactivate the live feed
@@ -678,8 +1207,7 @@ class BoothUI(QWidget):
         canvas.drawText( pixmap.rect(), Qt.AlignCenter, QString.fromUtf8("Vorschau mit Fußtaster oder Leertaste reaktivieren.") )
         canvas.end()
 
-        pixmap = self.scaleImageToLabel(pixmap)
-        self.ui.label_pictureView.setPixmap(pixmap)
+        self.ui.pictureView.setImage(pixmap)
 
 
     def printSelectedImage(self):
@@ -696,7 +1224,9 @@ class BoothUI(QWidget):
         """ Print a page with a single image. """
 
         # first, write the image to a PDF, just in case
-        self.printToPDF(image)
+        pdfPath = self.printToPDF(image)
+        if self.uploadQueue is not None:
+            self.uploadQueue.add(pdfPath)
 
         # open the dialog
         printer = QPrinter(QPrinter.HighResolution)
@@ -705,22 +1235,24 @@ class BoothUI(QWidget):
             return
 
         # start the painting process
-        canvas = QPainter()
-        canvas.begin(printer)
+        with METRICS.timer('printImage'):
+            canvas = QPainter()
+            canvas.begin(printer)
 
-        # fill the image
-        target = QRectF(0.0, 0.0, canvas.device().width(), canvas.device().height())
-        canvas.drawImage(target, QImage(image['path']))
+            # fill the image
+            target = QRectF(0.0, 0.0, canvas.device().width(), canvas.device().height())
+            canvas.drawImage(target, QImage(STAGING.resolve(image['path'])))
 
-        # finish the job (i.e.: print)
-        canvas.end()
+            # finish the job (i.e.: print)
+            canvas.end()
 
 
+    @METRICS.timed('printToPDF')
     def printToPDF(self, image):
         """ Generate a PDF with a single image. """
         # create the PDF
         pdfPath = PRINTS_PATH + image['base'] + ".pdf"
-        self.printerPDF.setOutputFileName(pdfPath)
+        self.printerPDF.setOutputFileName(JOURNAL.tempPath(pdfPath))
 
         # start the painting process
         canvas = QPainter()
@@ -728,10 +1260,11 @@ class BoothUI(QWidget):
 
         # fill the image
         target = QRectF(0.0, 0.0, canvas.device().width(), canvas.device().height())
-        canvas.drawImage(target, QImage(image['path']))
+        canvas.drawImage(target, QImage(STAGING.resolve(image['path'])))
 
         # finish the job (i.e.: print)
         canvas.end()
+        JOURNAL.commitFile(pdfPath)
         return pdfPath
 
 
@@ -744,10 +1277,13 @@ class BoothUI(QWidget):
             # move the file into the deleted folder
             oldPath = selectedImage['path']
             newPath = oldPath.replace(PICTURE_PATH, DELETED_PATH)
-            os.rename(oldPath, newPath)
+            STAGING.move(oldPath, newPath)
 
             # update the picture list and show the next image
-            self.updatePictureList()
+            if self.gallerySync is not None:
+                self.applyGalleryChanges([], [oldPath])
+            else:
+                self.updatePictureList()
             if selectedImageID >= len(self.pictureList):
                 selectedImageID = len(self.pictureList)-1
             self.ui.listWidget_lastPictures.setCurrentRow(selectedImageID)
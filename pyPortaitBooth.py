@@ -9,8 +9,8 @@ import sys, os
 import psutil
 import glob
 import time
+import threading
 import random
-from subprocess import call
 
 # used for the webcam
 import numpy as np
@@ -20,6 +20,47 @@ import cv, cv2
 sys.path.append('piggyphoto/')
 import piggyphoto
 import gphoto2 as gp
+from gphotoCamera import GphotoCamera, isJpeg
+from rawPreview import RawDeveloper, extractPreviewData
+
+# instrumentation
+from boothMetrics import METRICS
+from stallDetector import StallDetector
+from samplingProfiler import SamplingProfiler
+from resourceMonitor import ResourceMonitor
+
+# motion detection for the live view
+from motionDetector import MotionPacer, decodePreview
+
+# JPEG encoding off the GUI thread
+from jpegEncoder import JpegEncoder, qimageToArray, writeFile
+
+# monotone coloring of the portraits
+from toneMapping import buildToneLut, applyTone
+
+# automatic crop frame following the face
+from faceTracker import FaceTracker
+
+# the camera in a separate process
+from captureService import CaptureService, RingVideoCapture, RingCamera
+
+# crash-safe writing of the pictures
+from captureJournal import JOURNAL
+
+# new files in RAM first, flushed to the (slow) disk in the background
+from stagingStore import STAGING
+
+# archiving of an event while the booth keeps running
+from eventArchive import archiveEvent, resumeArchives
+
+# several booths sharing the picture folders
+from gallerySync import GallerySync
+
+# copies of all pictures on an S3 compatible storage
+from uploadQueue import UploadQueue
+
+# all thumbnails in one memory-mapped file
+from thumbnailAtlas import ThumbnailAtlas
 
 # the UI
 from PyQt4.QtCore import *
@@ -32,12 +73,66 @@ from portraitBoothUI import Ui_portraitBooth
 #  webcam: use internal webcam
 CAM_MODE = 'auto'
 
+# run the webcam / camera in a separate process, restarted if it crashes or hangs
+CAPTURE_SERVICE = True
+
+# watch the picture folders (e.g. shared by several booths) and update the
+# gallery picture by picture instead of reading the whole folder every time
+GALLERY_SYNC = False
+
+# upload the pictures and prints to an S3 compatible storage (None: off), e.g.
+#   {'endpoint': "http://192.168.1.2:9000", 'bucket': "fotobox", 'prefix': "hochzeit/",
+#    'accessKey': "...", 'secretKey': "...", 'rate': 512*1024}
+UPLOAD_TARGET = None
+
+# write new files to a folder in RAM first and copy them to the paths below
+# in the background (None: off); writing waits once STAGING_LIMIT_MB are staged
+STAGING_PATH = "/dev/shm/portraitbooth"
+STAGING_LIMIT_MB = 256
+
+# pack the thumbnails into one memory-mapped file (thumbnails/.atlas.*), so
+# the gallery loads without reading a file per picture (benchmarkAtlas.py)
+THUMBNAIL_ATLAS = True
+
 # paths to generated files
 DELETED_PATH = "deleted/"
 PICTURE_PATH = "pictures/"
 PRINTS_PATH = "prints/"
 RAWPICS_PATH = "pictures_raw/"
 THUMBNAIL_PATH = "thumbnails/"
+THUMBNAIL_PLACEHOLDER = "graphics/picture_single.png"
+
+# latency metrics: Prometheus endpoint (http://localhost:PORT/metrics) and log
+METRICS_PORT = 9101
+METRICS_LOG_PATH = "logs/metrics_portraitbooth.json"
+
+# event loop watchdog: log the call blocking the GUI longer than the threshold
+STALL_THRESHOLD_MS = 250
+HEARTBEAT_MS = 50
+
+# slow the live view down to IDLE_INTERVAL_MS while nothing moves and wake it
+# up from hibernation on motion (checked every MOTION_PROBE_MS)
+ADAPTIVE_LIVEVIEW = True
+IDLE_INTERVAL_MS = 500
+MOTION_WAKE = True
+MOTION_PROBE_MS = 1000
+
+# show the live view in the tone the next picture will get
+TONED_PREVIEW = True
+
+# automatic crop frame (toggled with A): the face fills FACE_SHARE of the
+# frame height and the frame moves by FACE_SMOOTHING of the distance per frame
+FACE_SHARE = 0.35
+FACE_SMOOTHING = 0.2
+
+# what the DSLR saves: 'jpeg', 'raw+jpeg' or 'raw'; the image format setting
+# of the camera is changed to CAMERA_IMAGE_FORMAT if given (the names depend
+# on the camera, e.g. "RAW + Large Fine JPEG")
+CAPTURE_FORMAT = 'jpeg'
+CAMERA_IMAGE_FORMAT = None
+
+# develop the RAW files in the background, e.g. ["darktable-cli", "{raw}", "{output}"]
+RAW_DEVELOP_COMMAND = None
 
 # dimensions
 class Dimensions():
@@ -103,6 +198,14 @@ class CropFrame():
     def getCanvasWidth(self):
         return self.getCroppedHeight() * self.paperDimension.getRatio()
 
+    def getCropArea(self):
+        cropArea = QRect()
+        cropArea.setTop(self.getOffsetTop())
+        cropArea.setRight(self.getOffsetRight())
+        cropArea.setBottom(self.getOffsetBottom())
+        cropArea.setLeft(self.getOffsetLeft())
+        return cropArea
+
 
     def moveFrameToRight(self):
         croppedWidth = self.height * self.ratio / self.baseRatio
@@ -145,6 +248,21 @@ class CropFrame():
         else:
             self.height = 0.3
 
+    def followFace(self, face, faceShare, smoothing):
+        """ Move the frame a step towards framing the face, staying within the image. """
+        faceX, faceY, faceWidth, faceHeight = face
+        targetHeight = min(max(faceHeight / faceShare, 0.3), 1.0)
+        self.height += smoothing * (targetHeight - self.height)
+
+        # center the face horizontally, put the eyes at about a third from the top
+        croppedWidth = self.height * self.ratio / self.baseRatio
+        targetX = faceX + faceWidth/2 - croppedWidth/2
+        targetY = faceY + faceHeight*0.4 - self.height/3
+        targetX = min(max(targetX, 0.0), 1.0 - croppedWidth)
+        targetY = min(max(targetY, 0.0), 1.0 - self.height)
+        self.offsetX += smoothing * (targetX - self.offsetX)
+        self.offsetY += smoothing * (targetY - self.offsetY)
+
 
 WEBCAM_WIDTH_PX = 740
 WEBCAM_HEIGHT_PX = 500
@@ -167,40 +285,59 @@ def getFilePath():
     return rawfilepath, filepath
 
 
-def createThumbnails(redoAll = False):
-    pictureFiles = filter(os.path.isfile, glob.glob(PICTURE_PATH + "*.jpg"))
+@METRICS.timed('createThumbnails')
+def createThumbnails(encoder, redoAll = False, callback = None, pictureFiles = None):
+    """ Let the encoder create the missing thumbnails in the background. """
+    if pictureFiles is None:
+        pictureFiles = STAGING.glob(PICTURE_PATH + "*.jpg")
     for f in pictureFiles:
         thumbnailFile = f.replace(PICTURE_PATH, THUMBNAIL_PATH)
-        if ( redoAll or not os.path.isfile(thumbnailFile) ):
-            image = QImage(f)
-            thumbnail = image.scaledToWidth(200)
-            thumbnail.save(thumbnailFile, "JPG", 90)
+        if ( redoAll or not os.path.isfile(STAGING.resolve(thumbnailFile)) ):
+            encoder.scaleFile(f, thumbnailFile, 200, 'thumbnail', callback)
 
 
-def getPictureList():
+def decodeCropArea(rawFilePath, cropFrame):
+    """ Decode only the part of the raw picture inside the crop frame. """
+    reader = QImageReader(STAGING.resolve(rawFilePath))
+    cropFrame.setBaseImageSize(reader.size())
+
+    # the JPEG decoder skips everything outside of the clip rectangle and
+    # directly delivers the size the picture gets on the canvas
+    reader.setClipRect(cropFrame.getCropArea())
+    reader.setScaledSize(QSize(int(cropFrame.getCroppedWidth()), int(cropFrame.getCroppedHeight())))
+    return reader.read()
+
+
+def getPictureList(atlas = None):
     # get a sorted list of files
-    pictureFiles = filter(os.path.isfile, glob.glob(PICTURE_PATH + "*.jpg"))
-    pictureFiles.sort(key=lambda x: os.path.getctime(x))
+    pictureFiles = STAGING.glob(PICTURE_PATH + "*.jpg")
+    pictureFiles.sort(key=lambda x: STAGING.getctime(x))
     pictureFiles.reverse()
 
     # go through the filenames and create QIcons
-    pictures = []
-    for f in pictureFiles:
-        timeInfo = time.strftime( "%H:%M:%S", time.localtime(os.path.getctime(f)) )
+    return [getPictureEntry(f, atlas) for f in pictureFiles]
 
-        # use the thumbnail if it exists
-        thumbnailFile = f.replace(PICTURE_PATH, THUMBNAIL_PATH)
+
+def getPictureEntry(f, atlas = None):
+    ctime = STAGING.getctime(f)
+    timeInfo = time.strftime( "%H:%M:%S", time.localtime(ctime) )
+
+    # use the thumbnail from the atlas or its file if it exists, otherwise a
+    # placeholder until thumbnailCreated (never the full picture)
+    thumbnail = atlas.icon(os.path.basename(f)) if atlas is not None else None
+    if thumbnail is None:
+        thumbnailFile = STAGING.resolve(f.replace(PICTURE_PATH, THUMBNAIL_PATH))
         if not os.path.isfile(thumbnailFile):
-            thumbnailFile = f
+            thumbnailFile = THUMBNAIL_PLACEHOLDER
         thumbnail = QIcon(thumbnailFile)
 
-        pictures.append({
-            "title": timeInfo,
-            "pic":   thumbnail,
-            "path":  f,
-            "base":  os.path.splitext( os.path.basename(f) )[0]
-        })
-    return pictures
+    return {
+        "title": timeInfo,
+        "pic":   thumbnail,
+        "path":  f,
+        "base":  os.path.splitext( os.path.basename(f) )[0],
+        "time":  ctime
+    }
 
 
 def getCurrentTone():
@@ -220,10 +357,19 @@ class BoothUI(QWidget):
         QWidget.__init__(self, parent)
         self.ui = Ui_portraitBooth()
         self.ui.setupUi(self)
+        # before anything is written (or a process is started that reads)
+        if STAGING_PATH is not None:
+            STAGING.open(STAGING_PATH, STAGING_LIMIT_MB*1024*1024)
         self.initObjects()
 
+        # clean up after a crash before showing the pictures
+        JOURNAL.open()
+        unfinished = JOURNAL.recover([PICTURE_PATH, RAWPICS_PATH, THUMBNAIL_PATH], DELETED_PATH)
+        qApp.aboutToQuit.connect(JOURNAL.stop)
+
         # display the latest pictures
         self.updatePictureList()
+        self.resumeCaptures(unfinished)
 
         # detect if an external camera has been connected
         global USE_WEBCAM
@@ -249,6 +395,19 @@ class BoothUI(QWidget):
         quit_action.triggered.connect(qApp.closeAllWindows)
         self.addAction(quit_action)
 
+        # hidden sampling profiler (writes flame graph stacks to profiles/)
+        profile_action = QAction('Profile', self)
+        profile_action.setShortcut('Ctrl+P')
+        profile_action.triggered.connect(self.toggleProfiler)
+        self.addAction(profile_action)
+        qApp.aboutToQuit.connect(self.stopProfiler)
+
+        # archive the event so far and continue with an empty gallery
+        archive_action = QAction('Archive', self)
+        archive_action.setShortcut('Ctrl+E')
+        archive_action.triggered.connect(self.archiveCurrentEvent)
+        self.addAction(archive_action)
+
         # take an image
         self.ui.pushButton_main.clicked.connect(self.startMainActionClick)
         scMain = QShortcut(QKeySequence(Qt.Key_Space), self, self.startMainAction)
@@ -263,6 +422,7 @@ class BoothUI(QWidget):
         scCFdown = QShortcut(QKeySequence(Qt.Key_Down), self, self.cropFrameDown)
         scCFplus = QShortcut(QKeySequence(Qt.Key_Plus), self, self.cropFrameEnlarge)
         scCFminus = QShortcut(QKeySequence(Qt.Key_Minus), self, self.cropFrameShrink)
+        scCFauto = QShortcut(QKeySequence(Qt.Key_A), self, self.autoCropToggle)
 
         # select an image
         self.ui.listWidget_lastPictures.itemSelectionChanged.connect(self.displayImage)
@@ -271,6 +431,25 @@ class BoothUI(QWidget):
         self.ui.pushButton_delete.clicked.connect(self.deleteSelectedImage)
         scDelete = QShortcut(QKeySequence(Qt.Key_L), self, self.deleteSelectedImage)
 
+        # latency metrics and their on-screen overlay
+        scMetrics = QShortcut(QKeySequence(Qt.Key_D), self, self.toggleMetricsOverlay)
+        METRICS.startServer(METRICS_PORT)
+        METRICS.startJsonLog(METRICS_LOG_PATH)
+        qApp.aboutToQuit.connect(METRICS.stop)
+
+        # watch the event loop for stalls
+        self.stallDetector = StallDetector(STALL_THRESHOLD_MS/1000.0, HEARTBEAT_MS/1000.0)
+        self.heartbeat = QTimer()
+        self.heartbeat.timeout.connect(self.stallDetector.beat)
+        self.heartbeat.start(HEARTBEAT_MS)
+        self.stallDetector.start()
+        qApp.aboutToQuit.connect(self.stallDetector.stop)
+
+        # record memory, CPU and disk usage over the event
+        self.resourceMonitor = ResourceMonitor([PICTURE_PATH, RAWPICS_PATH, PRINTS_PATH, THUMBNAIL_PATH, DELETED_PATH])
+        self.resourceMonitor.start()
+        qApp.aboutToQuit.connect(self.resourceMonitor.stop)
+
 
     def initObjects(self):
         self.printDim = Dimensions()
@@ -283,7 +462,42 @@ class BoothUI(QWidget):
         self.ui.currentState = S_LIVEVIEW
         self.lastRawPicture = ""
         self.countDownOverlayActive = False
+        self.countDownEndTime = 0
+        self.metricsOverlayActive = False
+        self.profiler = None
+        self.archivePacker = None
+        self.archiveWait = None
+        for packer in resumeArchives():
+            qApp.aboutToQuit.connect(packer.stop)
         self.enableFrameEdit = False
+        self.autoCropActive = False
+        self.faceTracker = None
+
+        self.encoder = JpegEncoder()
+        qApp.aboutToQuit.connect(self.encoder.finish)
+
+        # painted on top of the live view / picture, in this order
+        for layer in [self.paintCroppingFrame, self.paintCountdown, self.paintMetrics, self.paintWarning]:
+            self.ui.pictureView.addLayer(layer)
+
+        self.thumbnailAtlas = None
+        if THUMBNAIL_ATLAS:
+            self.thumbnailAtlas = ThumbnailAtlas(THUMBNAIL_PATH)
+            qApp.aboutToQuit.connect(self.thumbnailAtlas.close)
+
+        self.gallerySync = None
+        if GALLERY_SYNC:
+            self.gallerySync = GallerySync([PICTURE_PATH, THUMBNAIL_PATH])
+            self.gallerySync.changed.connect(self.applyGalleryChanges)
+            self.gallerySync.rescan.connect(self.updatePictureList)
+            qApp.aboutToQuit.connect(self.gallerySync.stop)
+
+        self.uploadQueue = None
+        if UPLOAD_TARGET is not None:
+            self.uploadQueue = UploadQueue(UPLOAD_TARGET, folders=[PICTURE_PATH, PRINTS_PATH])
+            self.uploadQueue.start()
+            qApp.aboutToQuit.connect(self.uploadQueue.stop)
+        self.chooseNextTone()
 
         self.countDownTimer = QTimer()
         self.countDownTimer.timeout.connect(self.shotCountDown)
@@ -293,6 +507,10 @@ class BoothUI(QWidget):
         self.camHibernate.timeout.connect(self.pauseLiveview)
         self.camHibernate.setInterval(3*60*1000)
 
+        self.motionProbe = QTimer()
+        self.motionProbe.timeout.connect(self.probeMotion)
+        self.motionProbe.setInterval(MOTION_PROBE_MS)
+
         self.printerPDF = QPrinter()
         self.printerPDF.setOrientation(QPrinter.Portrait)
         self.printerPDF.setPaperSize(self.printDim.getPageSize(), self.printDim.getPageSizeUnit())
@@ -304,48 +522,67 @@ class BoothUI(QWidget):
 
     def setupWebcam(self):
         """ Initialize webcam camera and get regular pictures """
-        self.capture = cv2.VideoCapture(0)
+        if CAPTURE_SERVICE:
+            self.captureService = CaptureService('webcam')
+            self.captureService.start()
+            qApp.aboutToQuit.connect(self.captureService.stop)
+            self.capture = RingVideoCapture(self.captureService)
+        else:
+            self.capture = cv2.VideoCapture(0)
 
         self.camRefresh = QTimer()
         self.camRefresh.timeout.connect(self.displayWebcamStream)
         self.camRefresh.setInterval(50)
         self.camRefresh.start()
+        self.motionPacer = MotionPacer(50, IDLE_INTERVAL_MS)
 
         self.camHibernate.start()
 
 
     def setupCamera(self):
         """ Initialize the camera and get regular preview pictures. """
-        self.camera = piggyphoto.Camera()
+        if CAPTURE_FORMAT == 'jpeg' and CAPTURE_SERVICE:
+            self.captureService = CaptureService('camera', 0.1)
+            self.captureService.start()
+            qApp.aboutToQuit.connect(self.captureService.stop)
+            self.camera = RingCamera(self.captureService)
+        elif CAPTURE_FORMAT == 'jpeg':
+            self.camera = piggyphoto.Camera()
+        else:
+            self.camera = GphotoCamera(CAMERA_IMAGE_FORMAT)
+            self.rawDeveloper = RawDeveloper(RAW_DEVELOP_COMMAND)
+            self.rawDeveloper.start()
+            qApp.aboutToQuit.connect(self.rawDeveloper.stop)
         self.camera.leave_locked()
 
         self.camRefresh = QTimer()
         self.camRefresh.timeout.connect(self.displayCameraPreview)
         self.camRefresh.setInterval(100)
         self.camRefresh.start()
+        self.motionPacer = MotionPacer(100, IDLE_INTERVAL_MS)
         self.camHibernate.start()
 
 
+    @METRICS.timed('displayCameraPreview')
     def displayCameraPreview(self):
-        """ Read frame from camera and repaint QLabel widget. """
+        """ Read frame from camera and show it in the picture view. """
         preview = self.camera.capture_preview()
+        previewData = preview.to_pixbuf()
+        if ADAPTIVE_LIVEVIEW:
+            self.adaptLiveviewRate(decodePreview(previewData))
+        if self.autoCropActive:
+            # the tracker decodes the data itself
+            self.faceTracker.submit(previewData)
+
+        # the view scales it while painting, the overlays are its layers
+        if TONED_PREVIEW:
+            image, frame = self.tonedImage(cv2.imdecode(np.frombuffer(previewData, np.uint8), 1))
+            self.ui.pictureView.setImage(image, frame)
+        else:
+            self.ui.pictureView.setImage(QImage.fromData(previewData, "JPG"))
 
-        # load from temporary file
-        pixmap = QPixmap()
-        pixmap.loadFromData(preview.to_pixbuf(), "JPG")
-
-        # scale the image down if necessary
-        pixmap = self.scaleImageToLabel(pixmap)
-
-        # show the frame of cropped areas
-        pixmap = self.overlayCroppingFrame(pixmap)
-
-        # overlay the countdown on the image if activated
-        if self.countDownOverlayActive:
-            pixmap = self.overlayCountdown(pixmap)
-
-        # set image
-        self.ui.label_pictureView.setPixmap(pixmap)
+        # move the frame of the cropped area along with the face
+        self.followFace()
 
         # free unused memory (not tested if this works)
         preview.clean()
@@ -353,6 +590,9 @@ class BoothUI(QWidget):
 
     def captureFrame(self):
         _, frame = self.capture.read()
+        if frame is None:
+            # no frame from the camera (yet)
+            return None
 
         # get the current ratio
         frameSize = cv.GetSize(cv.fromarray(frame))
@@ -373,46 +613,73 @@ class BoothUI(QWidget):
         return newFrame
 
 
-    def scaleImageToLabel(self, pixmap):
-        """ Scale the image to the label's area. """
-        labelWidth = self.ui.label_pictureView.width()
-        labelHeight = self.ui.label_pictureView.height()
-        return pixmap.scaled(labelWidth, labelHeight, Qt.KeepAspectRatio)
-
-
+    @METRICS.timed('displayWebcamStream')
     def displayWebcamStream(self):
-        """ Read frame from camera and repaint QLabel widget. """
+        """ Read frame from camera and show it in the picture view. """
         frame = self.captureFrame()
+        if frame is None:
+            return
+        if ADAPTIVE_LIVEVIEW:
+            self.adaptLiveviewRate(frame)
 
         # apply some corrections to the live feed
-        frame = cv2.cvtColor(frame, cv2.cv.CV_BGR2RGB)
         frame = cv2.flip(frame, 1)
+        if self.autoCropActive:
+            self.faceTracker.submit(frame)
+        if TONED_PREVIEW:
+            image, frame = self.tonedImage(frame)
+        else:
+            frame = cv2.cvtColor(frame, cv2.cv.CV_BGR2RGB)
+            image = QImage(frame, frame.shape[1], frame.shape[0],
+                           frame.strides[0], QImage.Format_RGB888)
+
+        # the view scales it while painting, the overlays are its layers;
+        # the image uses the memory of the frame, which has to live until then
+        self.ui.pictureView.setImage(image, frame)
+
+        # move the frame of the cropped area along with the face
+        self.followFace()
+
+
+    def tonedImage(self, frame):
+        """ Shrink a BGR frame to the view and color it like the next picture;
+            returns the QImage and the RGB frame holding its memory. """
+        start = time.time()
+
+        # toning the small frame is much cheaper than the full one
+        labelWidth = self.ui.pictureView.width()
+        labelHeight = self.ui.pictureView.height()
+        scale = min(float(labelWidth) / frame.shape[1], float(labelHeight) / frame.shape[0])
+        if scale < 1.0:
+            size = (int(frame.shape[1] * scale), int(frame.shape[0] * scale))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        frame = applyTone(frame, self.toneLut)
+        METRICS.observe('tonePreview', time.time() - start)
+
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         image = QImage(frame, frame.shape[1], frame.shape[0],
                        frame.strides[0], QImage.Format_RGB888)
+        return image, frame
 
-        # show the frame of cropped areas
-        pixmap = self.overlayCroppingFrame(QPixmap.fromImage(image))
-
-        # scale the image down if necessary
-        pixmap = self.scaleImageToLabel(pixmap)
-
-        # overlay the countdown on the image if activated
-        if self.countDownOverlayActive:
-            pixmap = self.overlayCountdown(pixmap)
 
-        # set image
-        self.ui.label_pictureView.setPixmap(pixmap)
+    def chooseNextTone(self):
+        """ Pick the tone of the next picture, so the live view can show it. """
+        self.currentTone = getCurrentTone()
+        self.toneLut = buildToneLut(self.currentTone.red(), self.currentTone.green(), self.currentTone.blue())
 
 
-    def overlayCroppingFrame(self, pixmap):
-        canvas = QPainter()
-        canvas.begin(pixmap)
-        self.croppedFrame.setBaseImageSize(pixmap)
+    def paintCroppingFrame(self, canvas, rect):
+        if self.ui.currentState != S_LIVEVIEW:
+            return
+        self.croppedFrame.setBaseImageSize(rect)
 
         whiteTransparent = QBrush(QColor(255, 255, 255, 160))
         greenTransparent = QBrush(QColor(152, 223, 138, 180))
+        blueTransparent = QBrush(QColor(174, 199, 232, 180))
         if self.enableFrameEdit:
             overlayColor = greenTransparent
+        elif self.autoCropActive:
+            overlayColor = blueTransparent
         else:
             overlayColor = whiteTransparent
 
@@ -420,13 +687,13 @@ class BoothUI(QWidget):
         topRect.setTop(0)
         topRect.setLeft(0)
         topRect.setBottom(self.croppedFrame.getOffsetTop())
-        topRect.setRight(pixmap.width())
+        topRect.setRight(rect.width())
 
         bottomRect = QRect()
         bottomRect.setTop(self.croppedFrame.getOffsetBottom())
         bottomRect.setLeft(0)
-        bottomRect.setBottom(pixmap.height())
-        bottomRect.setRight(pixmap.width())
+        bottomRect.setBottom(rect.height())
+        bottomRect.setRight(rect.width())
 
         leftRect = QRect()
         leftRect.setTop(self.croppedFrame.getOffsetTop()+1)
@@ -438,27 +705,25 @@ class BoothUI(QWidget):
         rightRect.setTop(self.croppedFrame.getOffsetTop()+1)
         rightRect.setLeft(self.croppedFrame.getOffsetRight())
         rightRect.setBottom(self.croppedFrame.getOffsetBottom()-1)
-        rightRect.setRight(pixmap.width())
+        rightRect.setRight(rect.width())
 
         canvas.fillRect(topRect, overlayColor)
         canvas.fillRect(bottomRect, overlayColor)
         canvas.fillRect(leftRect, overlayColor)
         canvas.fillRect(rightRect, overlayColor)
 
-        return pixmap
-
 
-    def overlayCountdown(self, pixmap):
-        canvas = QPainter()
-        canvas.begin(pixmap)
+    def paintCountdown(self, canvas, rect):
+        if not self.countDownOverlayActive:
+            return
         shadowOffset = 2
 
         counterTitle = "Foto in"
         counterValue = "{0}".format(self.countDownValue+1)
 
         # the counter title
-        counterTitleRect = pixmap.rect()
-        counterTitleRect.setHeight(pixmap.height()/2)
+        counterTitleRect = QRect(rect)
+        counterTitleRect.setHeight(rect.height()/2)
         counterTitleFont = QFont("Helvetica Neue")
         counterTitleFont.setPointSize(100)
         canvas.setFont( counterTitleFont )
@@ -489,28 +754,82 @@ class BoothUI(QWidget):
         canvas.setFont( counterValueFont )
 
         canvas.setPen( Qt.black )
-        rect1 = pixmap.rect()
+        rect1 = QRect(rect)
         rect1.translate(0,shadowOffset)
         canvas.drawText( rect1, Qt.AlignCenter, counterValue )
 
-        rect2 = pixmap.rect()
+        rect2 = QRect(rect)
         rect2.translate(0,-shadowOffset)
         canvas.drawText( rect2, Qt.AlignCenter, counterValue )
 
-        rect3 = pixmap.rect()
+        rect3 = QRect(rect)
         rect3.translate(shadowOffset,0)
         canvas.drawText( rect3, Qt.AlignCenter, counterValue )
 
-        rect4 = pixmap.rect()
+        rect4 = QRect(rect)
         rect4.translate(-shadowOffset,0)
         canvas.drawText( rect4, Qt.AlignCenter, counterValue )
 
         canvas.setPen( Qt.white )
-        canvas.drawText( pixmap.rect(), Qt.AlignCenter, counterValue )
+        canvas.drawText( QRect(rect), Qt.AlignCenter, counterValue )
 
 
-        canvas.end()
-        return pixmap
+    def paintMetrics(self, canvas, rect):
+        """ Draw the latency summary of all stages in the upper left corner. """
+        if not self.metricsOverlayActive:
+            return
+        lines = METRICS.summaryLines()
+
+        metricsFont = QFont("Menlo")
+        metricsFont.setStyleHint(QFont.TypeWriter)
+        metricsFont.setPointSize(11)
+        canvas.setFont( metricsFont )
+
+        lineHeight = canvas.fontMetrics().height()
+        boxWidth = max([canvas.fontMetrics().width(l) for l in lines]) + 20
+        boxHeight = lineHeight * len(lines) + 20
+        canvas.fillRect(0,0, boxWidth, boxHeight, QColor(0,0,0,160))
+
+        canvas.setPen( Qt.white )
+        for i, line in enumerate(lines):
+            canvas.drawText( 10, 10 + lineHeight*(i+1) - canvas.fontMetrics().descent(), line )
+
+
+    def paintWarning(self, canvas, rect):
+        """ Draw a red bar with a warning at the bottom of the picture. """
+        message = self.resourceMonitor.warning
+        if not message:
+            return
+        warningFont = QFont("Helvetica Neue")
+        warningFont.setPointSize(16)
+        canvas.setFont( warningFont )
+
+        barHeight = canvas.fontMetrics().height() + 16
+        warningRect = QRect(0, rect.height() - barHeight, rect.width(), barHeight)
+        canvas.fillRect(warningRect, QColor(200,30,30,200))
+        canvas.setPen( Qt.white )
+        canvas.drawText( warningRect, Qt.AlignCenter, QString.fromUtf8(message) )
+
+
+    def toggleMetricsOverlay(self):
+        """ Show or hide the latency numbers on top of the picture. """
+        self.metricsOverlayActive = not self.metricsOverlayActive
+        self.ui.pictureView.update()
+
+
+    def toggleProfiler(self):
+        """ Start or stop sampling all threads of the booth. """
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(lambda: self.ui.currentState)
+            self.profiler.start()
+        else:
+            self.stopProfiler()
+
+
+    def stopProfiler(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
 
 
     def overlayShutter(self):
@@ -518,20 +837,20 @@ class BoothUI(QWidget):
         self.camRefresh.stop()
         self.camHibernate.stop()
 
-        # now produce an overlay to indicate the picture taking process
-        pixmap = self.ui.label_pictureView.pixmap()
+        # now show an overlay to indicate the picture taking process
+        self.ui.pictureView.showUntilNextImage(self.paintShutter)
+
 
+    def paintShutter(self, canvas, rect):
         # white shadow
-        canvas = QPainter()
-        canvas.begin(pixmap)
-        canvas.fillRect(0,0, pixmap.width(), pixmap.height(), QColor(255,255,255,150))
+        canvas.fillRect(rect, QColor(255,255,255,150))
 
         # message if in camera mode
         if not USE_WEBCAM:
             message = "Aufnahme..."
             shadowOffset = 2
-            messageRect = pixmap.rect()
-            messageRect.setHeight(pixmap.height()/2)
+            messageRect = QRect(rect)
+            messageRect.setHeight(rect.height()/2)
             messageFont = QFont("Helvetica Neue")
             messageFont.setPointSize(100)
             canvas.setFont( messageFont )
@@ -556,11 +875,6 @@ class BoothUI(QWidget):
             canvas.setPen( Qt.white )
             canvas.drawText( messageRect, Qt.AlignCenter, message )
 
-        canvas.end()
-
-        pixmap = self.scaleImageToLabel(pixmap)
-        self.ui.label_pictureView.setPixmap(pixmap)
-
 
     def pauseLiveview(self):
         """ Pause the live preview for now. """
@@ -569,12 +883,48 @@ class BoothUI(QWidget):
             self.camHibernate.stop()
             QTimer.singleShot(100, self.displayHibernateImage)
             self.ui.currentState = S_HIBERNATE
+            if MOTION_WAKE:
+                self.motionPacer.reset()
+                self.motionProbe.start()
         else:
+            self.motionProbe.stop()
+            self.motionPacer.poke()
             self.camHibernate.start()
             self.camRefresh.start()
             self.ui.currentState = S_LIVEVIEW
 
 
+    def adaptLiveviewRate(self, frame):
+        """ Slow the live view down while nobody moves in front of the booth. """
+        if self.countDownOverlayActive:
+            self.motionPacer.poke()
+        else:
+            self.motionPacer.update(frame)
+
+        interval = self.motionPacer.interval()
+        if self.camRefresh.interval() != interval:
+            self.camRefresh.setInterval(interval)
+
+
+    def probeMotion(self):
+        """ Look for motion while hibernating and wake the live view up. """
+        if self.ui.currentState != S_HIBERNATE:
+            self.motionProbe.stop()
+            return
+
+        if USE_WEBCAM:
+            frame = self.captureFrame()
+            if frame is None:
+                return
+        else:
+            preview = self.camera.capture_preview()
+            frame = decodePreview(preview.to_pixbuf())
+            preview.clean()
+
+        if self.motionPacer.update(frame):
+            self.pauseLiveview()
+
+
     def adjustMainButton(self):
         """ Depending on the current state, modify the main button. """
         icon = QIcon()
@@ -611,12 +961,31 @@ class BoothUI(QWidget):
 
     def enableFrameEditToggle(self):
         self.enableFrameEdit = not self.enableFrameEdit
+        if self.enableFrameEdit and self.autoCropActive:
+            # manual editing takes over from the face tracker
+            self.autoCropToggle()
         if self.enableFrameEdit:
             buttonTitle = "Bearbeitung stoppen"
         else:
             buttonTitle = "Rahmen bearbeiten"
         self.ui.pushButton_editCropFrame.setText(buttonTitle)
 
+    def autoCropToggle(self):
+        """ Let the crop frame follow the face or leave it where it is. """
+        self.autoCropActive = not self.autoCropActive
+        if self.autoCropActive and self.faceTracker is None:
+            self.faceTracker = FaceTracker()
+            self.faceTracker.start()
+            qApp.aboutToQuit.connect(self.faceTracker.stop)
+
+    def followFace(self):
+        """ Move the crop frame towards the last face found, without waiting for the tracker. """
+        if not self.autoCropActive or self.enableFrameEdit:
+            return
+        face = self.faceTracker.face
+        if face is not None and hasattr(self.croppedFrame, 'baseRatio'):
+            self.croppedFrame.followFace(face, FACE_SHARE, FACE_SMOOTHING)
+
     def cropFrameLeft(self):
         if self.enableFrameEdit:
             self.croppedFrame.moveFrameToLeft()
@@ -638,29 +1007,107 @@ class BoothUI(QWidget):
 
 
     def takeImage(self):
-        """ Read frame from camera and repaint QLabel widget. """
+        """ Read frame from camera and show it in the picture view. """
 
         # now take a picture
+        METRICS.observe('countdownToExposure', time.time() - self.countDownEndTime)
         rawFilePath, filePath = getFilePath()
-        if USE_WEBCAM:
-            frame = self.captureFrame()
-            frame = cv2.flip(frame, 1)
-            cv2.imwrite(rawFilePath, frame)
-        else:
-            self.camera.capture_image(rawFilePath)
+        JOURNAL.begin(filePath)
+        with METRICS.timer('takeImage'):
+            if USE_WEBCAM:
+                frame = self.captureFrame()
+                if frame is None:
+                    self.captureFailed(filePath, "no frame from the webcam")
+                    return
+                frame = cv2.flip(frame, 1)
+                self.encoder.encodeFrame(frame, rawFilePath, 'archive',
+                                         lambda rawPath: self.cropAndColorImage(rawPath, filePath),
+                                         lambda reason: self.captureFailed(filePath, reason))
+            elif CAPTURE_FORMAT == 'jpeg':
+                self.camera.capture_image(JOURNAL.tempPath(rawFilePath))
+                JOURNAL.commitFile(rawFilePath)
+                self.cropAndColorImage(rawFilePath, filePath)
+            elif self.captureRaw(rawFilePath):
+                self.cropAndColorImage(rawFilePath, filePath)
+            else:
+                self.captureFailed(filePath, "the camera delivered no picture to show")
+
 
-        # adjust image for the portrait wall
-        self.cropAndColorImage(rawFilePath, filePath)
+    def captureFailed(self, filePath, reason):
+        """ There is no raw picture, so nothing to resume after a crash. """
+        JOURNAL.abort(filePath)
+        self.pictureFailed(reason)
 
-        # update picture list and select the most recent one
-        createThumbnails()
 
+    @METRICS.timed('captureRaw')
+    def captureRaw(self, rawFilePath):
+        """ Capture RAW (+JPEG); the JPEG or the preview inside the RAW continues as raw picture.
+            False if there is nothing to continue with. """
+        # only the JPEG is downloaded before the review
+        (fileName, data), downloadRest = self.camera.capture_first()
+        basePath = os.path.splitext(rawFilePath)[0]
+        if isJpeg(fileName):
+            jpegData = data
+        else:
+            # RAW only: no demosaicing for the review, the embedded preview is good enough
+            jpegData = extractPreviewData(data)
+            self.rawDeveloper.add(basePath + os.path.splitext(fileName)[1].lower(), data)
+
+        # the big files are downloaded, written (and developed) in the background
+        self.rawDeveloper.addDownload(basePath, downloadRest)
+        if jpegData is None:
+            return False
+        writeFile(rawFilePath, jpegData)
+        return True
+
+
+    def resumeCaptures(self, unfinished):
+        """ Finish the portraits whose raw picture was taken before a crash. """
+        for filePath in unfinished:
+            if not filePath.startswith(PICTURE_PATH):
+                continue
+            rawFilePath = filePath.replace(PICTURE_PATH, RAWPICS_PATH)
+            if os.path.isfile(STAGING.resolve(rawFilePath)):
+                print "resuming '{0}'".format(filePath)
+                JOURNAL.begin(filePath)
+                self.cropAndColorImage(rawFilePath, filePath)
+
+
+    def pictureFinished(self, filePath):
+        """ Update picture list and select the most recent one. """
         self.ui.pushButton_main.setEnabled(True)
-        self.updatePictureList()
+        if self.uploadQueue is not None:
+            self.uploadQueue.add(filePath)
+        if self.gallerySync is not None:
+            # only this picture is new here, others come from the watcher
+            createThumbnails(self.encoder, callback=self.thumbnailCreated, pictureFiles=[filePath])
+            self.applyGalleryChanges([filePath], [])
+        else:
+            createThumbnails(self.encoder, callback=self.thumbnailCreated)
+            self.updatePictureList()
         self.ui.listWidget_lastPictures.setCurrentRow(1)
         self.displayImage()
 
 
+    def thumbnailCreated(self, thumbnailFile):
+        """ Swap the icon of a picture once its thumbnail is ready. """
+        picturePath = thumbnailFile.replace(THUMBNAIL_PATH, PICTURE_PATH)
+        if self.thumbnailAtlas is not None:
+            # shown from the atlas from the next start on
+            self.thumbnailAtlas.pack([thumbnailFile], replace=True)
+        p = self.pictureIndex.get(picturePath)
+        if p is not None:
+            p['pic'] = QIcon(STAGING.resolve(thumbnailFile))
+            row = self.pictureList.index(p)
+            self.ui.listWidget_lastPictures.item(row).setIcon(p['pic'])
+
+
+    def pictureFailed(self, reason):
+        """ Taking the picture went wrong, back to the live view. """
+        print "no picture taken: {0}".format(reason)
+        self.ui.pushButton_main.setEnabled(True)
+
+
     def startPictureProcess(self):
         """ Starts the process taking pichture(s) depending on the set mode. """
         self.ui.pushButton_main.setEnabled(False)
@@ -678,13 +1125,74 @@ class BoothUI(QWidget):
         else:
             self.countDownTimer.stop()
             self.countDownOverlayActive = False
+            self.countDownEndTime = time.time()
             QTimer.singleShot(100, self.overlayShutter)
             QTimer.singleShot(200, self.takeImage)
 
 
+    def archiveCurrentEvent(self):
+        """ Move all pictures into the archive and start over with an empty gallery. """
+        if not self.ui.pushButton_main.isEnabled() or self.countDownTimer.isActive():
+            return
+        answer = QMessageBox.question(self, "Veranstaltung archivieren",
+                                      "Alle Bilder archivieren und mit einer leeren Galerie weitermachen?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if answer != QMessageBox.Yes:
+            return
+
+        # nothing may be written into the old folders anymore; the booth
+        # keeps running while the encoder and the staging area finish
+        self.ui.pushButton_main.setEnabled(False)
+        self.archiveWait = threading.Thread(target=self.waitForOutput, name="archiveWait")
+        self.archiveWait.daemon = True
+        self.archiveWait.start()
+        self.rotateEvent()
+
+
+    def waitForOutput(self):
+        """ Wait until everything taken so far is written to its folder. """
+        self.encoder.jobs.join()
+        STAGING.flushAll()
+
+
+    def rotateEvent(self):
+        """ Archive the folders once they are complete, see archiveCurrentEvent. """
+        if self.archiveWait.is_alive():
+            QTimer.singleShot(100, self.rotateEvent)
+            return
+        self.archiveWait = None
+        self.ui.pushButton_main.setEnabled(True)
+
+        # the atlas moves with the thumbnails, a new one starts empty
+        if self.thumbnailAtlas is not None:
+            self.thumbnailAtlas.close()
+        try:
+            self.archivePacker = archiveEvent([PICTURE_PATH, RAWPICS_PATH, PRINTS_PATH, THUMBNAIL_PATH, DELETED_PATH])
+        except OSError as e:
+            print "could not archive the event: {0}".format(e)
+            return
+        finally:
+            if self.thumbnailAtlas is not None:
+                self.thumbnailAtlas.open()
+        qApp.aboutToQuit.connect(self.archivePacker.stop)
+
+        # the gallery is known to be empty now, no need to rescan
+        self.pictureList = [self.liveViewIcon]
+        self.pictureIndex = {}
+        self.ui.listWidget_lastPictures.clear()
+        QListWidgetItem(self.liveViewIcon['pic'], self.liveViewIcon['title'], self.ui.listWidget_lastPictures)
+        self.ui.listWidget_lastPictures.setCurrentRow(0)
+
+
+    @METRICS.timed('updatePictureList')
     def updatePictureList(self):
         """ Gets a list of QPixmaps from the latest images. """
-        self.pictureList = getPictureList()
+        self.pictureList = getPictureList(self.thumbnailAtlas)
+        self.pictureIndex = dict((p['path'], p) for p in self.pictureList)
+        if self.thumbnailAtlas is not None:
+            # e.g. thumbnails from before the atlas or from another booth
+            self.thumbnailAtlas.pack([p['path'].replace(PICTURE_PATH, THUMBNAIL_PATH) for p in self.pictureList
+                                      if os.path.basename(p['path']) not in self.thumbnailAtlas])
         self.pictureList.insert(0, self.liveViewIcon)
 
         # put the pictures in the list
@@ -693,6 +1201,35 @@ class BoothUI(QWidget):
             newItem = QListWidgetItem(p['pic'], p['title'], self.ui.listWidget_lastPictures)
 
 
+    @METRICS.timed('applyGalleryChanges')
+    def applyGalleryChanges(self, added, removed):
+        """ Add and remove single pictures instead of reading the whole list again. """
+        listWidget = self.ui.listWidget_lastPictures
+        for filePath in removed:
+            p = self.pictureIndex.pop(filePath, None)
+            if p is not None:
+                row = self.pictureList.index(p)
+                del self.pictureList[row]
+                listWidget.takeItem(row)
+
+        for filePath in added:
+            if filePath.startswith(THUMBNAIL_PATH):
+                self.thumbnailCreated(filePath)
+                continue
+            if filePath in self.pictureIndex or not os.path.isfile(STAGING.resolve(filePath)):
+                continue
+            p = getPictureEntry(filePath, self.thumbnailAtlas)
+            self.pictureIndex[filePath] = p
+
+            # newest first, a new picture usually belongs right at the top
+            row = 1
+            while row < len(self.pictureList) and self.pictureList[row]['time'] > p['time']:
+                row += 1
+            self.pictureList.insert(row, p)
+            listWidget.insertItem(row, QListWidgetItem(p['pic'], p['title']))
+
+
+    @METRICS.timed('displayImage')
     def displayImage(self, filePath = ""):
         """ Get the currently selected image and display it. """
         selectedImageID = self.ui.listWidget_lastPictures.currentRow()
@@ -701,25 +1238,17 @@ class BoothUI(QWidget):
             self.camRefresh.stop()
             self.camHibernate.stop()
 
-            # load the image and display it
-            # (Note: It scales the image only once when it loads it.
-            #        Resizing the window after that doesn't change scaling.)
+            # load the image and display it (the view scales it to its size)
             if filePath == "":
                 if selectedImageID >= len(self.pictureList):
                     selectedImageID = len(self.pictureList) - 1
                 selectedImage = self.pictureList[selectedImageID]
-                selectedImagePixmap = QPixmap(selectedImage['path'])
+                selectedImagePixmap = QPixmap(STAGING.resolve(selectedImage['path']))
             else:
-                selectedImagePixmap = QPixmap(filePath)
+                selectedImagePixmap = QPixmap(STAGING.resolve(filePath))
 
             self.ui.currentState = S_DISPLAY
-            selectedImagePixmap = self.scaleImageToLabel(selectedImagePixmap)
-
-            # overlay the countdown on the image if activated
-            if self.countDownOverlayActive:
-                selectedImagePixmap = self.overlayCountdown(selectedImagePixmap)
-
-            self.ui.label_pictureView.setPixmap(selectedImagePixmap)
+            self.ui.pictureView.setImage(selectedImagePixmap)
             self.ui.pushButton_delete.setEnabled(True)
         else:
             # reactivate the live feed
@@ -745,66 +1274,37 @@ class BoothUI(QWidget):
         canvas.drawText( pixmap.rect(), Qt.AlignCenter, QString.fromUtf8("Vorschau mit Fußtaster oder Leertaste reaktivieren.") )
         canvas.end()
 
-        pixmap = self.scaleImageToLabel(pixmap)
-        self.ui.label_pictureView.setPixmap(pixmap)
+        self.ui.pictureView.setImage(pixmap)
 
 
+    @METRICS.timed('cropAndColorImage')
     def cropAndColorImage(self, rawFilePath, filePath):
-        # load the picture
-        rawPicture = QImage(rawFilePath)
-        self.croppedFrame.setBaseImageSize(rawPicture.size())
+        # load only the cropped part of the picture
+        picture = decodeCropArea(rawFilePath, self.croppedFrame)
 
         # create the base of the image including white space
         canvas = QPainter()
-        canvasImage = QImage(self.croppedFrame.getCanvasWidth(), self.croppedFrame.getCanvasHeight(), QImage.Format_RGB32)
+        canvasImage = QImage(int(self.croppedFrame.getCanvasWidth()), int(self.croppedFrame.getCanvasHeight()), QImage.Format_RGB32)
         canvasImage.fill(Qt.white)
         canvas.begin(canvasImage)
 
-        # crop the raw image
-        picture = self.cropImage(rawPicture)
-
-        # place the actual image on one side
-        target = QRectF(0, 0, self.croppedFrame.getCroppedWidth(), self.croppedFrame.getCroppedHeight())
-        canvas.drawImage(target, picture)
-
-        # finish and save
+        # place the actual image on one side (already in size, no scaling)
+        canvas.drawImage(QPoint(0, 0), picture)
         canvas.end()
-        canvasImage.save(filePath, "JPG", 93)
-
-        # finally color the image (last step because it needs a physical file)
-        self.colorImage(filePath)
-
-
-    def cropImage(self, rawPicture):
-        cropArea = QRect()
-        cropArea.setTop(self.croppedFrame.getOffsetTop())
-        cropArea.setRight(self.croppedFrame.getOffsetRight())
-        cropArea.setBottom(self.croppedFrame.getOffsetBottom())
-        cropArea.setLeft(self.croppedFrame.getOffsetLeft())
 
-        croppedPicture = rawPicture.copy(cropArea)
-        return croppedPicture
+        # finally color the image and save it
+        picture = self.colorImage(canvasImage)
+        self.encoder.encodeFrame(picture, filePath, 'print', self.pictureFinished, self.pictureFailed)
 
+        # the live view already shows the tone of the next guest
+        self.chooseNextTone()
 
-    def colorImage(self, filePath):
-        # get a random tone and normalize it
-        tone = getCurrentTone()
 
-        # extract gray value for each pixel and color it then
-        # coloredPicture = picture
-        # for x in range(picture.width()):
-        #     for y in range(picture.height()):
-        #         gray = qGray(picture.pixel(x,y))
-        #         monotone = QColor().fromHsv(tone.hue(), tone.saturation()*1.2, gray)
-        #         monotone = monotone.lighter(130)
-        #         coloredPicture.setPixel(x,y, monotone.rgb())
-
-        # return coloredPicture
-
-        # use imagemagick to convert the color of the image
-        levelColors = "'rgb({0},{1},{2})',".format(tone.red(), tone.green(), tone.blue())
-        command = r"convert {0} \( -clone 0 -contrast -contrast -colorspace Gray +level-colors {1} \) -compose blend -define compose:args=80 -composite {0}".format(filePath, levelColors)
-        call(command, shell=True)
+    @METRICS.timed('colorImage')
+    def colorImage(self, picture):
+        """ Color the picture with the tone shown in the live view. """
+        # same lookup table as the live view, so both always match
+        return applyTone(qimageToArray(picture), self.toneLut)
 
 
     def printSelectedImage(self):
@@ -821,7 +1321,9 @@ class BoothUI(QWidget):
         """ Print a page with a single image. """
 
         # first, write the image to a PDF, just in case
-        self.printToPDF(image)
+        pdfPath = self.printToPDF(image)
+        if self.uploadQueue is not None:
+            self.uploadQueue.add(pdfPath)
 
         # open the dialog
         printer = QPrinter(QPrinter.HighResolution)
@@ -830,22 +1332,24 @@ class BoothUI(QWidget):
             return
 
         # start the painting process
-        canvas = QPainter()
-        canvas.begin(printer)
+        with METRICS.timer('printImage'):
+            canvas = QPainter()
+            canvas.begin(printer)
 
-        # fill the image
-        target = QRectF(0.0, 0.0, canvas.device().width(), canvas.device().height())
-        canvas.drawImage(target, QImage(image['path']))
+            # fill the image
+            target = QRectF(0.0, 0.0, canvas.device().width(), canvas.device().height())
+            canvas.drawImage(target, QImage(STAGING.resolve(image['path'])))
 
-        # finish the job (i.e.: print)
-        canvas.end()
+            # finish the job (i.e.: print)
+            canvas.end()
 
 
+    @METRICS.timed('printToPDF')
     def printToPDF(self, image):
         """ Generate a PDF with a single image. """
         # create the PDF
         pdfPath = PRINTS_PATH + image['base'] + ".pdf"
-        self.printerPDF.setOutputFileName(pdfPath)
+        self.printerPDF.setOutputFileName(JOURNAL.tempPath(pdfPath))
 
         # start the painting process
         canvas = QPainter()
@@ -853,10 +1357,11 @@ class BoothUI(QWidget):
 
         # fill the image
         target = QRectF(0.0, 0.0, canvas.device().width(), canvas.device().height())
-        canvas.drawImage(target, QImage(image['path']))
+        canvas.drawImage(target, QImage(STAGING.resolve(image['path'])))
 
         # finish the job (i.e.: print)
         canvas.end()
+        JOURNAL.commitFile(pdfPath)
         return pdfPath
 
 
@@ -869,10 +1374,13 @@ class BoothUI(QWidget):
             # move the file into the deleted folder
             oldPath = selectedImage['path']
             newPath = oldPath.replace(PICTURE_PATH, DELETED_PATH)
-            os.rename(oldPath, newPath)
+            STAGING.move(oldPath, newPath)
 
             # update the picture list and show the next image
-            self.updatePictureList()
+            if self.gallerySync is not None:
+                self.applyGalleryChanges([], [oldPath])
+            else:
+                self.updatePictureList()
             if selectedImageID >= len(self.pictureList):
                 selectedImageID = len(self.pictureList)-1
             self.ui.listWidget_lastPictures.setCurrentRow(selectedImageID)
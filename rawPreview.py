@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# The embedded JPEG preview of TIFF based RAW files (CR2, NEF, ARW, DNG,
+# PEF, ...). Cameras store a full or nearly full size JPEG next to the
+# sensor data; reading it takes a few milliseconds, developing the RAW
+# takes seconds. Only the IFDs and the preview itself are read.
+# The RAW files themselves are downloaded from the camera and written by a
+# background thread and optionally developed there by a command at low
+# priority.
+
+import os
+import time
+import struct
+import threading
+import subprocess
+import Queue
+from cStringIO import StringIO
+
+from boothMetrics import METRICS
+from jpegEncoder import writeFile
+
+TAG_COMPRESSION = 259
+TAG_STRIP_OFFSETS = 273
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_SUB_IFDS = 330
+TAG_JPEG_OFFSET = 513
+TAG_JPEG_LENGTH = 514
+TAG_EXIF_IFD = 34665
+
+# (old style) JPEG compression
+JPEG_COMPRESSIONS = (6, 7)
+
+# bytes of each TIFF type
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+# frame types a normal JPEG decoder handles (baseline, extended, progressive)
+DECODABLE_FRAMES = (0xc0, 0xc1, 0xc2)
+
+
+class TiffReader():
+    def __init__(self, f):
+        self.f = f
+        order = f.read(2)
+        if order == 'II':
+            self.order = '<'
+        elif order == 'MM':
+            self.order = '>'
+        else:
+            raise ValueError("not a TIFF based RAW file")
+        # CR2 and friends use 42 as well, ORF uses its own magic numbers
+        magic, self.firstIfd = self.unpack("HI", f.read(6))
+
+    def unpack(self, fmt, data):
+        return struct.unpack(self.order + fmt, data)
+
+    def readIfd(self, offset):
+        """ The entries of an IFD as {tag: [values]} and the offset of the next one. """
+        self.f.seek(offset)
+        count = self.unpack("H", self.f.read(2))[0]
+        raw = self.f.read(12 * count)
+        nextIfd = self.unpack("I", self.f.read(4))[0]
+
+        entries = {}
+        for i in range(count):
+            tag, kind, n, value = self.unpack("HHI4s", raw[12*i:12*i+12])
+            if kind not in (3, 4, 13) or n > 64:
+                # only short and long numbers are needed here
+                continue
+            size = TYPE_SIZES[kind] * n
+            if size > 4:
+                position = self.f.tell()
+                self.f.seek(self.unpack("I", value)[0])
+                value = self.f.read(size)
+                self.f.seek(position)
+            fmt = "H" if kind == 3 else "I"
+            entries[tag] = list(self.unpack(fmt * n, value[:size]))
+        return entries, nextIfd
+
+    def allIfds(self):
+        """ All IFDs: the main chain, their SubIFDs and the EXIF IFD. """
+        todo = [self.firstIfd]
+        seen = set()
+        while todo:
+            offset = todo.pop(0)
+            if offset == 0 or offset in seen:
+                continue
+            seen.add(offset)
+            try:
+                entries, nextIfd = self.readIfd(offset)
+            except struct.error:
+                continue
+            yield entries
+            todo.append(nextIfd)
+            todo.extend(entries.get(TAG_SUB_IFDS, []))
+            todo.extend(entries.get(TAG_EXIF_IFD, []))
+
+
+def jpegFrame(f, offset):
+    """ Frame type, width and height of the JPEG at offset, or None if there is none. """
+    f.seek(offset)
+    if f.read(2) != '\xff\xd8':
+        return None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != '\xff':
+            return None
+        code = ord(marker[1])
+        if code == 0xff:
+            f.seek(-1, 1)
+            continue
+        if 0xd0 <= code <= 0xd9 or code == 0x01:
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return code, width, height
+        f.seek(length - 2, 1)
+
+
+def findPreviews(f):
+    """ (offset, length) of every JPEG referenced in the IFDs. """
+    reader = TiffReader(f)
+    previews = []
+    for entries in reader.allIfds():
+        if TAG_JPEG_OFFSET in entries and TAG_JPEG_LENGTH in entries:
+            previews.append((entries[TAG_JPEG_OFFSET][0], entries[TAG_JPEG_LENGTH][0]))
+        compression = entries.get(TAG_COMPRESSION, [0])[0]
+        strips = entries.get(TAG_STRIP_OFFSETS, [])
+        if compression in JPEG_COMPRESSIONS and len(strips) == 1:
+            previews.append((strips[0], entries.get(TAG_STRIP_BYTE_COUNTS, [0])[0]))
+    return previews
+
+
+def readPreview(f):
+    """ The largest embedded JPEG a normal decoder can read, as a string (or None). """
+    best = None
+    for offset, length in findPreviews(f):
+        if length == 0:
+            continue
+        frame = jpegFrame(f, offset)
+        # lossless JPEG (the sensor data of a CR2) is not a preview
+        if frame is None or frame[0] not in DECODABLE_FRAMES:
+            continue
+        if best is None or frame[1] > best[0]:
+            best = (frame[1], offset, length)
+    if best is None:
+        return None
+    f.seek(best[1])
+    return f.read(best[2])
+
+
+def extractPreview(rawFilePath):
+    with open(rawFilePath, 'rb') as f:
+        return readPreview(f)
+
+
+def extractPreviewData(data):
+    """ Same as extractPreview, for a RAW file still in memory. """
+    return readPreview(StringIO(data))
+
+
+class RawDeveloper(threading.Thread):
+    """ Download and write RAW files and run the development command on them at low priority. """
+    def __init__(self, command=None):
+        threading.Thread.__init__(self, name="rawDeveloper")
+        self.daemon = True
+        # e.g. ["darktable-cli", "{raw}", "{output}"]
+        self.command = command
+        self.jobs = Queue.Queue()
+
+    def add(self, rawFilePath, data):
+        self.jobs.put((rawFilePath, data))
+
+    def addDownload(self, basePath, download):
+        """ The files download() returns as (file name, data) go to basePath + their extension. """
+        self.jobs.put((basePath, download))
+
+    def run(self):
+        # only the development command is niced (see develop), os.nice()
+        # here would apply to the whole process on macOS
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            rawFilePath, data = job
+            try:
+                if callable(data):
+                    # still on the camera
+                    files = [(rawFilePath + os.path.splitext(name)[1].lower(), fileData)
+                             for name, fileData in data()]
+                else:
+                    files = [(rawFilePath, data)]
+                for filePath, fileData in files:
+                    writeFile(filePath, fileData)
+                    if self.command:
+                        self.develop(filePath)
+            except Exception as e:
+                # gphoto2 errors as well
+                print "could not store '{0}': {1}".format(rawFilePath, e)
+
+    def develop(self, rawFilePath):
+        outputPath = os.path.splitext(rawFilePath)[0] + ".tif"
+        command = [part.format(raw=rawFilePath, output=outputPath) for part in self.command]
+        command = ["nice", "-n", "19"] + command
+        if os.path.exists("/usr/bin/ionice"):
+            command = ["ionice", "-c", "3"] + command
+        start = time.time()
+        if subprocess.call(command) != 0:
+            print "developing '{0}' failed".format(rawFilePath)
+        METRICS.observe('rawDevelop', time.time() - start)
+
+    def stop(self):
+        """ Write the remaining RAW files; developing them is left for later. """
+        self.command = None
+        self.jobs.put(None)
+        self.join()
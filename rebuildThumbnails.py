@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+Rebuild the thumbnails (or larger previews) of all pictures at once
+
+    python rebuildThumbnails.py
+    python rebuildThumbnails.py --root archive_2016-09-03
+    python rebuildThumbnails.py --width 1024 --profile preview --output previews/
+
+The pictures are spread over a process pool using all cores. Each JPEG is
+decoded right at the thumbnail size by the decoder itself (DCT scaling, see
+jpegEncoder.readScaled), so the full picture is never decoded. Thumbnails newer than their picture and of the
+right width are skipped; with --hash a manifest of picture checksums in the
+output folder decides instead of the modification times.
+"""
+
+import os
+import sys
+import glob
+import time
+import json
+import hashlib
+import argparse
+import multiprocessing
+
+import cv2
+
+from jpegEncoder import ENCODE_PROFILES, readScaled, qimageToArray, writeFile
+from rawPreview import jpegFrame
+
+MANIFEST_FILE = ".manifest.json"
+
+
+def parseArguments():
+    parser = argparse.ArgumentParser(description="Rebuild thumbnails in parallel.")
+    parser.add_argument("--root", default=".",
+                        help="booth folder or an archive made by moveImages.sh (default: .)")
+    parser.add_argument("--input", default="pictures/", help="pictures, relative to the root")
+    parser.add_argument("--output", default="thumbnails/", help="thumbnails, relative to the root")
+    parser.add_argument("--width", type=int, default=200, help="width of the thumbnails (default: 200)")
+    parser.add_argument("--profile", default="thumbnail", choices=sorted(ENCODE_PROFILES),
+                        help="JPEG encode profile (default: thumbnail)")
+    parser.add_argument("--hash", action="store_true",
+                        help="decide what is up to date by content hash instead of mtime")
+    parser.add_argument("-f", "--force", action="store_true", help="rebuild everything")
+    parser.add_argument("-w", "--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="number of processes")
+    return parser.parse_args()
+
+
+def fileHash(filePath):
+    sha = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), ''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def rebuild(job):
+    """ Create one thumbnail; runs in the pool. Returns (picture, state, hash). """
+    picturePath, thumbnailPath, width, profileName, knownHash = job
+    try:
+        pictureHash = None
+        if knownHash is not None:
+            pictureHash = fileHash(picturePath)
+            if pictureHash == knownHash:
+                return picturePath, 'skipped', pictureHash
+
+        image = readScaled(picturePath, width)
+        if image is None:
+            return picturePath, 'failed', None
+        ok, data = cv2.imencode(".jpg", qimageToArray(image), ENCODE_PROFILES[profileName].imencodeParams())
+        writeFile(thumbnailPath, data.tostring())
+        return picturePath, 'done', pictureHash
+    except Exception as e:
+        print "\ncould not create a thumbnail of '{0}': {1}".format(picturePath, e)
+        return picturePath, 'failed', None
+
+
+def isUpToDate(picturePath, thumbnailPath, width):
+    """ The thumbnail is newer than the picture and has the requested width. """
+    if not os.path.isfile(thumbnailPath):
+        return False
+    if os.path.getmtime(thumbnailPath) < os.path.getmtime(picturePath):
+        return False
+    with open(thumbnailPath, 'rb') as f:
+        frame = jpegFrame(f, 0)
+    return frame is not None and frame[1] == width
+
+
+def main():
+    args = parseArguments()
+    inputPath = os.path.join(args.root, args.input)
+    outputPath = os.path.join(args.root, args.output)
+    if not os.path.isdir(inputPath):
+        print "no picture folder '{0}'".format(inputPath)
+        return 1
+    if not os.path.exists(outputPath):
+        os.makedirs(outputPath)
+
+    # the manifest remembers the hash of the picture each thumbnail was made from
+    manifestPath = os.path.join(outputPath, MANIFEST_FILE)
+    manifest = {}
+    if args.hash and os.path.isfile(manifestPath):
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+        if manifest.get('width') != args.width or manifest.get('profile') != args.profile:
+            manifest = {}
+    hashes = manifest.get('pictures', {})
+
+    jobs = []
+    skipped = 0
+    for picturePath in sorted(glob.glob(os.path.join(inputPath, "*.jpg"))):
+        name = os.path.basename(picturePath)
+        thumbnailPath = os.path.join(outputPath, name)
+        knownHash = None
+        if args.hash:
+            # an empty hash never matches, but the new one still gets recorded
+            knownHash = ''
+            if not args.force and os.path.isfile(thumbnailPath):
+                knownHash = hashes.get(name, '')
+        elif not args.force and isUpToDate(picturePath, thumbnailPath, args.width):
+            skipped += 1
+            continue
+        jobs.append((picturePath, thumbnailPath, args.width, args.profile, knownHash))
+
+    total = len(jobs) + skipped
+    counts = {'done': 0, 'skipped': skipped, 'failed': 0}
+    startTime = time.time()
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        for picturePath, state, pictureHash in pool.imap_unordered(rebuild, jobs, chunksize=4):
+            counts[state] += 1
+            if pictureHash is not None:
+                hashes[os.path.basename(picturePath)] = pictureHash
+            finished = sum(counts.values())
+            elapsed = max(time.time() - startTime, 1e-6)
+            sys.stdout.write("\r{0}/{1} pictures, {2} rebuilt, {3} up to date, {4} failed, {5:.1f} files/s   ".format(
+                finished, total, counts['done'], counts['skipped'], counts['failed'], counts['done'] / elapsed))
+            sys.stdout.flush()
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print "\ninterrupted"
+    pool.join()
+
+    if args.hash:
+        with open(manifestPath, 'w') as f:
+            json.dump({'width': args.width, 'profile': args.profile, 'pictures': hashes}, f)
+
+    print "\n{0} rebuilt, {1} up to date, {2} failed in {3:.1f} s".format(
+        counts['done'], counts['skipped'], counts['failed'], time.time() - startTime)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Background sampler for the resources used by the booth over an event:
+# memory, CPU per thread, open files, free disk space and the size of the
+# output folders. One CSV line per sample goes to a time-series file.
+
+import os
+import time
+import threading
+import psutil
+
+# time between two samples and between two scans of the folders (in seconds)
+SAMPLE_INTERVAL = 5
+FOLDER_INTERVAL = 60
+
+# show a warning on screen beyond these limits
+MEMORY_WARN_MB = 1500
+DISK_WARN_MB = 2000
+
+
+def getFolderSize(path):
+    """ Sum of the file sizes below a folder in bytes. """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+class ResourceMonitor(threading.Thread):
+    def __init__(self, folders, logPath="logs/resources.csv", interval=SAMPLE_INTERVAL):
+        threading.Thread.__init__(self, name="resourceMonitor")
+        self.daemon = True
+        self.folders = folders
+        self.logPath = logPath
+        self.interval = interval
+        self.process = psutil.Process()
+        self.threadTimes = {}
+        self.folderSizes = dict((f, 0) for f in folders)
+        self.lastFolderScan = 0
+        self.warning = None
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        logDir = os.path.dirname(self.logPath)
+        if logDir and not os.path.exists(logDir):
+            os.makedirs(logDir)
+        newFile = not os.path.isfile(self.logPath)
+        logFile = open(self.logPath, 'a')
+        if newFile:
+            header = ["time", "rss_mb", "cpu_pct", "fds", "disk_free_mb"]
+            header += [f.strip('/') + "_mb" for f in self.folders]
+            header.append("thread_cpu_pct")
+            logFile.write(",".join(header) + "\n")
+
+        self.process.cpu_percent()
+        lastSample = time.time()
+        while not self.stopEvent.wait(self.interval):
+            now = time.time()
+            logFile.write(self.sample(now - lastSample) + "\n")
+            logFile.flush()
+            lastSample = now
+        logFile.close()
+
+    def sample(self, elapsed):
+        """ Take one sample and return it as a CSV line. """
+        now = time.time()
+        rss = self.process.memory_info().rss / 1024.0**2
+        cpu = self.process.cpu_percent()
+        try:
+            fds = self.process.num_fds()
+        except AttributeError:
+            fds = len(self.process.open_files())
+        diskFree = psutil.disk_usage(os.getcwd()).free / 1024.0**2
+
+        # CPU per thread since the last sample
+        threadCpu = []
+        threadTimes = {}
+        for t in self.process.threads():
+            cpuTime = t.user_time + t.system_time
+            threadTimes[t.id] = cpuTime
+            if t.id in self.threadTimes and elapsed > 0:
+                percent = 100.0 * (cpuTime - self.threadTimes[t.id]) / elapsed
+                threadCpu.append("{0}:{1:.0f}".format(t.id, percent))
+        self.threadTimes = threadTimes
+
+        # the folders change slowly, scan them less often
+        if now - self.lastFolderScan > FOLDER_INTERVAL:
+            for f in self.folders:
+                self.folderSizes[f] = getFolderSize(f)
+            self.lastFolderScan = now
+
+        self.warning = self.checkLimits(rss, diskFree)
+
+        values = [time.strftime("%Y-%m-%dT%H:%M:%S"), "{0:.0f}".format(rss),
+                  "{0:.0f}".format(cpu), str(fds), "{0:.0f}".format(diskFree)]
+        values += ["{0:.0f}".format(self.folderSizes[f] / 1024.0**2) for f in self.folders]
+        values.append(" ".join(threadCpu))
+        return ",".join(values)
+
+    def checkLimits(self, rss, diskFree):
+        """ A message for the screen if memory or disk space run out. """
+        messages = []
+        if rss > MEMORY_WARN_MB:
+            messages.append("Speicher: {0:.0f} MB belegt".format(rss))
+        if diskFree < DISK_WARN_MB:
+            messages.append("Festplatte: nur noch {0:.0f} MB frei".format(diskFree))
+        if messages:
+            return " / ".join(messages)
+        return None
+
+    def stop(self):
+        self.stopEvent.set()
+        self.join(1.0)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Sampling profiler over all threads of the booth. The stacks are written in
+# the collapsed format of flamegraph.pl / speedscope, one file per booth
+# state and one with the state as the root frame.
+
+import os
+import sys
+import time
+import threading
+
+# time between two samples (in seconds)
+SAMPLE_INTERVAL = 0.01
+
+
+def collapseStack(frame):
+    """ Turn a frame and its parents into 'outer;...;inner'. """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = "{0} ({1})".format(code.co_name, os.path.basename(code.co_filename))
+        names.append(name.replace(';', ':'))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler(threading.Thread):
+    def __init__(self, stateGetter, interval=SAMPLE_INTERVAL, outputDir="profiles/"):
+        threading.Thread.__init__(self, name="samplingProfiler")
+        self.daemon = True
+        self.stateGetter = stateGetter
+        self.interval = interval
+        self.outputDir = outputDir
+        self.samples = {}
+        self.sampleCount = 0
+        self.threadNames = {}
+        self.stopEvent = threading.Event()
+
+    def updateThreadNames(self):
+        self.threadNames = dict((t.ident, t.name) for t in threading.enumerate())
+
+    def run(self):
+        self.startTime = time.time()
+        lastNameUpdate = 0
+        while not self.stopEvent.wait(self.interval):
+            now = time.time()
+            if now - lastNameUpdate > 1.0:
+                self.updateThreadNames()
+                lastNameUpdate = now
+
+            state = self.stateGetter()
+            stateSamples = self.samples.setdefault(state, {})
+            for threadId, frame in sys._current_frames().items():
+                if threadId == self.ident:
+                    continue
+                threadName = self.threadNames.get(threadId, str(threadId))
+                stack = threadName.replace(';', ':') + ";" + collapseStack(frame)
+                stateSamples[stack] = stateSamples.get(stack, 0) + 1
+            self.sampleCount += 1
+
+    def stop(self):
+        """ Stop sampling and write the profiles, returns the written files. """
+        self.stopEvent.set()
+        self.join()
+        return self.writeProfiles()
+
+    def writeProfiles(self):
+        if not os.path.exists(self.outputDir):
+            os.makedirs(self.outputDir)
+        prefix = os.path.join(self.outputDir, time.strftime("%Y-%m-%d_%H-%M-%S"))
+
+        files = []
+        combined = open(prefix + "_all.folded", 'w')
+        for state, stacks in sorted(self.samples.items()):
+            path = "{0}_{1}.folded".format(prefix, state)
+            with open(path, 'w') as stateFile:
+                for stack, count in sorted(stacks.items()):
+                    stateFile.write("{0} {1}\n".format(stack, count))
+                    combined.write("{0};{1} {2}\n".format(state, stack, count))
+            files.append(path)
+        combined.close()
+        files.append(prefix + "_all.folded")
+
+        print "profiled {0} samples in {1:.1f} s: {2}".format(
+            self.sampleCount, time.time() - self.startTime, ", ".join(files))
+        return files
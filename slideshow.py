@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# A slideshow of the newest pictures on a second screen, e.g. a TV next to
+# the booth. A background thread at the lowest priority decodes the next
+# picture ahead of time, directly at screen size (the JPEG decoder scales
+# while decoding); the window only swaps the prepared frame in, so a change
+# of picture never waits for a decoder. New pictures are shown right away.
+
+import time
+import Queue
+
+from PyQt4.QtCore import Qt, QThread, QTimer, pyqtSignal
+from PyQt4.QtGui import QWidget, QImage, QImageReader, QPixmap, QPainter, QPalette, QApplication
+
+from boothMetrics import METRICS
+from stagingStore import STAGING
+
+SLIDESHOW_INTERVAL_MS = 6000
+SLIDESHOW_COUNT = 30
+
+# jobs of the loader, the smaller the earlier
+P_NOW, P_NEXT = 0, 1
+
+
+class SlideshowLoader(QThread):
+    """ Decodes pictures at screen size, off the GUI thread. """
+    # emitted in this thread, delivered in the GUI thread
+    loaded = pyqtSignal(str, QImage, int)
+
+    def __init__(self):
+        QThread.__init__(self)
+        self.jobs = Queue.PriorityQueue()
+        self.jobCount = 0
+
+    def request(self, filePath, size, priority=P_NEXT):
+        self.jobCount += 1
+        self.jobs.put((priority, self.jobCount, filePath, size))
+
+    def run(self):
+        # started with QThread.IdlePriority (SCHED_IDLE on Linux); no nice
+        # value, on other systems that would slow down the whole booth
+        while True:
+            priority, jobId, filePath, size = self.jobs.get()
+            if filePath is None:
+                break
+            start = time.time()
+            reader = QImageReader(STAGING.resolve(filePath))
+            pictureSize = reader.size()
+            if pictureSize.isValid():
+                pictureSize.scale(size, Qt.KeepAspectRatio)
+                reader.setScaledSize(pictureSize)
+            image = reader.read()
+            if image.isNull():
+                print "slideshow could not read '{0}'".format(filePath)
+                continue
+            METRICS.observe('slideshowDecode', time.time() - start)
+            self.loaded.emit(filePath, image, priority)
+
+    def stop(self):
+        self.jobs.put((P_NOW, 0, None, None))
+        self.wait()
+
+
+class SlideshowWindow(QWidget):
+    def __init__(self, screen=1, parent=None):
+        QWidget.__init__(self, parent)
+        self.setWindowTitle("Fotobox")
+        palette = self.palette()
+        palette.setColor(QPalette.Window, Qt.black)
+        self.setPalette(palette)
+        self.setAutoFillBackground(True)
+        self.setCursor(Qt.BlankCursor)
+        self.screen = screen
+
+        self.pictures = []
+        self.position = 0
+        # the frame on screen and the one prepared for the next swap
+        self.frontBuffer = None
+        self.backBuffer = None
+        self.backPath = None
+
+        self.loader = SlideshowLoader()
+        self.loader.loaded.connect(self.pictureLoaded)
+        self.loader.start(QThread.IdlePriority)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.nextPicture)
+        self.timer.setInterval(SLIDESHOW_INTERVAL_MS)
+
+    def showOnScreen(self):
+        """ Full screen on the configured screen; False if it is not connected. """
+        desktop = QApplication.desktop()
+        if desktop.screenCount() <= self.screen:
+            return False
+        self.setGeometry(desktop.screenGeometry(self.screen))
+        self.showFullScreen()
+        self.timer.start()
+        self.preloadNext()
+        return True
+
+    def setPictures(self, filePaths):
+        """ The pictures to cycle through, newest first. """
+        self.pictures = filePaths[:SLIDESHOW_COUNT]
+        if self.position >= len(self.pictures):
+            self.position = 0
+        if self.backPath not in self.pictures:
+            self.backBuffer = None
+            self.backPath = None
+            self.preloadNext()
+
+    def showNow(self, filePath):
+        """ A new picture: decode it first and show it as soon as it is ready. """
+        if filePath not in self.pictures:
+            self.pictures.insert(0, filePath)
+            del self.pictures[SLIDESHOW_COUNT:]
+        if not self.isVisible():
+            return
+        self.loader.request(filePath, self.size(), P_NOW)
+
+    def preloadNext(self):
+        if not self.pictures or not self.isVisible():
+            return
+        self.backPath = self.pictures[self.position % len(self.pictures)]
+        self.loader.request(self.backPath, self.size(), P_NEXT)
+
+    def pictureLoaded(self, filePath, image, priority):
+        filePath = str(filePath)
+        if priority == P_NOW:
+            # show it right away and continue the cycle after it
+            self.frontBuffer = QPixmap.fromImage(image)
+            self.position = (self.pictures.index(filePath) + 1) if filePath in self.pictures else 0
+            self.update()
+            self.timer.start()
+            self.preloadNext()
+        elif filePath == self.backPath:
+            # converted now, the swap itself only exchanges the buffers
+            self.backBuffer = QPixmap.fromImage(image)
+            if self.frontBuffer is None:
+                self.nextPicture()
+
+    def nextPicture(self):
+        if self.backBuffer is None:
+            # still decoding, keep the current picture a bit longer
+            return
+        self.frontBuffer, self.backBuffer = self.backBuffer, None
+        self.position = (self.position + 1) % max(len(self.pictures), 1)
+        self.update()
+        self.preloadNext()
+
+    def paintEvent(self, event):
+        if self.frontBuffer is None:
+            return
+        painter = QPainter(self)
+        pixmap = self.frontBuffer
+        if pixmap.width() > self.width() or pixmap.height() > self.height():
+            # decoded for another size, e.g. before the window was full screen
+            pixmap = pixmap.scaled(self.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        painter.drawPixmap((self.width() - pixmap.width()) / 2, (self.height() - pixmap.height()) / 2, pixmap)
+        painter.end()
+
+    def resizeEvent(self, event):
+        # prepare the next picture again at the new size
+        self.backBuffer = None
+        self.preloadNext()
+
+    def stop(self):
+        self.timer.stop()
+        self.loader.stop()
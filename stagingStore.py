@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# New files land in RAM first. At events the booth usually writes to a slow
+# USB stick or SD card; with a staging folder on a tmpfs (/dev/shm) the
+# journal writes there instead and a flusher thread copies the files to
+# their real place in the order they were written. Until then they are read
+# from RAM: resolve() gives the path to read a file from, glob() lists both
+# places; remove() and move() take a file out of the queue as well, so the
+# flusher doesn't write it back. If the staging area is full, writing waits
+# for the flusher. Files left in RAM by a crash are flushed at the next
+# start, everything else is flushed when the journal stops. Other processes
+# (gallery, uploader) attach() to read the staged files.
+
+import os
+import glob
+import time
+import shutil
+import threading
+from collections import deque
+
+from boothMetrics import METRICS
+from captureJournal import JOURNAL, TEMP_SUFFIX
+
+STAGING_PATH = "/dev/shm/photobooth"
+
+# writing waits while this much is not flushed yet
+STAGING_LIMIT = 256*1024*1024
+
+# the persistent volume failed (full, unplugged), try again after a while
+FLUSH_RETRY_SECONDS = 5.0
+
+COPY_BLOCK = 1024*1024
+
+
+class StagingStore():
+    def __init__(self):
+        self.root = None
+        self.limit = STAGING_LIMIT
+        self.condition = threading.Condition()
+        # files waiting for the flush, oldest first, with their size and the
+        # number of times they were written (a print may be written again)
+        self.queue = deque()
+        self.staged = {}
+        self.versions = {}
+        self.stagedBytes = 0
+        # the file the flusher is copying right now
+        self.flushing = None
+        self.flushThread = None
+        self.stopped = False
+
+    def open(self, root=STAGING_PATH, limit=STAGING_LIMIT):
+        """ Stage new files under root; False if it cannot be used. """
+        try:
+            if not os.path.isdir(root):
+                os.makedirs(root)
+        except OSError as e:
+            print "no staging in '{0}': {1}".format(root, e)
+            return False
+        self.root = root
+        self.limit = limit
+        self.stopped = False
+
+        # left over from a crash: complete files go to their place right
+        # away (before the journal's recovery looks at them)
+        leftovers = []
+        for path, dirs, files in os.walk(root):
+            for f in files:
+                stagedPath = os.path.join(path, f)
+                if f.endswith(TEMP_SUFFIX):
+                    os.remove(stagedPath)
+                else:
+                    leftovers.append((os.path.getmtime(stagedPath), os.path.relpath(stagedPath, root)))
+        for mtime, filePath in sorted(leftovers):
+            print "flushing '{0}' left in RAM".format(filePath)
+            try:
+                self.flushFile(filePath)
+                os.remove(self.stagedPath(filePath))
+            except (IOError, OSError) as e:
+                print "could not flush '{0}': {1}".format(filePath, e)
+                self.queue.append(filePath)
+                self.staged[filePath] = os.path.getsize(self.stagedPath(filePath))
+                self.versions[filePath] = 1
+                self.stagedBytes += self.staged[filePath]
+
+        JOURNAL.staging = self
+        self.flushThread = threading.Thread(target=self.flushLoop, name="stagingStore")
+        self.flushThread.daemon = True
+        self.flushThread.start()
+        return True
+
+    def attach(self, root=STAGING_PATH):
+        """ Only read the files staged by the booth, e.g. in another process. """
+        self.root = root if os.path.isdir(root) else None
+
+    def isActive(self):
+        return self.root is not None and not self.stopped
+
+    def stagedPath(self, filePath):
+        return os.path.join(self.root, os.path.normpath(filePath))
+
+    def resolve(self, filePath):
+        """ Where to read a file from: in RAM until it is flushed. """
+        if self.root is None or os.path.isabs(filePath):
+            return filePath
+        stagedPath = self.stagedPath(filePath)
+        return stagedPath if os.path.exists(stagedPath) else filePath
+
+    def getctime(self, filePath):
+        """ os.path.getctime, also for a file flushed between resolve() and stat. """
+        try:
+            return os.path.getctime(self.resolve(filePath))
+        except OSError:
+            return os.path.getctime(filePath)
+
+    def glob(self, pattern):
+        """ Like glob.glob, for the flushed and the staged files. """
+        filePaths = set(glob.glob(pattern))
+        if self.root is not None:
+            offset = len(os.path.join(self.root, ""))
+            filePaths.update(p[offset:] for p in glob.glob(os.path.join(self.root, pattern)))
+        return list(filePaths)
+
+    def tempPath(self, filePath):
+        """ Where to write a file in RAM; waits while the staging area is full. """
+        with self.condition:
+            if self.stagedBytes >= self.limit:
+                start = time.time()
+                while self.stagedBytes >= self.limit and not self.stopped:
+                    self.condition.wait(1.0)
+                METRICS.observe('stagingWait', time.time() - start)
+        stagedPath = self.stagedPath(filePath)
+        folder = os.path.dirname(stagedPath)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # created by another writer in the meantime
+                pass
+        return stagedPath + TEMP_SUFFIX
+
+    def commit(self, filePath):
+        """ A file written to tempPath() is complete; False if it is not in RAM. """
+        if self.root is None or os.path.isabs(filePath):
+            return False
+        stagedPath = self.stagedPath(filePath)
+        if not os.path.exists(stagedPath + TEMP_SUFFIX):
+            return False
+        with self.condition:
+            if self.stopped:
+                # written while stopping, goes directly to its place
+                shutil.move(stagedPath + TEMP_SUFFIX, filePath + TEMP_SUFFIX)
+                return False
+            # renamed under the lock, so the flusher never removes a newer version
+            os.rename(stagedPath + TEMP_SUFFIX, stagedPath)
+            size = os.path.getsize(stagedPath)
+            if filePath not in self.staged:
+                self.queue.append(filePath)
+            self.stagedBytes += size - self.staged.get(filePath, 0)
+            self.staged[filePath] = size
+            self.versions[filePath] = self.versions.get(filePath, 0) + 1
+            self.condition.notify_all()
+        return True
+
+    def unqueue(self, filePath):
+        """ Take a file out of the queue, the condition held; its staged path or None. """
+        if self.root is None or os.path.isabs(filePath):
+            return None
+        # the file being copied is removed from RAM afterwards
+        while self.flushing == filePath:
+            self.condition.wait(1.0)
+        if filePath not in self.staged:
+            return None
+        self.queue.remove(filePath)
+        self.stagedBytes -= self.staged.pop(filePath)
+        del self.versions[filePath]
+        self.condition.notify_all()
+        return self.stagedPath(filePath)
+
+    def remove(self, filePath):
+        """ Delete a file, staged or already flushed. """
+        with self.condition:
+            stagedPath = self.unqueue(filePath)
+            if stagedPath is not None:
+                os.remove(stagedPath)
+        if stagedPath is None or os.path.exists(filePath):
+            os.remove(filePath)
+
+    def move(self, filePath, newPath):
+        """ Rename a file, staged or already flushed; newPath is not staged. """
+        with self.condition:
+            stagedPath = self.unqueue(filePath)
+            if stagedPath is not None:
+                shutil.move(stagedPath, newPath)
+        if stagedPath is None:
+            os.rename(filePath, newPath)
+        elif os.path.exists(filePath):
+            # an older version was flushed already
+            os.remove(filePath)
+
+    def flushFile(self, filePath):
+        """ Copy a staged file to its place: temporary name, then rename. """
+        folder = os.path.dirname(filePath)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(self.stagedPath(filePath), 'rb') as source:
+            with open(filePath + TEMP_SUFFIX, 'wb') as target:
+                shutil.copyfileobj(source, target, COPY_BLOCK)
+        os.rename(filePath + TEMP_SUFFIX, filePath)
+
+    def flushLoop(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    self.condition.wait()
+                if not self.queue:
+                    break
+                filePath = self.queue[0]
+                version = self.versions[filePath]
+                self.flushing = filePath
+
+            start = time.time()
+            try:
+                self.flushFile(filePath)
+            except (IOError, OSError) as e:
+                print "could not flush '{0}': {1}".format(filePath, e)
+                with self.condition:
+                    self.flushing = None
+                    if not os.path.exists(self.stagedPath(filePath)):
+                        # gone from RAM (e.g. deleted by hand), retrying cannot help
+                        self.queue.popleft()
+                        self.stagedBytes -= self.staged.pop(filePath)
+                        del self.versions[filePath]
+                        self.condition.notify_all()
+                        continue
+                    self.condition.notify_all()
+                if self.stopped:
+                    # stays in RAM until the next start
+                    break
+                time.sleep(FLUSH_RETRY_SECONDS)
+                continue
+            METRICS.observe('stagingFlush', time.time() - start)
+            # synced with the journal's next batch
+            JOURNAL.committed(filePath)
+
+            with self.condition:
+                self.flushing = None
+                self.queue.popleft()
+                if self.versions[filePath] != version:
+                    # written again meanwhile, flush the new version as well
+                    self.queue.append(filePath)
+                else:
+                    os.remove(self.stagedPath(filePath))
+                    self.stagedBytes -= self.staged.pop(filePath)
+                    del self.versions[filePath]
+                self.condition.notify_all()
+
+    def flushAll(self):
+        """ Wait until everything written so far is at its place. """
+        with self.condition:
+            while self.queue and self.flushThread is not None and self.flushThread.is_alive():
+                self.condition.wait(1.0)
+
+    def stop(self):
+        """ Flush everything; later files are written directly. """
+        if self.flushThread is None:
+            return
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.flushThread.join()
+        self.flushThread = None
+
+
+STAGING = StagingStore()
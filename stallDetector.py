@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Watchdog for the Qt event loop. The GUI thread calls beat() from a short
+# QTimer; if no beat arrives within the threshold, the watchdog thread grabs
+# the stack of the GUI thread so we know which call blocked the booth.
+
+import os
+import sys
+import time
+import threading
+import traceback
+import logging
+
+from boothMetrics import METRICS
+
+# only frames from files below this directory count as "our" code
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stall():
+    def __init__(self, start, stack):
+        self.start = start
+        self.stack = stack
+        self.duration = 0.0
+
+    def blockingCall(self):
+        """ The innermost frame of the booth's own code, as a short description. """
+        if not self.stack:
+            return "unknown"
+        frame = self.stack[-1]
+        for candidate in reversed(self.stack):
+            if os.path.abspath(candidate[0]).startswith(APP_DIR):
+                frame = candidate
+                break
+        filename, lineno, function, text = frame
+        return "{0} ({1}:{2}): {3}".format(function, os.path.basename(filename), lineno, text)
+
+
+class StallDetector(threading.Thread):
+    def __init__(self, threshold=0.25, interval=0.05, logPath="logs/stalls.log"):
+        threading.Thread.__init__(self, name="stallDetector")
+        self.daemon = True
+        self.threshold = threshold
+        self.interval = interval
+        self.mainThreadId = threading.current_thread().ident
+        self.lastBeat = time.time()
+        self.currentStall = None
+        self.stalls = []
+        self.stopEvent = threading.Event()
+
+        logDir = os.path.dirname(logPath)
+        if logDir and not os.path.exists(logDir):
+            os.makedirs(logDir)
+        self.logger = logging.getLogger("photobooth.stalls")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        handler = logging.FileHandler(logPath)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        self.logger.addHandler(handler)
+
+    def beat(self):
+        """ Called from the GUI thread by a QTimer with the given interval. """
+        now = time.time()
+        latency = now - self.lastBeat - self.interval
+        self.lastBeat = now
+        METRICS.observe('eventLoopLatency', max(latency, 0.0))
+
+        # the loop is running again, close the stall
+        stall = self.currentStall
+        if stall is not None:
+            self.currentStall = None
+            stall.duration = now - stall.start - self.interval
+            self.stalls.append(stall)
+            METRICS.observe('eventLoopStall', stall.duration)
+            self.logger.info("event loop blocked for {0:.0f} ms in {1}".format(
+                stall.duration*1000, stall.blockingCall()))
+            self.logger.info("stack:\n" + "".join(traceback.format_list(stall.stack)))
+
+    def run(self):
+        while not self.stopEvent.wait(self.threshold / 4):
+            lastBeat = self.lastBeat
+            if self.currentStall is None and time.time() - lastBeat - self.interval > self.threshold:
+                frame = sys._current_frames().get(self.mainThreadId)
+                stack = traceback.extract_stack(frame) if frame is not None else []
+                self.currentStall = Stall(lastBeat, stack)
+
+    def stop(self):
+        """ Stop watching and write the summary of all stalls. """
+        self.stopEvent.set()
+        self.join(1.0)
+        summary = self.report()
+        self.logger.info(summary)
+        print summary
+
+    def report(self):
+        """ Summarise the stalls grouped by the call which blocked the loop. """
+        if not self.stalls:
+            return "no event loop stalls above {0:.0f} ms".format(self.threshold*1000)
+
+        calls = {}
+        for stall in self.stalls:
+            calls.setdefault(stall.blockingCall(), []).append(stall.duration)
+
+        lines = ["event loop stalls above {0:.0f} ms: {1}, {2:.1f} s in total".format(
+            self.threshold*1000, len(self.stalls), sum(s.duration for s in self.stalls))]
+        ranking = sorted(calls.items(), key=lambda c: sum(c[1]), reverse=True)
+        for call, durations in ranking:
+            lines.append("{0:>5}x  total {1:>7.0f} ms  max {2:>6.0f} ms  {3}".format(
+                len(durations), sum(durations)*1000, max(durations)*1000, call))
+        return "\n".join(lines)
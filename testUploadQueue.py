@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Check the uploader against a storage kept in memory, no network or boto3
+needed
+
+    python testUploadQueue.py
+
+It goes through a multipart upload that breaks off and is resumed (only
+the missing parts are sent again), a second file with the same content
+(copied on the storage instead of sent) and a print that is written again
+(requeued and sent with its new content). Parts are made small, so the
+files stay small too.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import uploadQueue
+from uploadQueue import UploadDatabase, Uploader, S_DONE, S_COPIED
+
+PART_SIZE = 64*1024
+
+
+class MemoryStorage():
+    """ The calls of the boto3 client the uploader uses. """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.nextUploadId = 0
+        self.sentParts = []
+        self.copies = []
+        # PartNumber that fails once, like a dropped connection
+        self.failPart = None
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise KeyError("NoSuchKey")
+        return {'Metadata': self.objects[Key][1]}
+
+    def put_object(self, Bucket, Key, Body, ContentLength, Metadata):
+        self.objects[Key] = (Body.read(), Metadata)
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective):
+        self.objects[Key] = self.objects[CopySource['Key']]
+        self.copies.append((CopySource['Key'], Key))
+
+    def create_multipart_upload(self, Bucket, Key, Metadata):
+        self.nextUploadId += 1
+        uploadId = str(self.nextUploadId)
+        self.uploads[uploadId] = (Key, Metadata, {})
+        return {'UploadId': uploadId}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, ContentLength, Body):
+        if PartNumber == self.failPart:
+            self.failPart = None
+            raise IOError("connection reset")
+        data = Body.read()
+        assert len(data) == ContentLength
+        self.uploads[UploadId][2][PartNumber] = data
+        self.sentParts.append(PartNumber)
+        return {'ETag': "etag{0}".format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        key, metadata, parts = self.uploads.pop(UploadId)
+        data = "".join(parts[p['PartNumber']] for p in MultipartUpload['Parts'])
+        self.objects[key] = (data, metadata)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+
+def writeFile(filePath, data):
+    folder = os.path.dirname(filePath)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(filePath, 'wb') as f:
+        f.write(data)
+
+
+def state(database, filePath):
+    return database.db.execute("SELECT state FROM files WHERE path=?", (filePath,)).fetchone()[0]
+
+
+def check(name, condition):
+    print "{0:<40} {1}".format(name, "ok" if condition else "FAILED")
+    return condition
+
+
+def main():
+    uploadQueue.PART_SIZE = PART_SIZE
+    uploadQueue.MULTIPART_THRESHOLD = 2*PART_SIZE
+    folder = tempfile.mkdtemp(prefix="testUploadQueue_")
+    cwd = os.getcwd()
+    os.chdir(folder)
+    results = []
+    try:
+        storage = MemoryStorage()
+        target = {'bucket': "booth", 'prefix': "test/", 'rate': 1024*1024*1024}
+        dbPath = "logs/uploads.sqlite"
+
+        # multipart upload broken off at the third part, then resumed after a restart
+        big = os.urandom(5*PART_SIZE + 1000)
+        writeFile("series/big.jpg", big)
+        database = UploadDatabase(dbPath)
+        database.add(["series/big.jpg"])
+        storage.failPart = 3
+        uploader = Uploader(storage, target, database, workers=0)
+        try:
+            uploader.upload("series/big.jpg")
+        except IOError:
+            database.failed("series/big.jpg")
+        database.close()
+        database = UploadDatabase(dbPath)
+        uploader = Uploader(storage, target, database, workers=0)
+        uploader.upload("series/big.jpg")
+        results.append(check("multipart: only missing parts resent", storage.sentParts == [1, 2, 3, 4, 5, 6]))
+        results.append(check("multipart: object complete", storage.objects["test/series/big.jpg"][0] == big))
+        results.append(check("multipart: done", state(database, "series/big.jpg") == S_DONE))
+
+        # the same content a second time is copied on the storage
+        small = os.urandom(1000)
+        writeFile("pictures/a.jpg", small)
+        writeFile("pictures/b.jpg", small)
+        database.add(["pictures/a.jpg", "pictures/b.jpg"])
+        uploader.upload("pictures/a.jpg")
+        uploader.upload("pictures/b.jpg")
+        results.append(check("dedup: copied instead of sent", storage.copies == [("test/pictures/a.jpg", "test/pictures/b.jpg")]))
+        results.append(check("dedup: copied", state(database, "pictures/b.jpg") == S_COPIED))
+
+        # a print written again goes up again with the new content
+        writeFile("prints/p.jpg", os.urandom(1000))
+        database.add(["prints/p.jpg"])
+        uploader.upload("prints/p.jpg")
+        newPrint = os.urandom(1200)
+        writeFile("prints/p.jpg", newPrint)
+        if not database.add(["prints/p.jpg"]):
+            database.requeue("prints/p.jpg")
+        results.append(check("requeue: due again", database.take(10) == ["prints/p.jpg"]))
+        uploader.upload("prints/p.jpg")
+        results.append(check("requeue: new content sent", storage.objects["test/prints/p.jpg"][0] == newPrint))
+        database.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# All thumbnails in one file, so the gallery doesn't open and decode a JPEG
+# per picture. Every thumbnail is an uncompressed RGB565 tile of the same
+# size; the tiles are appended to one file and an index file next to it
+# holds a fixed-size record per tile (name and size of the picture inside),
+# the n-th record belongs to the n-th tile. The booth maps the tile file
+# into memory and the icons paint their tile straight from there, only when
+# they are shown. Thumbnails are appended in the background; a newer
+# thumbnail of the same picture gets a new tile, the last one counts.
+# Booths sharing the folder append under a lock on the index file and pick
+# up each other's tiles before appending. The atlas is only a cache:
+# deleted, it is filled again from the thumbnails.
+
+import os
+import time
+import mmap
+import fcntl
+import Queue
+import struct
+import threading
+
+from PyQt4.QtCore import Qt, QSize, QRect, QPoint
+from PyQt4.QtGui import QIcon, QIconEngineV2, QImage, QPixmap, QPainter
+
+from boothMetrics import METRICS
+from stagingStore import STAGING
+
+ATLAS_TILES = ".atlas.tiles"
+ATLAS_INDEX = ".atlas.index"
+
+# the icons in the list are 170 x 130
+TILE_WIDTH = 200
+TILE_HEIGHT = 150
+TILE_BYTES = TILE_WIDTH * TILE_HEIGHT * 2
+
+# a tile file of another tile size is started over
+MAGIC = "PBATLAS1"
+HEADER = struct.Struct("<8sHH")
+RECORD = struct.Struct("<96sHHd")
+
+
+def tileData(image):
+    """ A QImage scaled into a tile: RGB565 bytes and the size of the picture in it. """
+    image = image.scaled(TILE_WIDTH, TILE_HEIGHT, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    tile = QImage(TILE_WIDTH, TILE_HEIGHT, QImage.Format_RGB16)
+    tile.fill(0)
+    painter = QPainter(tile)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return tile.constBits().asstring(TILE_BYTES), image.width(), image.height()
+
+
+def writeAll(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+class AtlasIconEngine(QIconEngineV2):
+    """ Paints a tile of the atlas, only when the icon is shown. """
+    def __init__(self, atlas, generation, slot, width, height):
+        QIconEngineV2.__init__(self)
+        self.atlas = atlas
+        self.generation = generation
+        self.slot = slot
+        self.size = QSize(width, height)
+
+    def actualSize(self, size, mode, state):
+        actual = QSize(self.size)
+        actual.scale(size, Qt.KeepAspectRatio)
+        return actual
+
+    def paint(self, painter, rect, mode, state):
+        data = self.atlas.tile(self.generation, self.slot)
+        if data is None:
+            return
+        # the slice copies the tile out of the map (60 KB), the QImage uses that copy as it is
+        image = QImage(data, self.size.width(), self.size.height(), TILE_WIDTH * 2, QImage.Format_RGB16)
+        size = self.actualSize(rect.size(), mode, state)
+        target = QRect(QPoint(rect.x() + (rect.width() - size.width()) / 2,
+                              rect.y() + (rect.height() - size.height()) / 2), size)
+        painter.drawImage(target, image)
+
+    def pixmap(self, size, mode, state):
+        pixmap = QPixmap(self.actualSize(size, mode, state))
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        self.paint(painter, QRect(QPoint(0, 0), pixmap.size()), mode, state)
+        painter.end()
+        return pixmap
+
+    def clone(self):
+        return AtlasIconEngine(self.atlas, self.generation, self.slot, self.size.width(), self.size.height())
+
+
+class ThumbnailAtlas():
+    def __init__(self, folder):
+        self.tilesPath = os.path.join(folder, ATLAS_TILES)
+        self.indexPath = os.path.join(folder, ATLAS_INDEX)
+        self.lock = threading.Lock()
+        # name -> (slot, width, height), the newest tile of each picture
+        self.slots = {}
+        self.count = 0
+        self.tilesFd = None
+        self.indexFd = None
+        self.map = None
+        # icons of a closed atlas paint nothing
+        self.generation = 0
+        self.jobs = None
+        self.packThread = None
+        self.stopEvent = None
+        self.open()
+
+    def open(self):
+        folder = os.path.dirname(self.indexPath)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        start = time.time()
+        self.generation += 1
+        self.slots = {}
+        self.count = 0
+        self.indexFd = os.open(self.indexPath, os.O_RDWR | os.O_CREAT, 0o644)
+        self.tilesFd = os.open(self.tilesPath, os.O_RDWR | os.O_CREAT, 0o644)
+
+        fcntl.flock(self.indexFd, fcntl.LOCK_EX)
+        try:
+            header = os.read(self.indexFd, HEADER.size)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, TILE_WIDTH, TILE_HEIGHT):
+                os.ftruncate(self.tilesFd, 0)
+                os.ftruncate(self.indexFd, 0)
+                os.lseek(self.indexFd, 0, os.SEEK_SET)
+                writeAll(self.indexFd, HEADER.pack(MAGIC, TILE_WIDTH, TILE_HEIGHT))
+            # one read for the whole index
+            self.refresh()
+        finally:
+            fcntl.flock(self.indexFd, fcntl.LOCK_UN)
+        METRICS.observe('atlasOpen', time.time() - start)
+
+        self.jobs = Queue.Queue()
+        self.queued = set()
+        self.stopEvent = threading.Event()
+        self.packThread = threading.Thread(target=self.packLoop, name="thumbnailAtlas")
+        self.packThread.daemon = True
+        self.packThread.start()
+
+    def refresh(self):
+        """ Read the records appended since, also by other booths; the index locked. """
+        # a tile is written before its record: a record needs its tile, a
+        # tile without record (or half a record) is left by a crash and
+        # overwritten by the next tile
+        count = min((os.fstat(self.indexFd).st_size - HEADER.size) // RECORD.size,
+                    os.fstat(self.tilesFd).st_size // TILE_BYTES)
+        if count <= self.count:
+            return
+        os.lseek(self.indexFd, HEADER.size + self.count * RECORD.size, os.SEEK_SET)
+        data = os.read(self.indexFd, (count - self.count) * RECORD.size)
+        for slot in range(self.count, self.count + len(data) // RECORD.size):
+            name, width, height, added = RECORD.unpack_from(data, (slot - self.count) * RECORD.size)
+            self.slots[name.rstrip("\0")] = (slot, width, height)
+        self.count += len(data) // RECORD.size
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def icon(self, name):
+        """ The icon of a picture (by file name), None if it is not in the atlas. """
+        entry = self.slots.get(name)
+        if entry is None:
+            return None
+        return QIcon(AtlasIconEngine(self, self.generation, *entry))
+
+    def tile(self, generation, slot):
+        """ The bytes of a tile, None if the atlas was closed or reopened since. """
+        if generation != self.generation or self.tilesFd is None:
+            return None
+        offset = slot * TILE_BYTES
+        if self.map is None or offset + TILE_BYTES > len(self.map):
+            # grown by appended tiles
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.tilesFd, 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + TILE_BYTES]
+
+    def add(self, name, image, replace=True):
+        """ Append the tile of a thumbnail (QImage); not again if it is packed, unless replace. """
+        data, width, height = tileData(image)
+        with self.lock:
+            if self.tilesFd is None:
+                return
+            # another booth may have appended in the meantime
+            fcntl.flock(self.indexFd, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                if name in self.slots and not replace:
+                    return
+                slot = self.count
+                os.lseek(self.tilesFd, slot * TILE_BYTES, os.SEEK_SET)
+                writeAll(self.tilesFd, data)
+                os.lseek(self.indexFd, HEADER.size + slot * RECORD.size, os.SEEK_SET)
+                writeAll(self.indexFd, RECORD.pack(name, width, height, time.time()))
+                self.count += 1
+                self.slots[name] = (slot, width, height)
+            finally:
+                fcntl.flock(self.indexFd, fcntl.LOCK_UN)
+
+    def pack(self, thumbnailFiles, replace=False):
+        """ Add thumbnails in the background; replace a packed one, e.g. if rebuilt. """
+        for filePath in thumbnailFiles:
+            if replace or filePath not in self.queued:
+                self.queued.add(filePath)
+                self.jobs.put((filePath, replace))
+
+    def packLoop(self):
+        while True:
+            filePath, replace = self.jobs.get()
+            if filePath is None or self.stopEvent.is_set():
+                break
+            self.queued.discard(filePath)
+            name = os.path.basename(filePath)
+            if name in self.slots and not replace:
+                continue
+            image = QImage(STAGING.resolve(filePath))
+            if not image.isNull():
+                self.add(name, image, replace)
+
+    def close(self):
+        """ Stop packing and close the files; unpacked thumbnails stay files. """
+        if self.packThread is None:
+            return
+        # the rest is packed after the next open
+        self.stopEvent.set()
+        self.jobs.put((None, False))
+        self.packThread.join()
+        self.packThread = None
+        with self.lock:
+            self.generation += 1
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            os.close(self.tilesFd)
+            os.close(self.indexFd)
+            self.tilesFd = None
+            self.indexFd = None
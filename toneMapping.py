@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Monotone coloring of the portraits with a lookup table. It follows the
+# ImageMagick command used before,
+#   convert in ( -clone 0 -contrast -contrast -colorspace Gray
+#                +level-colors 'rgb(tone)', ) -compose blend
+#              -define compose:args=80 -composite out
+# but is cheap enough to run on every frame of the live view.
+
+import numpy as np
+import cv2
+
+# share of the toned image in the blend with the original (compose:args=80)
+TONE_STRENGTH = 0.8
+
+
+def buildToneLut(red, green, blue):
+    """ A 3-channel table mapping a gray value to its (weighted) toned BGR color. """
+    gray = np.arange(256, dtype=np.float64) / 255.0
+
+    # -contrast, twice
+    for i in range(2):
+        gray += 0.5 * (0.5 * (np.sin(np.pi * (gray - 0.5)) + 1.0) - gray)
+    gray = np.clip(gray, 0.0, 1.0)
+
+    # +level-colors tone, maps black to the tone and white to white
+    tone = np.array([blue, green, red], dtype=np.float64)
+    toned = tone + (255.0 - tone) * gray[:, np.newaxis]
+
+    lut = np.round(TONE_STRENGTH * toned)
+    return lut.astype(np.uint8).reshape(256, 1, 3)
+
+
+def applyTone(frame, lut):
+    """ Color a BGR frame with a table from buildToneLut. """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    toned = cv2.LUT(cv2.merge([gray, gray, gray]), lut)
+    return cv2.addWeighted(toned, 1.0, frame, 1.0 - TONE_STRENGTH, 0)
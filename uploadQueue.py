@@ -0,0 +1,552 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# pyPhotoBooth - Python tool to take pictures and print them
+# http://github.com/Nepomuk/pyPhotoBooth
+
+# Uploads the pictures, series and prints to an S3 compatible storage (AWS,
+# MinIO, ...) while the booth is running. The booth only hands the path of a
+# finished file over; everything else happens in a separate process at the
+# lowest CPU and disk priority, so capturing, printing and the live view
+# always come first. The process is this script started anew (not forked
+# from the booth), the paths go to it line by line on stdin. The queue is an SQLite file: files, retries and the
+# parts of large (multipart) uploads survive a restart and continue where
+# they stopped. Several files are sent in parallel, all together limited to
+# a bandwidth cap; a file with the same content as one already uploaded is
+# copied on the storage instead of being sent again. After an event it can
+# also be started on its own:
+#
+#     python uploadQueue.py --endpoint http://192.168.1.2:9000 --bucket fotobox --prefix hochzeit/
+
+import os
+import sys
+import time
+import errno
+import Queue
+import ctypes
+import ctypes.util
+import sqlite3
+import hashlib
+import argparse
+import platform
+import threading
+import subprocess
+
+from stagingStore import STAGING, STAGING_PATH
+
+UPLOAD_NICE = 19
+UPLOAD_DB = "logs/uploads.sqlite"
+UPLOAD_FOLDERS = ["pictures/", "series/", "prints/"]
+
+# files sent at the same time and their bandwidth together (bytes/s)
+UPLOAD_WORKERS = 3
+UPLOAD_RATE = 1024*1024
+
+# larger files are sent in parts (at least 5 MB, except for the last one)
+PART_SIZE = 8*1024*1024
+MULTIPART_THRESHOLD = 16*1024*1024
+
+# seconds until a failed upload is tried again, the last one repeats
+RETRY_SECONDS = [10, 60, 300, 900]
+
+# how often the queue is checked for retries when nothing new comes in
+POLL_SECONDS = 5.0
+
+READ_BLOCK = 1024*1024
+
+# written by the journal, not complete yet
+TEMP_SUFFIX = ".tmp"
+
+# states of a file in the queue
+S_QUEUED, S_ACTIVE, S_DONE, S_COPIED, S_MISSING = "queued", "active", "done", "copied", "missing"
+
+# idle disk priority, only known to the kernel as a system call
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_SET_SYSCALL = {'x86_64': 251, 'i386': 289, 'i686': 289, 'armv6l': 314, 'armv7l': 314, 'aarch64': 30}
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _syscall = _libc.syscall
+except (OSError, AttributeError):
+    _syscall = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    sha256 TEXT,
+    uploadId TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    nextTry REAL NOT NULL DEFAULT 0,
+    added REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_due ON files (state, nextTry);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+CREATE TABLE IF NOT EXISTS parts (
+    path TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    PRIMARY KEY (path, number)
+);
+"""
+
+
+def setIdlePriority():
+    """ Lowest CPU priority and, on Linux, the idle disk I/O class. """
+    try:
+        os.nice(UPLOAD_NICE)
+    except OSError:
+        pass
+    # the numbers of the system call are those of Linux
+    if not sys.platform.startswith('linux'):
+        return False
+    number = IOPRIO_SET_SYSCALL.get(platform.machine())
+    if _syscall is None or number is None:
+        return False
+    return _syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0
+
+
+def fileHash(filePath):
+    sha256 = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCK), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class TokenBucket():
+    """ Bandwidth cap shared by all upload threads. """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self, amount):
+        """ Wait until amount bytes may be sent. """
+        while amount > 0:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                chunk = min(amount, self.burst)
+                wait = (chunk - self.tokens) / self.rate
+                if wait <= 0:
+                    self.tokens -= chunk
+                    amount -= chunk
+            if wait > 0:
+                time.sleep(wait)
+
+
+class ThrottledPart():
+    """ A part of a file as request body, every read waits for the bandwidth cap. """
+    def __init__(self, f, offset, length, bucket):
+        self.f = f
+        self.offset = offset
+        self.length = length
+        self.bucket = bucket
+        self.position = 0
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        self.bucket.take(size)
+        self.f.seek(self.offset + self.position)
+        data = self.f.read(size)
+        self.position += len(data)
+        return data
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self.position
+        elif whence == os.SEEK_END:
+            position += self.length
+        self.position = max(0, min(position, self.length))
+
+    def tell(self):
+        return self.position
+
+    def __len__(self):
+        return self.length
+
+
+class UploadDatabase():
+    """ The persistent queue, used by the upload threads together. """
+    def __init__(self, dbPath=UPLOAD_DB):
+        folder = os.path.dirname(dbPath)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbPath, check_same_thread=False)
+        # fewer syncs, the queue may lose the last entries on a power cut
+        # (they are found again by the scan at the next start)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        # interrupted by the last stop
+        self.db.execute("UPDATE files SET state=? WHERE state=?", (S_QUEUED, S_ACTIVE))
+        self.db.commit()
+
+    def add(self, filePaths):
+        with self.lock:
+            now = time.time()
+            cursor = self.db.executemany("INSERT OR IGNORE INTO files (path, state, added) VALUES (?, ?, ?)",
+                                         ((p, S_QUEUED, now) for p in filePaths))
+            self.db.commit()
+            return cursor.rowcount
+
+    def requeue(self, filePath):
+        """ A file that was written again (e.g. a print) has to go up again. """
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO files (path, state, added) VALUES (?, ?, ?)",
+                            (filePath, S_QUEUED, time.time()))
+            self.db.execute("DELETE FROM parts WHERE path=?", (filePath,))
+            self.db.commit()
+
+    def take(self, limit):
+        """ Files due for upload, marked as active. """
+        with self.lock:
+            rows = self.db.execute("SELECT path FROM files WHERE state=? AND nextTry<=? ORDER BY added LIMIT ?",
+                                   (S_QUEUED, time.time(), limit)).fetchall()
+            paths = [row[0] for row in rows]
+            self.db.executemany("UPDATE files SET state=? WHERE path=?", ((S_ACTIVE, p) for p in paths))
+            self.db.commit()
+            return paths
+
+    def get(self, filePath):
+        with self.lock:
+            return self.db.execute("SELECT sha256, uploadId FROM files WHERE path=?", (filePath,)).fetchone()
+
+    def uploadedCopy(self, sha256, filePath):
+        """ Another file with this content that is on the storage already. """
+        with self.lock:
+            row = self.db.execute("SELECT path FROM files WHERE sha256=? AND state IN (?, ?) AND path!=? LIMIT 1",
+                                  (sha256, S_DONE, S_COPIED, filePath)).fetchone()
+            return row[0] if row else None
+
+    def startMultipart(self, filePath, sha256, uploadId):
+        with self.lock:
+            self.db.execute("UPDATE files SET sha256=?, uploadId=? WHERE path=?", (sha256, uploadId, filePath))
+            self.db.execute("DELETE FROM parts WHERE path=?", (filePath,))
+            self.db.commit()
+
+    def parts(self, filePath):
+        with self.lock:
+            rows = self.db.execute("SELECT number, etag FROM parts WHERE path=?", (filePath,)).fetchall()
+            return dict(rows)
+
+    def partDone(self, filePath, number, etag):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO parts (path, number, etag) VALUES (?, ?, ?)",
+                            (filePath, number, etag))
+            self.db.commit()
+
+    def finish(self, filePath, state, sha256=None):
+        with self.lock:
+            self.db.execute("UPDATE files SET state=?, sha256=?, uploadId=NULL WHERE path=?",
+                            (state, sha256, filePath))
+            self.db.execute("DELETE FROM parts WHERE path=?", (filePath,))
+            self.db.commit()
+
+    def failed(self, filePath):
+        with self.lock:
+            attempts = self.db.execute("SELECT attempts FROM files WHERE path=?", (filePath,)).fetchone()[0]
+            delay = RETRY_SECONDS[min(attempts, len(RETRY_SECONDS) - 1)]
+            self.db.execute("UPDATE files SET state=?, attempts=?, nextTry=? WHERE path=?",
+                            (S_QUEUED, attempts + 1, time.time() + delay, filePath))
+            self.db.commit()
+
+    def pending(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM files WHERE state IN (?, ?)",
+                                   (S_QUEUED, S_ACTIVE)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class Uploader():
+    """ Sends the queued files with a few threads, in the upload process. """
+    def __init__(self, client, target, database, workers=UPLOAD_WORKERS):
+        self.client = client
+        self.bucket = target['bucket']
+        self.prefix = target.get('prefix', "")
+        self.database = database
+        self.bandwidth = TokenBucket(target.get('rate', UPLOAD_RATE))
+        self.jobs = Queue.Queue()
+        self.stopEvent = threading.Event()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.work, name="upload{0}".format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def key(self, filePath):
+        return self.prefix + os.path.normpath(filePath).replace(os.sep, "/")
+
+    def schedule(self):
+        """ Hand due files to idle threads, at most one ahead per thread. """
+        free = 2 * len(self.threads) - self.jobs.unfinished_tasks
+        if free > 0:
+            for filePath in self.database.take(free):
+                self.jobs.put(filePath)
+
+    def idle(self):
+        return self.jobs.unfinished_tasks == 0
+
+    def work(self):
+        while not self.stopEvent.is_set():
+            try:
+                filePath = self.jobs.get(timeout=1.0)
+            except Queue.Empty:
+                continue
+            try:
+                self.upload(filePath)
+            except Exception as e:
+                # network, storage or disk: try again later
+                print "upload of '{0}' failed: {1}".format(filePath, e)
+                self.database.failed(filePath)
+            finally:
+                self.jobs.task_done()
+
+    def upload(self, filePath):
+        # may still be in RAM (the process is started after the staging)
+        source = STAGING.resolve(filePath)
+        if not os.path.isfile(source):
+            self.database.finish(filePath, S_MISSING)
+            return
+        sha256 = fileHash(source)
+        key = self.key(filePath)
+
+        # the same content is on the storage already: copy it there
+        copyOf = self.database.uploadedCopy(sha256, filePath)
+        if copyOf is not None:
+            self.client.copy_object(Bucket=self.bucket, Key=key, MetadataDirective='COPY',
+                                    CopySource={'Bucket': self.bucket, 'Key': self.key(copyOf)})
+            self.database.finish(filePath, S_COPIED, sha256)
+            return
+        if self.remoteHash(key) == sha256:
+            self.database.finish(filePath, S_DONE, sha256)
+            return
+
+        start = time.time()
+        size = os.path.getsize(source)
+        if size < MULTIPART_THRESHOLD:
+            with open(source, 'rb') as f:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=ThrottledPart(f, 0, size, self.bandwidth),
+                                       ContentLength=size, Metadata={'sha256': sha256})
+        elif not self.uploadMultipart(filePath, source, key, sha256, size):
+            # stopped, the missing parts follow at the next start
+            return
+        self.database.finish(filePath, S_DONE, sha256)
+        print "uploaded '{0}' ({1:.1f} MB in {2:.1f} s)".format(filePath, size / 1024.0**2, time.time() - start)
+
+    def remoteHash(self, key):
+        """ The content of the object if it exists, e.g. from an earlier run. """
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception:
+            return None
+        return head.get('Metadata', {}).get('sha256')
+
+    def uploadMultipart(self, filePath, source, key, sha256, size):
+        """ Send the missing parts; False if stopped in between. """
+        known, uploadId = self.database.get(filePath)
+        if uploadId is not None and known != sha256:
+            # the file changed since the upload started
+            self.abortMultipart(key, uploadId)
+            uploadId = None
+        if uploadId is None:
+            uploadId = self.client.create_multipart_upload(Bucket=self.bucket, Key=key,
+                                                           Metadata={'sha256': sha256})['UploadId']
+            self.database.startMultipart(filePath, sha256, uploadId)
+
+        # parts sent before a restart are skipped
+        etags = self.database.parts(filePath)
+        count = (size + PART_SIZE - 1) // PART_SIZE
+        with open(source, 'rb') as f:
+            for number in range(1, count + 1):
+                if number in etags:
+                    continue
+                if self.stopEvent.is_set():
+                    return False
+                offset = (number - 1) * PART_SIZE
+                length = min(PART_SIZE, size - offset)
+                try:
+                    response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=uploadId,
+                                                       PartNumber=number, ContentLength=length,
+                                                       Body=ThrottledPart(f, offset, length, self.bandwidth))
+                except Exception as e:
+                    if 'NoSuchUpload' in str(e):
+                        # expired or cleaned up on the storage, start over
+                        self.database.startMultipart(filePath, None, None)
+                    raise
+                etags[number] = response['ETag']
+                self.database.partDone(filePath, number, response['ETag'])
+
+        parts = [{'PartNumber': n, 'ETag': etags[n]} for n in sorted(etags)]
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=uploadId,
+                                              MultipartUpload={'Parts': parts})
+        return True
+
+    def abortMultipart(self, key, uploadId):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=uploadId)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.stopEvent.set()
+        for thread in self.threads:
+            thread.join(1.0)
+
+
+def scanFolders(folders):
+    """ All finished files in the folders, e.g. taken while the uploader was off. """
+    filePaths = []
+    for folder in folders:
+        for path, dirs, files in os.walk(folder):
+            dirs.sort()
+            filePaths.extend(os.path.join(path, f) for f in sorted(files)
+                             if not f.startswith(".") and not f.endswith(TEMP_SUFFIX))
+    return filePaths
+
+
+def createClient(target):
+    # only needed in the upload process, the booth runs without boto3
+    import boto3
+    return boto3.client('s3', endpoint_url=target.get('endpoint'), region_name=target.get('region'),
+                        aws_access_key_id=target.get('accessKey'),
+                        aws_secret_access_key=target.get('secretKey'))
+
+
+def readPaths(stream):
+    """ A queue of the paths read line by line from stream, None at its end. """
+    paths = Queue.Queue()
+    def read():
+        for line in iter(stream.readline, ""):
+            if line.strip():
+                paths.put(line.rstrip("\n"))
+        paths.put(None)
+    thread = threading.Thread(target=read, name="uploadPaths")
+    thread.daemon = True
+    thread.start()
+    return paths
+
+
+def uploaderMain(target, paths=None, dbPath=UPLOAD_DB, folders=UPLOAD_FOLDERS, untilDone=False):
+    """ The upload process: paths of new files come in through the queue. """
+    if not setIdlePriority():
+        print "uploader: idle disk priority not available"
+    database = UploadDatabase(dbPath)
+    database.add(scanFolders(folders))
+    uploader = Uploader(createClient(target), target, database)
+    try:
+        while True:
+            uploader.schedule()
+            if untilDone and uploader.idle() and database.pending() == 0:
+                break
+            if paths is None:
+                time.sleep(1.0 if untilDone else POLL_SECONDS)
+                continue
+            try:
+                filePath = paths.get(timeout=POLL_SECONDS)
+            except Queue.Empty:
+                continue
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if filePath is None:
+                break
+            if not database.add([filePath]):
+                database.requeue(filePath)
+    finally:
+        uploader.stop()
+        database.close()
+
+
+class UploadQueue():
+    """ The uploader in a separate process, started and stopped with the booth. """
+    def __init__(self, target, dbPath=UPLOAD_DB, folders=UPLOAD_FOLDERS):
+        self.target = target
+        self.dbPath = dbPath
+        self.folders = folders
+        self.process = None
+
+    def start(self):
+        # a fresh interpreter: forking the running booth is not safe on macOS
+        script = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        command = [sys.executable, script, "--stdin", "--bucket", self.target['bucket'],
+                   "--prefix", self.target.get('prefix', ""), "--db", self.dbPath,
+                   "--rate", str(max(self.target.get('rate', UPLOAD_RATE) // 1024, 1))]
+        for option in ('endpoint', 'region'):
+            if self.target.get(option):
+                command += ["--" + option, self.target[option]]
+        command += ["--staging", STAGING.root or ""]
+        # the keys stay out of the command line
+        env = dict(os.environ)
+        if self.target.get('accessKey'):
+            env['AWS_ACCESS_KEY_ID'] = self.target['accessKey']
+        if self.target.get('secretKey'):
+            env['AWS_SECRET_ACCESS_KEY'] = self.target['secretKey']
+        self.process = subprocess.Popen(command + self.folders, stdin=subprocess.PIPE, env=env)
+
+    def add(self, filePath):
+        """ Queue a finished file, returns right away. """
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            self.process.stdin.write(filePath + "\n")
+            self.process.stdin.flush()
+        except IOError as e:
+            # found by the folder scan at the next start
+            print "uploader not reachable: {0}".format(e)
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        # unfinished uploads continue at the next start
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        deadline = time.time() + 2.0
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload the pictures of the booth to an S3 compatible storage.")
+    parser.add_argument("--endpoint", help="e.g. http://192.168.1.2:9000 (default: AWS)")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="", help="put in front of every key, e.g. hochzeit/")
+    parser.add_argument("--region")
+    parser.add_argument("--rate", type=int, default=UPLOAD_RATE / 1024,
+                        help="bandwidth in kB/s (default: {0})".format(UPLOAD_RATE / 1024))
+    parser.add_argument("--db", default=UPLOAD_DB, help="queue file (default: {0})".format(UPLOAD_DB))
+    parser.add_argument("--staging", default=STAGING_PATH,
+                        help="staging folder of the booth (default: {0})".format(STAGING_PATH))
+    parser.add_argument("--stdin", action="store_true",
+                        help="keep running and read the paths of new files from stdin (used by the booth)")
+    parser.add_argument("folders", nargs="*", default=UPLOAD_FOLDERS,
+                        help="folders to upload (default: {0})".format(" ".join(UPLOAD_FOLDERS)))
+    args = parser.parse_args()
+    # access keys come from the environment or ~/.aws/credentials
+    target = {'endpoint': args.endpoint, 'bucket': args.bucket, 'prefix': args.prefix,
+              'region': args.region, 'rate': args.rate * 1024}
+    STAGING.attach(args.staging)
+    paths = readPaths(sys.stdin) if args.stdin else None
+    try:
+        uploaderMain(target, paths, dbPath=args.db, folders=args.folders, untilDone=not args.stdin)
+    except KeyboardInterrupt:
+        pass